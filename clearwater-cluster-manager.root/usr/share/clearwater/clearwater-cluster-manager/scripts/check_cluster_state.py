@@ -6,31 +6,30 @@
 # Metaswitch Networks in a separate written agreement.
 
 import sys
-import etcd
 import json
 import os
+from metaswitch.clearwater.etcd_shared.bulk_read import read_all
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 
 mgmt_node = sys.argv[1]
 local_node_ip = sys.argv[2]
 local_site = sys.argv[3]
 sites = sys.argv[4]
 
-client = etcd.Client(mgmt_node, 4000)
+client = EtcdV2Client(mgmt_node, 4000)
 
 
 def describe_clusters():
     """This function returns the the number of unstable clusters it is
      checking """
-    # Pull out all the clearwater keys.
-    key = "/?recursive=True"
-
-    try:
-        result = client.get(key)
-    except etcd.EtcdKeyNotFound:
+    # Pull out all the clearwater keys - there's no need to read the rest of
+    # the store.
+    values, _ = read_all(client, "/clearwater")
+    if not values:
         # There's no clearwater keys yet
         return
 
-    cluster_values = {subkey.key: subkey.value for subkey in result.leaves}
+    cluster_values = {key: value for key, (value, _) in values.items()}
 
     local_site_info = ""
     if sites != "" and local_site != sites:
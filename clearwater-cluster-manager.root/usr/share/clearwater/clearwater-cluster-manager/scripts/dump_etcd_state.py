@@ -6,10 +6,10 @@
 # Metaswitch Networks in a separate written agreement.
 
 import sys
-import etcd
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 
 local_ip = sys.argv[1]
 key = sys.argv[2]
 
-c = etcd.Client(local_ip, 4000)
+c = EtcdV2Client(local_ip, 4000)
 print c.get(key).value
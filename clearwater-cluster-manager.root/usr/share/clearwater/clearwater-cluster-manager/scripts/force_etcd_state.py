@@ -6,7 +6,7 @@
 # Metaswitch Networks in a separate written agreement.
 
 import sys
-import etcd
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 
 local_ip = sys.argv[1]
 key = sys.argv[2]
@@ -15,7 +15,7 @@ data = ""
 with open(json_file) as f:
     data = f.read()
 
-c = etcd.Client(local_ip, 4000)
+c = EtcdV2Client(local_ip, 4000)
 old =  c.get(key).value
 
 print "Replacing old data %s with new data %s" % (old, data)
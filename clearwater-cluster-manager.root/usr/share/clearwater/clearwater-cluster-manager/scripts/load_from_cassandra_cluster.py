@@ -8,7 +8,7 @@
 import os
 import subprocess
 import sys
-import etcd
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 import yaml
 import json
 
@@ -38,7 +38,7 @@ try:
 
     print "Inserting data %s into etcd key %s" % (data, etcd_key)
 
-    c = etcd.Client(local_ip, 4000)
+    c = EtcdV2Client(local_ip, 4000)
     new = c.write(etcd_key, data).value
 
     if new == data:
@@ -9,7 +9,7 @@
 # Metaswitch Networks in a separate written agreement.
 
 import sys
-import etcd
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 import json
 import os
 
@@ -41,7 +41,7 @@ with open('/etc/chronos/chronos_cluster.conf') as f:
 
 print "Inserting data %s into etcd key %s" % (data, etcd_key)
 
-c = etcd.Client(local_ip, 4000)
+c = EtcdV2Client(local_ip, 4000)
 new = c.write(etcd_key, data).value
 
 if new == data:
@@ -6,7 +6,7 @@
 # Metaswitch Networks in a separate written agreement.
 
 import sys
-import etcd
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 import json
 import os
 
@@ -29,7 +29,7 @@ remote_etcd_key = "/{}/{}/{}/clustering/memcached".format(etcd_key,
 def strip_port(server):
     return server.rsplit(":", 1)[0].strip()
 
-c = etcd.Client(local_ip, 4000)
+c = EtcdV2Client(local_ip, 4000)
 
 
 def load_file_into_etcd(filename, etcd_key):
@@ -7,7 +7,7 @@
 
 import os
 from os import sys
-import etcd
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 import logging
 import time
 from metaswitch.clearwater.cluster_manager.cluster_state import \
@@ -84,7 +84,7 @@ error_syncer.thread.join()
 
 print "Process complete - %s has left the cluster" % dead_node_ip
 
-c = etcd.Client(etcd_ip, 4000)
+c = EtcdV2Client(etcd_ip, 4000)
 new_state = c.get(key).value
 
 _log.info("New etcd state (after removing %s) is %s" % (dead_node_ip, new_state))
@@ -5,49 +5,41 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
-import json
-import subprocess
+import etcd
 import sys
-
-
-# Gets the value from etcd for the given key
-def get_value(key):
-    stored_value = subprocess.check_output(["clearwater-etcdctl", "get", key])
-    return stored_value.strip()
+from metaswitch.clearwater.etcd_shared.bulk_read import read_all
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 
 
 # Start
 
-old_node_type = sys.argv[1]
-new_node_type = sys.argv[2]
-storage_type = sys.argv[3]
+etcd_ip = sys.argv[1]
+old_node_type = sys.argv[2]
+new_node_type = sys.argv[3]
+storage_type = sys.argv[4]
 
 print("Copying cluster information for {0} on {1} to {2}".format(storage_type,
                                                                  old_node_type,
                                                                  new_node_type))
 
 try:
-    # List all keys stored in etcd
-    # -p appends a "/" to all directories to help distinguish them from keys
-    output_str = subprocess.check_output(["clearwater-etcdctl", "ls", "-p", "--recursive"])
+    # Read all keys stored in etcd
+    client = EtcdV2Client(etcd_ip, 4000)
+    values, _ = read_all(client)
     new_data = {}
 
-    for line in output_str.splitlines():
-        line = line.strip()
-
+    for key, (value, _) in values.iteritems():
         # Only need to rename keys containing the old node name for this storage type
-        if (line.endswith("/{0}".format(storage_type))) and ("/{0}/".format(old_node_type) in line):
-            value = get_value(line)
-            new_key = line.replace("/{0}/".format(old_node_type), "/{0}/".format(new_node_type))
+        if (key.endswith("/{0}".format(storage_type))) and ("/{0}/".format(old_node_type) in key):
+            new_key = key.replace("/{0}/".format(old_node_type), "/{0}/".format(new_node_type))
             new_data[new_key] = value
 
     # Add the new key-value pairs
     for key, value in new_data.iteritems():
-        subprocess.check_output(["clearwater-etcdctl", "set", key, value])
+        client.write(key, value)
 
     print("Done")
 
-except subprocess.CalledProcessError, e:
+except etcd.EtcdException, e:
     print("ERROR: Unable to contact etcd.")
     print("ERROR: Confirm etcd is running and try again.")
-
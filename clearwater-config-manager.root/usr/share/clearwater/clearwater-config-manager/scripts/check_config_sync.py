@@ -9,26 +9,34 @@
 
 from metaswitch.clearwater.etcd_shared.plugin_loader import load_plugins_in_dir
 from metaswitch.clearwater.config_manager.plugin_base import FileStatus
-import etcd
+from metaswitch.clearwater.etcd_shared.value_codec import decode_value
 import os
 import sys
+from metaswitch.clearwater.etcd_shared.bulk_read import read_all
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 
 etcd_ip = sys.argv[1]
 site = sys.argv[2]
 etcd_key = sys.argv[3]
 
-client = etcd.Client(etcd_ip, 4000)
+client = EtcdV2Client(etcd_ip, 4000)
 
 plugins_dir = "/usr/share/clearwater/clearwater-config-manager/plugins/"
 plugins = load_plugins_in_dir(plugins_dir)
 
+
+def config_key(plugin):
+    return "/" + etcd_key + "/" + site + "/configuration/" + plugin.key()
+
+# Read all the config in one request.
+values, _ = read_all(client, keys=[config_key(plugin) for plugin in plugins])
+
 rc = 0
 
 for plugin in plugins:
-    try:
-        result = client.get("/" + etcd_key + "/" + site + "/configuration/" + plugin.key())
-        value = result.value
-    except etcd.EtcdKeyNotFound:
+    if config_key(plugin) in values:
+        value = decode_value(values[config_key(plugin)][0])
+    else:
         value = ""
 
     state = plugin.status(value)
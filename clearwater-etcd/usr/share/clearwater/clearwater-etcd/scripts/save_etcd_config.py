@@ -6,16 +6,13 @@
 # Metaswitch Networks in a separate written agreement.
 
 import datetime
+import etcd
 import json
 import re
 import subprocess
 import sys
-
-
-# Gets the value from etcd for the given key
-def get_value(key):
-    stored_value = subprocess.check_output(["clearwater-etcdctl", "get", key])
-    return stored_value.strip()
+from metaswitch.clearwater.etcd_shared.bulk_read import read_all
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 
 
 # Save the config
@@ -64,7 +61,8 @@ def get_local_cassandra_nodes(site_name):
 
 # Start
 
-local_site_name = sys.argv[1]
+etcd_ip = sys.argv[1]
+local_site_name = sys.argv[2]
 
 # Allow the user to specify the save location
 save_dir = raw_input("Enter the directory to save the config. Leave blank for default (/home/clearwater/ftp/) ")
@@ -80,21 +78,16 @@ filename = save_dir + "saved-etcd-config-" + datetime.datetime.now().strftime('%
 print("Saving etcd cluster info to {0}\n".format(filename))
 
 try:
-    # List all keys stored in etcd
-    # -p appends a "/" to all directories to help distinguish them from keys
-    output_str = subprocess.check_output(["clearwater-etcdctl", "ls", "-p", "--recursive"])
+    # Read all keys stored in etcd
+    values, _ = read_all(EtcdV2Client(etcd_ip, 4000))
 
     # Dictionary that will contain all the key-value pairs that we want to save
     data_to_save = {}
 
     # First, save all keys that contain the local site name
-    for line in output_str.splitlines():
-        line = line.strip()
-
-        # Save any keys that contain the local site name
-        if (not line.endswith("/")) and ("/{0}/".format(local_site_name) in line):
-            value = get_value(line)
-            data_to_save[line] = value
+    for key, (value, _) in values.iteritems():
+        if "/{0}/".format(local_site_name) in key:
+            data_to_save[key] = value
 
     # Now we need to add the homestead cassandra clustering info, but we only
     # want to add the nodes for the local site, so we build this manually
@@ -106,7 +99,7 @@ try:
 
     print("Saved etcd cluster info to disk")
 
-except subprocess.CalledProcessError, e:
+except etcd.EtcdException, e:
     print("ERROR: Unable to contact etcd.")
     print("ERROR: Confirm etcd is running and try again.")
 
@@ -8,12 +8,13 @@
 import sys
 import etcd
 import json
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 
 mgmt_node = sys.argv[1]
 local_site = sys.argv[2]
 queue_key = sys.argv[3]
 
-client = etcd.Client(mgmt_node, 4000)
+client = EtcdV2Client(mgmt_node, 4000)
 
 def describe_queue_state():
     print "Describing the current queue state for {}".format(queue_key)
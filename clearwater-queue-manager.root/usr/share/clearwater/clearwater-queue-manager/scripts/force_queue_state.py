@@ -5,18 +5,18 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
-import etcd
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 import sys
 
 mgmt_node = sys.argv[1]
 local_site = sys.argv[2]
 queue_key = sys.argv[3]
 
-client = etcd.Client(mgmt_node, 4000)
+client = EtcdV2Client(mgmt_node, 4000)
 key = "/clearwater/{}/configuration/{}".format(local_site, queue_key)
 default_value = "{\"ERRORED\": [], \"FORCE\": false, \"COMPLETED\": [], \"QUEUED\": []}"
 
-c = etcd.Client(mgmt_node, 4000)
+c = EtcdV2Client(mgmt_node, 4000)
 old = c.get(key).value
 
 print "Replacing old data %s with new data %s" % (old, default_value)
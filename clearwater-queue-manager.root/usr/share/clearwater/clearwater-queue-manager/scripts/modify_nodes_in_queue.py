@@ -6,7 +6,7 @@
 # Metaswitch Networks in a separate written agreement.
 
 from os import sys, umask
-import etcd
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 import logging
 from metaswitch.clearwater.queue_manager.etcd_synchronizer import EtcdSynchronizer, WriteToEtcdStatus
 from metaswitch.clearwater.queue_manager.null_plugin import NullPlugin
@@ -79,7 +79,7 @@ elif operation == "force_false":
 else:
     _log.debug("Invalid operation requested")
 
-c = etcd.Client(local_ip, 4000)
+c = EtcdV2Client(local_ip, 4000)
 key = make_key(site, clearwater_key, queue_key)
 queue = c.get(key).value
 _log.info("New etcd state is %s" % (queue))
@@ -14,9 +14,10 @@
 
 
 import logging
-from threading import Thread, Condition
+from threading import Lock
 from .alarm_constants import TOO_LONG_CLUSTERING
 from metaswitch.common.alarms import alarm_manager
+from metaswitch.clearwater.etcd_shared.event_loop import get_event_loop
 
 _log = logging.getLogger("cluster_manager.alarms")
 
@@ -24,44 +25,47 @@ ALARM_ISSUER_NAME = "cluster-manager"
 
 
 class TooLongAlarm(object):
+    # The alarm's timer is scheduled on the process's shared event loop, and
+    # raising the alarm (which may block talking to the SNMP agent) runs on
+    # the loop's executor.
     def __init__(self, delay=(15*60)):
-        self._condition = Condition()
-        self._timer_thread = None
+        self._lock = Lock()
+        self._timer = None
         self._should_alarm = False
         self._alarm = alarm_manager.get_alarm(ALARM_ISSUER_NAME,
                                               TOO_LONG_CLUSTERING)
         self._delay = delay
 
     def alarm(self):
-        with self._condition:
-            self._condition.wait(self._delay)
+        with self._lock:
             if self._should_alarm:
                 _log.info("Raising TOO_LONG_CLUSTERING alarm")
-                self._alarm.set()
+                get_event_loop().run_in_executor(self._alarm.set)
 
     def trigger(self, thread_name="Alarm thread"):
-        self._should_alarm = True
-        if self._timer_thread is None:
-            _log.debug("TOO_LONG_CLUSTERING alarm triggered, will fire in {} seconds".format(self._delay))
-            self._timer_thread = Thread(target=self.alarm, name=thread_name)
-            self._timer_thread.start()
+        with self._lock:
+            self._should_alarm = True
+            if self._timer is None:
+                _log.debug("TOO_LONG_CLUSTERING alarm triggered, will fire in {} seconds".format(self._delay))
+                self._timer = get_event_loop().call_later(self._delay,
+                                                          self.alarm)
 
     def quit(self):
-        if self._timer_thread is not None:
-            self._should_alarm = False
-            _log.info("TOO_LONG_CLUSTERING alarm cancelled when quitting")
-            with self._condition:
-                self._condition.notify()
-            self._timer_thread.join()
+        with self._lock:
+            if self._timer is not None:
+                self._should_alarm = False
+                _log.info("TOO_LONG_CLUSTERING alarm cancelled when quitting")
+                self._timer.cancel()
 
     def cancel(self):
-        with self._condition:
+        with self._lock:
             self._should_alarm = False
             _log.info("TOO_LONG_CLUSTERING alarm cancelled")
 
-            # cancel the thread
-            self._condition.notify()
-            self._timer_thread = None
+            # cancel the timer
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
 
             # clear the alarm
             self._alarm.clear()
@@ -7,19 +7,121 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
-import json
-from collections import defaultdict
-
 import constants
 import logging
+from metaswitch.clearwater.etcd_shared.value_cache import value_cache
 
 _log = logging.getLogger(__name__)
 
+# The node states that the cluster state depends on, other than ERROR. Each
+# gets a bit in the mask of which states are present in the cluster; any state
+# not listed here (which only an invalid cluster has) shares the OTHER bit.
+_KNOWN_STATES = [constants.NORMAL,
+                 constants.WAITING_TO_JOIN,
+                 constants.JOINING,
+                 constants.JOINING_ACKNOWLEDGED_CHANGE,
+                 constants.JOINING_CONFIG_CHANGED,
+                 constants.NORMAL_ACKNOWLEDGED_CHANGE,
+                 constants.NORMAL_CONFIG_CHANGED,
+                 constants.WAITING_TO_LEAVE,
+                 constants.LEAVING,
+                 constants.LEAVING_ACKNOWLEDGED_CHANGE,
+                 constants.LEAVING_CONFIG_CHANGED,
+                 constants.FINISHED]
+_STATE_BITS = {state: 1 << i for i, state in enumerate(_KNOWN_STATES)}
+_OTHER_BIT = 1 << len(_KNOWN_STATES)
+
+
+def _mask(states):
+    mask = 0
+    for state in states:
+        mask |= _STATE_BITS[state]
+    return mask
+
+
+# The allowed combinations of node states for each transitional cluster
+# state, in the order they're checked. The cluster is in that state if at
+# least one (non-ERROR) node is in one of the "one or more" states, and every
+# (non-ERROR) node is in one of the "one or more" or "zero or more" states.
+# Each is held as (cluster state, mask of "one or more" states, mask of all
+# the allowed states).
+_STATE_CHECKS = [
+    (cluster_state, _mask(one_or_more), _mask(one_or_more + zero_or_more))
+    for cluster_state, one_or_more, zero_or_more in [
+        (constants.JOIN_PENDING,
+         [constants.NORMAL, constants.WAITING_TO_JOIN],
+         []),
+        (constants.STARTED_JOINING,
+         [constants.NORMAL, constants.JOINING],
+         [constants.NORMAL_ACKNOWLEDGED_CHANGE,
+          constants.JOINING_ACKNOWLEDGED_CHANGE]),
+        (constants.JOINING_CONFIG_CHANGING,
+         [constants.NORMAL_ACKNOWLEDGED_CHANGE,
+          constants.JOINING_ACKNOWLEDGED_CHANGE],
+         [constants.NORMAL_CONFIG_CHANGED, constants.JOINING_CONFIG_CHANGED]),
+        (constants.JOINING_RESYNCING,
+         [constants.NORMAL_CONFIG_CHANGED, constants.JOINING_CONFIG_CHANGED],
+         [constants.NORMAL]),
+        (constants.LEAVE_PENDING,
+         [constants.NORMAL, constants.WAITING_TO_LEAVE],
+         []),
+        (constants.STARTED_LEAVING,
+         [constants.NORMAL, constants.LEAVING],
+         [constants.NORMAL_ACKNOWLEDGED_CHANGE,
+          constants.LEAVING_ACKNOWLEDGED_CHANGE]),
+        (constants.LEAVING_CONFIG_CHANGING,
+         [constants.NORMAL_ACKNOWLEDGED_CHANGE,
+          constants.LEAVING_ACKNOWLEDGED_CHANGE],
+         [constants.NORMAL_CONFIG_CHANGED, constants.LEAVING_CONFIG_CHANGED]),
+        (constants.LEAVING_RESYNCING,
+         [constants.NORMAL_CONFIG_CHANGED, constants.LEAVING_CONFIG_CHANGED],
+         [constants.NORMAL, constants.FINISHED]),
+        (constants.FINISHED_LEAVING,
+         [constants.NORMAL, constants.FINISHED],
+         []),
+    ]]
+
+
+def _classify(present, has_errors):
+    # Works out the cluster state from the mask of (non-ERROR) node states
+    # present in the cluster, and whether any nodes are in ERROR state.
+    if present == 0:
+        return constants.STABLE_WITH_ERRORS if has_errors else constants.EMPTY
+    elif present == _STATE_BITS[constants.NORMAL]:
+        return constants.STABLE_WITH_ERRORS if has_errors else constants.STABLE
+
+    for cluster_state, one_or_more, allowed in _STATE_CHECKS:
+        if present & one_or_more and not present & ~allowed:
+            return cluster_state
+
+    # Cluster in unexpected state.
+    return constants.INVALID_CLUSTER_STATE
+
+
+# The cluster state for each combination of node states that we've seen,
+# indexed by (mask of states present, whether any nodes are in ERROR state).
+# Only a few of the possible combinations ever turn up, so this is filled in
+# as they do.
+_cluster_states = {}
+
+
+def _lookup_cluster_state(present, has_errors):
+    try:
+        return _cluster_states[(present, has_errors)]
+    except KeyError:
+        cluster_state = _classify(present, has_errors)
+        _cluster_states[(present, has_errors)] = cluster_state
+        return cluster_state
+
+
 class ClusterInfo(object):
-    def __init__(self, value):
+    # If key and index (the modifiedIndex of the value) are given, the parsed
+    # view is shared with anyone else who's parsed that revision of the key.
+    # Either way, the view is immutable.
+    def __init__(self, value, key=None, index=None):
         self.view = {}
         try:
-            self.view = json.loads(value)
+            self.view = value_cache.decode(key, index, value)
         except: # pragma : no cover
             pass
 
@@ -35,82 +137,12 @@ class ClusterInfo(object):
     # Calculate the state of the cluster based on the state of all the nodes in
     # the cluster.
     def calculate_cluster_state(self, cluster_view):
-        # Create a default dictionary. The default value of any key is 0.
-        node_state_counts = defaultdict(int)
-        node_states = cluster_view.values()
-        node_count = 0
-        error_count = 0
-
-        # Count the number of nodes in each state. This will make working out
-        # the state of the cluster below easier.
-        for state in node_states:
-            node_state_counts[state] += 1
-
-            # Count the total number of nodes in the cluster. Ignore nodes in
-            # ERROR state.
+        states = set(cluster_view.itervalues())
+        present = 0
+        for state in states:
             if state != constants.ERROR:
-                node_count += 1
-            else:
-                error_count += 1
-
-        # Checks the contents of node_states: returns True if
-        # - at least one node is in one of the states in oneOrMore, and
-        # - all nodes are in one of the states on oneOrMore, zeroOrMore, or
-        #   ERROR
-        def state_check(zeroOrMore=None, oneOrMore=None):
-            if not zeroOrMore:
-                zeroOrMore = []
-            if not oneOrMore: # pragma: no cover
-                oneOrMore = []
-
-            states_to_sum = zeroOrMore + oneOrMore
-
-            total = sum([node_state_counts[i] for i in states_to_sum])
-            has_minimum = sum([node_state_counts[i] for i in oneOrMore]) > 0
-
-            return has_minimum and (total == node_count)
-
-        if node_count == 0 and error_count == 0:
-            return constants.EMPTY
-        elif node_state_counts[constants.NORMAL] == node_count and error_count == 0:
-            return constants.STABLE
-        elif node_state_counts[constants.NORMAL] == node_count:
-            return constants.STABLE_WITH_ERRORS
-        elif state_check(oneOrMore=[constants.NORMAL, constants.WAITING_TO_JOIN]):
-            return constants.JOIN_PENDING
-        elif state_check(oneOrMore=[constants.NORMAL, constants.JOINING],
-                         zeroOrMore=[constants.NORMAL_ACKNOWLEDGED_CHANGE,
-                                     constants.JOINING_ACKNOWLEDGED_CHANGE]):
-            return constants.STARTED_JOINING
-        elif state_check(oneOrMore=[constants.NORMAL_ACKNOWLEDGED_CHANGE,
-                                    constants.JOINING_ACKNOWLEDGED_CHANGE],
-                         zeroOrMore=[constants.NORMAL_CONFIG_CHANGED,
-                                     constants.JOINING_CONFIG_CHANGED]):
-            return constants.JOINING_CONFIG_CHANGING
-        elif state_check(oneOrMore=[constants.NORMAL_CONFIG_CHANGED,
-                                    constants.JOINING_CONFIG_CHANGED],
-                         zeroOrMore=[constants.NORMAL]):
-            return constants.JOINING_RESYNCING
-        elif state_check(oneOrMore=[constants.NORMAL, constants.WAITING_TO_LEAVE]):
-            return constants.LEAVE_PENDING
-        elif state_check(oneOrMore=[constants.NORMAL, constants.LEAVING],
-                         zeroOrMore=[constants.NORMAL_ACKNOWLEDGED_CHANGE,
-                                     constants.LEAVING_ACKNOWLEDGED_CHANGE]):
-            return constants.STARTED_LEAVING
-        elif state_check(oneOrMore=[constants.NORMAL_ACKNOWLEDGED_CHANGE,
-                                    constants.LEAVING_ACKNOWLEDGED_CHANGE],
-                         zeroOrMore=[constants.NORMAL_CONFIG_CHANGED,
-                                     constants.LEAVING_CONFIG_CHANGED]):
-            return constants.LEAVING_CONFIG_CHANGING
-        elif state_check(oneOrMore=[constants.NORMAL_CONFIG_CHANGED,
-                                    constants.LEAVING_CONFIG_CHANGED],
-                         zeroOrMore=[constants.NORMAL, constants.FINISHED]):
-            return constants.LEAVING_RESYNCING
-        elif state_check(oneOrMore=[constants.NORMAL, constants.FINISHED]):
-            return constants.FINISHED_LEAVING
-        else:
-            # Cluster in unexpected state.
-            return constants.INVALID_CLUSTER_STATE
+                present |= _STATE_BITS.get(state, _OTHER_BIT)
+        return _lookup_cluster_state(present, constants.ERROR in states)
 
     # Returns the local node's state in the cluster, and None if the local node
     # is not in the cluster.
@@ -7,12 +7,14 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
-import json
 
 import constants
 from .synchronization_fsm import SyncFSM
-from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import CommonEtcdSynchronizer
+from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import \
+    CommonEtcdSynchronizer, ReadConsistency
 from .cluster_state import ClusterInfo
+from metaswitch.clearwater.etcd_shared.value_cache import encode, thaw
+from metaswitch.clearwater.etcd_shared.value_log import ValueSummary
 import logging
 from etcd import EtcdAlreadyExist
 
@@ -20,6 +22,15 @@ _log = logging.getLogger(__name__)
 
 
 class EtcdSynchronizer(CommonEtcdSynchronizer):
+    # During scaling operations the cluster changes many times in quick
+    # succession as each node moves on. Only the latest view matters, so
+    # collect changes for a moment before running the state machine.
+    COALESCING_WINDOW = 0.2
+
+    # Every node reacts to each of those changes, so spread their writes out
+    # rather than have them all contend for the key at once.
+    REACTION_JITTER = 0.5
+
     def __init__(self, plugin, ip, etcd_ip=None, force_leave=False):
         super(EtcdSynchronizer, self).__init__(plugin, ip, etcd_ip)
         self._fsm = SyncFSM(self._plugin, self._ip)
@@ -44,8 +55,10 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
             if self._terminate_flag:
                 break
             if etcd_value is not None:
-                _log.info("Got new state %s from etcd" % etcd_value)
-                cluster_info = ClusterInfo(etcd_value)
+                _log.info("Got new state (%s) from etcd",
+                          ValueSummary(self.key(), self._index, etcd_value))
+                self._full_value_log.log(self.key(), self._index, etcd_value)
+                cluster_info = ClusterInfo(etcd_value, self.key(), self._index)
 
                 # This node can only leave the cluster if the cluster is in a
                 # stable state. Also check that we've both requested to leave
@@ -60,13 +73,17 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
                     _log.info("Cluster is in a stable state, so leaving the cluster now")
                     new_state = constants.WAITING_TO_LEAVE
                 else:
-                    new_state = self._fsm.next(cluster_info.local_state(self._ip),
-                                               cluster_info.cluster_state,
-                                               cluster_info.view)
+                    new_state = self._fsm.next(
+                        cluster_info.local_state(self._ip),
+                        cluster_info.cluster_state,
+                        cluster_info.view,
+                        already_handled=self.already_handled(cluster_info))
 
-                # If we have a new state, try and write it to etcd.
+                # If we have a new state, try and write it to etcd - after
+                # our reaction delay, so that every node in the deployment
+                # doesn't write at once.
                 if new_state is not None:
-                    self.write_to_etcd(cluster_info, new_state)
+                    self.react(cluster_info, new_state)
                 else:
                     _log.debug("No state change")
             else:
@@ -76,6 +93,65 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
         _log.info("Quitting FSM")
         self._fsm.quit()
 
+    def react(self, cluster_info, new_state):
+        result = self.wait_to_react()
+        if self._terminate_flag:
+            return
+
+        if result is None:
+            self.write_to_etcd(cluster_info, new_state)
+            return
+
+        # Another node changed the cluster while we were waiting. If the
+        # change doesn't affect us, make ours on top of it - otherwise we'll
+        # handle the new cluster next time round.
+        updated_cluster_info = ClusterInfo(result.value,
+                                           self.key(),
+                                           result.modifiedIndex)
+        if (result.value is not None and
+            self.can_reapply(cluster_info, updated_cluster_info, new_state)):
+            _log.debug("Cluster changed while waiting to write - writing "
+                       "state {} on top of the change".format(new_state))
+            self.write_to_etcd(updated_cluster_info,
+                               new_state,
+                               with_index=result.modifiedIndex)
+        else:
+            _log.debug("Cluster changed while waiting to write state {} - "
+                       "handling the change instead".format(new_state))
+
+    # Whether new_state (which was worked out from cluster_info) can be
+    # written on top of updated_cluster_info instead. This is only true if
+    # we're just changing our own state, and neither we nor anyone else has
+    # changed it or the overall deployment state in the meantime (in which
+    # case we may want to change our state to something else) - unless we're
+    # going into ERROR or DELETE_ME, which we do regardless.
+    def can_reapply(self, cluster_info, updated_cluster_info, new_state):
+        if not isinstance(new_state, str):
+            return False
+        return ((new_state in [constants.ERROR, constants.DELETE_ME]) or
+                ((updated_cluster_info.local_state(self._ip) ==
+                  cluster_info.local_state(self._ip)) and
+                 (updated_cluster_info.cluster_state ==
+                  cluster_info.cluster_state)))
+
+    # Whether we'd already handled this cluster state before we restarted,
+    # leaving nothing for the plugin to do in it. The plugin has the final say,
+    # as what it wrote before the restart may have been changed since.
+    def already_handled(self, cluster_info):
+        return (self.unchanged_since_restart() and
+                self.is_steady_state(cluster_info) and
+                self._plugin.is_up_to_date(thaw(cluster_info.view)))
+
+    # Whether the cluster is stable with this node in it (or, if we're just
+    # monitoring a remote cluster, whether it's stable).
+    def is_steady_state(self, cluster_info):
+        if not self._plugin.should_be_in_cluster():
+            return cluster_info.cluster_state == constants.STABLE
+
+        return (cluster_info.local_state(self._ip) == constants.NORMAL and
+                cluster_info.cluster_state in [constants.STABLE,
+                                               constants.STABLE_WITH_ERRORS])
+
     # This node has been asked to leave the cluster. Check if the cluster is in
     # a stable state, in which case we can leave. Otherwise, set a flag and
     # leave at the next available opportunity.
@@ -88,8 +164,11 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
             self._terminate_flag = True
             return
 
-        etcd_result, idx = self.read_from_etcd(wait=False)
-        cluster_info = ClusterInfo(etcd_result)
+        # Any change we haven't seen yet makes the write fail, and we then
+        # retry with a quorum read.
+        etcd_result, idx = self.read_from_etcd(
+            wait=False, consistency=ReadConsistency.CACHED)
+        cluster_info = ClusterInfo(etcd_result, self.key(), idx)
 
         self._leaving_requested = True
         if cluster_info.can_leave(self.force_leave):
@@ -106,10 +185,11 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
             # no-op
             return
 
-        etcd_result, idx = self.read_from_etcd(wait=False)
+        etcd_result, idx = self.read_from_etcd(
+            wait=False, consistency=ReadConsistency.CACHED)
         if etcd_result is not None:
             _log.warning("Got result of None from read_from_etcd")
-        cluster_info = ClusterInfo(etcd_result)
+        cluster_info = ClusterInfo(etcd_result, self.key(), idx)
 
         self.write_to_etcd(cluster_info, constants.ERROR)
 
@@ -129,14 +209,22 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
         elif isinstance(new_state, dict):
             cluster_view = new_state
 
-        _log.debug("Writing state %s into etcd" % cluster_view)
-        json_data = json.dumps(cluster_view)
+        _log.debug("Writing state %s into etcd", cluster_view)
+        json_data = encode(cluster_view)
 
         try:
-            if index:
-                self._client.write(self.key(), json_data, prevIndex=index)
-            else:
-                self._client.write(self.key(), json_data, prevExist=False)
+            self._retry_policy.check()
+            with self._metrics.histogram("etcd_write_seconds").time():
+                if index:
+                    result = self._client.write(self.key(),
+                                                json_data,
+                                                prevIndex=index)
+                else:
+                    result = self._client.write(self.key(),
+                                                json_data,
+                                                prevExist=False)
+            self._retry_policy.succeeded()
+            self.record_write(json_data, result)
 
             # We may have just successfully set the local node to
             # WAITING_TO_LEAVE, in which case we no longer need the leaving
@@ -144,24 +232,26 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
             if new_state == constants.WAITING_TO_LEAVE:
                 self._leaving_requested = False
         except (EtcdAlreadyExist, ValueError):
+            self._metrics.counter("etcd_write_contention").inc()
             _log.debug("Contention on etcd write - new_state is {}".format(new_state))
-            # Our etcd write failed because someone got there before us.
+            # Our etcd write failed because someone got there before us. etcd
+            # itself is fine though.
+            self._retry_policy.succeeded()
 
             if isinstance(new_state, str):
                 # We're just trying to update our own state, so it may be safe
                 # to take the new state, update our own state in it, and retry.
-                (etcd_result, idx) = self.read_from_etcd(wait=False)
-                updated_cluster_info = ClusterInfo(etcd_result)
+                (etcd_result, idx) = self.read_from_etcd(
+                    wait=False, consistency=ReadConsistency.QUORUM)
+                updated_cluster_info = ClusterInfo(etcd_result, self.key(), idx)
 
                 # This isn't safe if someone else has changed our state for us,
                 # or the overall deployment state has changed (in which case we
                 # may want to change our state to something else, so check for
                 # that.
-                if ((new_state in [constants.ERROR, constants.DELETE_ME]) or
-                    ((updated_cluster_info.local_state(self._ip) ==
-                     cluster_info.local_state(self._ip)) and
-                    (updated_cluster_info.cluster_state ==
-                     cluster_info.cluster_state))):
+                if self.can_reapply(cluster_info,
+                                    updated_cluster_info,
+                                    new_state):
                     _log.debug("Retrying contended write with updated value")
                     self.write_to_etcd(updated_cluster_info,
                                        new_state,
@@ -169,6 +259,7 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
         except Exception as e:
             # Catch-all error handler (for invalid requests, timeouts, etc -
             # unset our state and start over.
+            self._metrics.counter("etcd_write_errors").inc()
             _log.error("{} caught {!r} when trying to write {} with index {}"
                        " - pause before retrying"
                        .format(self._ip, e, json_data, self._index))
@@ -177,4 +268,4 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
             # that any necessary work/state changes get retried.
             self._last_value, self._last_index = None, None
             # Sleep briefly to avoid hammering a failed server
-            self.pause()
+            self.pause(e)
@@ -13,6 +13,7 @@ Usage:
   main.py --mgmt-local-ip=IP --sig-local-ip=IP --local-site=NAME --remote-site=NAME --remote-cassandra-seeds=IPs --uuid=UUID --etcd-key=KEY --etcd-cluster-key=CLUSTER_KEY
           [--signaling-namespace=NAME] [--foreground] [--log-level=LVL]
           [--log-directory=DIR] [--pidfile=FILE] [--cluster-manager-enabled=Y/N]
+          [--etcd-api=VERSION] [--etcd-endpoints=MODE]
 
 Options:
   -h --help                      Show this screen.
@@ -30,12 +31,18 @@ Options:
   --log-directory=DIR            Directory to log to [default: ./]
   --pidfile=FILE                 Pidfile to write [default: ./cluster-manager.pid]
   --cluster-manager-enabled=Y/N  Whether the cluster manager should start any threads [default: Yes]
+  --etcd-api=VERSION             Etcd API to use, v2 or v3 [default: v2]
+  --etcd-endpoints=MODE          Etcd members to use: local, cluster, hedged or leader [default: local]
 
 """
 
 from docopt import docopt, DocoptExit
 
 from metaswitch.common import logging_config, utils
+from metaswitch.clearwater.etcd_shared.state_cache import configure_state_cache
+from metaswitch.clearwater.etcd_shared.metrics import export_stats_file
+from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import \
+    shutdown_time
 from metaswitch.clearwater.etcd_shared.plugin_loader import load_plugins_in_dir
 from metaswitch.clearwater.cluster_manager.etcd_synchronizer import EtcdSynchronizer
 from metaswitch.clearwater.cluster_manager.plugin_base import PluginParams
@@ -96,6 +103,8 @@ def main(args):
     cluster_manager_enabled = arguments['--cluster-manager-enabled']
     log_dir = arguments['--log-directory']
     log_level = LOG_LEVELS.get(arguments['--log-level'], logging.DEBUG)
+    EtcdSynchronizer.ETCD_API = arguments['--etcd-api']
+    EtcdSynchronizer.ETCD_ENDPOINTS = arguments['--etcd-endpoints']
 
     stdout_err_log = os.path.join(log_dir, "cluster-manager.output.log")
 
@@ -133,6 +142,13 @@ def main(args):
         # We failed to take the lock - another process is already running
         exit(1)
 
+    # Keep track of what we've handled in a file alongside the pidfile, so
+    # that a restart doesn't redo work unnecessarily.
+    configure_state_cache(arguments['--pidfile'])
+
+    # Periodically write out performance metrics alongside the pidfile.
+    export_stats_file(arguments['--pidfile'])
+
     plugins_dir = "/usr/share/clearwater/clearwater-cluster-manager/plugins/"
     plugins = load_plugins_in_dir(plugins_dir,
                                   PluginParams(ip=sig_ip,
@@ -195,8 +211,9 @@ def main(args):
 
     _log.info("No plugin threads running, waiting for a SIGTERM or SIGQUIT")
     while not utils.should_quit and not should_quit:
-        sleep(1)
+        sleep(0.1)
     _log.info("Quitting")
     _log.debug("%d threads outstanding at exit" % activeCount())
-    pdlogs.EXITING.log()
+    pdlogs.EXITING.log(
+        shutdown_time="{:.3f}".format(shutdown_time(synchronizers)))
     syslog.closelog()
@@ -27,5 +27,9 @@ class NullPlugin(SynchroniserPluginBase):
     def on_stable_cluster(self, cluster_view): # pragma: no cover
         pass
 
+    def is_up_to_date(self, cluster_view):
+        # There's nothing for this plugin to keep up to date.
+        return True
+
     def on_leaving_cluster(self, cluster_view):
         pass
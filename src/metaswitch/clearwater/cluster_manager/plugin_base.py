@@ -39,11 +39,37 @@ class SynchroniserPluginBase(object): # pragma: no cover
         """Allows a plugin to monitor, but not join, a remote cluster"""
         return True
 
+    def coalescing_window(self):
+
+        """How long (in seconds) to wait for further changes to the cluster
+        before acting on a change, or None to use the cluster manager's
+        default"""
+        return None
+
+    def reaction_jitter(self):
+
+        """The most (in seconds) that this node should wait before writing
+        its response to a change to the cluster, so that the nodes in the
+        deployment don't all write at once, or None to use the cluster
+        manager's default"""
+        return None
+
     def on_startup(self, cluster_view):
         # Most of our plugins don't want to do anything on startup, so this
         # isn't marked as an @abstractmethod which they must implement.
         pass
 
+    def is_up_to_date(self, cluster_view):
+
+        """Whether this node already reflects cluster_view (e.g. its config
+        files already match it). After a restart, if the cluster is stable
+        and unchanged since before the restart, on_stable_cluster isn't
+        called again for a plugin that is up to date.
+
+        Plugins that can't tell should return False, so that
+        on_stable_cluster is always called."""
+        return False
+
     @abstractmethod
     def on_cluster_changing(self, cluster_view):
 
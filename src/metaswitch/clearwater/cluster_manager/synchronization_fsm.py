@@ -6,17 +6,20 @@
 # Metaswitch Networks in a separate written agreement.
 
 
-from time import sleep
+from time import sleep, time
 import constants
 from .alarms import TooLongAlarm
 from . import pdlogs
+from metaswitch.clearwater.etcd_shared.metrics import metrics
+from metaswitch.clearwater.etcd_shared.value_cache import thaw
 import logging
 
 _log = logging.getLogger("cluster_manager.synchronization_fsm")
 
 
 # Decorator to call a plugin function, and catch and log any exceptions it
-# raises.
+# raises. The plugin gets its own copy of the cluster view, as the view we're
+# given is shared (and immutable).
 def safe_plugin(f, cluster_view, new_state=None):
     try:
         _log.info("Calling plugin method {}.{}".
@@ -24,7 +27,10 @@ def safe_plugin(f, cluster_view, new_state=None):
                          f.__name__))
         # Call into the plugin, and if it doesn't throw an exception,
         # return the state we should move into.
-        f(cluster_view)
+        with metrics.histogram("plugin_hook_seconds",
+                               plugin=f.__self__.__class__.__name__,
+                               hook=f.__name__).time():
+            f(thaw(cluster_view))
         return new_state
     except AssertionError: # pragma: no cover
         # Allow UT plugins to assert things, halt their FSM, and be noticed more
@@ -59,6 +65,10 @@ class SyncFSM(object):
         self._startup = True
         self._alarm = TooLongAlarm()
 
+        # The local state we last saw, and when we entered it
+        self._local_state = None
+        self._local_state_entered = None
+
     def quit(self):
         self._alarm.quit()
 
@@ -85,13 +95,39 @@ class SyncFSM(object):
                 pdlogs.NODE_LEAVING.log(ip=node,
                                         cluster_desc=self._plugin.cluster_description())
 
-    def next(self, local_state, cluster_state, cluster_view):  # noqa
+    def _track_local_state(self, local_state):
+        # Record how long the local node spent in its previous state
+        if local_state == self._local_state:
+            return
+
+        now = time()
+        if self._local_state is not None:
+            metrics.histogram("fsm_state_seconds",
+                              plugin=self._plugin.__class__.__name__,
+                              state=self._local_state).observe(
+                                  now - self._local_state_entered)
+        self._local_state = local_state
+        self._local_state_entered = now
+
+    def _stable_cluster(self, cluster_view, already_handled):
+        if already_handled:
+            _log.info("Cluster is unchanged since restart, and plugin {} is "
+                      "up to date".format(self._plugin.__class__.__name__))
+            return None
+        return safe_plugin(self._plugin.on_stable_cluster,
+                           cluster_view)
+
+    def next(self, local_state, cluster_state, cluster_view,  # noqa
+             already_handled=False):
         """Main state machine function.
 
         Arguments:
             - local_state: string constant from constants.py
             - cluster_state: string constant from constants.py
             - cluster_view: dictionary of node IPs to local states
+            - already_handled: True if this node had already handled this
+            cluster view before it restarted, and the plugin is up to date
+            with it - so there's no need to call on_stable_cluster again
 
         Returns:
             - None if the state should not change
@@ -107,6 +143,7 @@ class SyncFSM(object):
                       cluster_state,
                       cluster_view))
         assert(self._running)
+        self._track_local_state(local_state)
         if self._startup:
             safe_plugin(self._plugin.on_startup,
                         cluster_view)
@@ -132,8 +169,7 @@ class SyncFSM(object):
                 safe_plugin(self._plugin.on_cluster_changing, # pragma: no cover
                             cluster_view)
             elif cluster_state == constants.STABLE:
-                safe_plugin(self._plugin.on_stable_cluster,
-                            cluster_view)
+                self._stable_cluster(cluster_view, already_handled)
             return None
 
         if local_state is None:
@@ -154,12 +190,10 @@ class SyncFSM(object):
 
         elif (cluster_state == constants.STABLE and
                 local_state == constants.NORMAL):
-            return safe_plugin(self._plugin.on_stable_cluster,
-                               cluster_view)
+            return self._stable_cluster(cluster_view, already_handled)
         elif (cluster_state == constants.STABLE_WITH_ERRORS and
                 local_state == constants.NORMAL):
-            return safe_plugin(self._plugin.on_stable_cluster,
-                               cluster_view)
+            return self._stable_cluster(cluster_view, already_handled)
 
         # States for joining a cluster
 
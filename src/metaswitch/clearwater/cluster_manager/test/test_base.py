@@ -15,6 +15,9 @@ from metaswitch.clearwater.cluster_manager.etcd_synchronizer import \
     EtcdSynchronizer
 from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import \
     CommonEtcdSynchronizer
+from metaswitch.clearwater.etcd_shared.metrics import metrics
+from metaswitch.clearwater.etcd_shared.event_loop import stop_event_loop
+from metaswitch.clearwater.etcd_shared.watch_hub import stop_watch_hubs
 from .dummy_plugin import DummyPlugin
 from time import sleep
 import json
@@ -29,10 +32,19 @@ class BaseClusterTest(unittest.TestCase):
         CommonEtcdSynchronizer.PAUSE_BEFORE_RETRY_ON_EXCEPTION = 0
         CommonEtcdSynchronizer.PAUSE_BEFORE_RETRY_ON_MISSING_KEY = 0
         CommonEtcdSynchronizer.TIMEOUT_ON_WATCH = 0
+        EtcdSynchronizer.COALESCING_WINDOW = 0
+        EtcdSynchronizer.REACTION_JITTER = 0
         MockEtcdClient.clear()
+        metrics.clear()
         alarms_patch.start()
         self.syncs = []
 
+    def tearDown(self):
+        # Stop the threads the synchronizers share, so that none are left
+        # running into the next test (or into interpreter shutdown).
+        stop_watch_hubs()
+        stop_event_loop()
+
     def wait_for_all_normal(self, client, required_number=-1, tries=20):
         for i in range(tries):
             value = None
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import unittest
+from metaswitch.clearwater.etcd_shared.bulk_read import read_all
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
+from metaswitch.clearwater.etcd_tests.etcdstandin import EtcdStandInServer
+
+
+class TestBulkRead(unittest.TestCase):
+    def setUp(self):
+        self.server = EtcdStandInServer("127.0.0.248")
+        self.client = EtcdV2Client("127.0.0.248", 4000)
+        self.client.write("/clearwater/site1/configuration/shared_config", "a")
+        self.client.write("/clearwater/site1/configuration/dns_json", "b")
+        self.client.write("/clearwater/sprout/clustering/memcached", "c")
+        self.client.write("/other", "d")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.exit()
+
+    def test_prefix(self):
+        values, index = read_all(self.client, "/clearwater")
+        self.assertEqual(
+            {"/clearwater/site1/configuration/shared_config": ("a", 1),
+             "/clearwater/site1/configuration/dns_json": ("b", 2),
+             "/clearwater/sprout/clustering/memcached": ("c", 3)},
+            values)
+        self.assertEqual(4, index)
+
+        values, _ = read_all(self.client)
+        self.assertEqual(4, len(values))
+
+    def test_keys(self):
+        # Only the requested keys are returned, and missing ones are left out
+        values, index = read_all(
+            self.client,
+            keys=["clearwater/site1/configuration/shared_config",
+                  "/clearwater/sprout/clustering/memcached",
+                  "/clearwater/site1/configuration/missing"])
+        self.assertEqual(
+            {"/clearwater/site1/configuration/shared_config": ("a", 1),
+             "/clearwater/sprout/clustering/memcached": ("c", 3)},
+            values)
+        self.assertEqual(4, index)
+
+        values, _ = read_all(self.client, keys=["/other"])
+        self.assertEqual({"/other": ("d", 4)}, values)
+
+    def test_missing(self):
+        values, index = read_all(self.client, "/missing")
+        self.assertEqual({}, values)
+        self.assertEqual(4, index)
+
+        self.assertEqual(({}, None), read_all(self.client, keys=[]))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import json
+import unittest
+from metaswitch.clearwater.cluster_manager import constants
+from metaswitch.clearwater.cluster_manager.cluster_state import ClusterInfo
+
+
+class TestClusterState(unittest.TestCase):
+    def check(self, cluster_state, view):
+        self.assertEqual(cluster_state,
+                         ClusterInfo(json.dumps(view)).cluster_state)
+
+    def test_cluster_states(self):
+        self.check(constants.EMPTY, {})
+        self.check(constants.STABLE, {"10.0.0.1": constants.NORMAL,
+                                      "10.0.0.2": constants.NORMAL})
+        self.check(constants.STABLE_WITH_ERRORS,
+                   {"10.0.0.1": constants.NORMAL,
+                    "10.0.0.2": constants.ERROR})
+        self.check(constants.STABLE_WITH_ERRORS,
+                   {"10.0.0.1": constants.ERROR})
+        self.check(constants.JOIN_PENDING,
+                   {"10.0.0.1": constants.NORMAL,
+                    "10.0.0.2": constants.WAITING_TO_JOIN,
+                    "10.0.0.3": constants.ERROR})
+        self.check(constants.STARTED_JOINING,
+                   {"10.0.0.1": constants.NORMAL_ACKNOWLEDGED_CHANGE,
+                    "10.0.0.2": constants.JOINING})
+        self.check(constants.LEAVING_RESYNCING,
+                   {"10.0.0.1": constants.NORMAL_CONFIG_CHANGED,
+                    "10.0.0.2": constants.FINISHED})
+        self.check(constants.FINISHED_LEAVING,
+                   {"10.0.0.1": constants.FINISHED})
+        self.check(constants.INVALID_CLUSTER_STATE,
+                   {"10.0.0.1": constants.WAITING_TO_JOIN,
+                    "10.0.0.2": constants.WAITING_TO_LEAVE})
+        self.check(constants.INVALID_CLUSTER_STATE,
+                   {"10.0.0.1": constants.NORMAL,
+                    "10.0.0.2": "not a real state"})
+
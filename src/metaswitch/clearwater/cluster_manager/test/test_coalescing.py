@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+from mock import patch
+from threading import Thread
+from time import sleep, time
+from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import EtcdFactory
+from metaswitch.clearwater.cluster_manager.etcd_synchronizer import \
+    EtcdSynchronizer
+from .dummy_plugin import DummyPlugin
+from .test_base import BaseClusterTest
+
+
+class CoalescingPlugin(DummyPlugin):
+    def coalescing_window(self):
+        return 1
+
+
+class TestCoalescing(BaseClusterTest):
+    def write_burst(self, client):
+        for value in ["second", "third", "fourth"]:
+            sleep(0.1)
+            client.write("/test", value)
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_burst_is_coalesced(self):
+        e = EtcdSynchronizer(CoalescingPlugin(None), "10.0.0.1")
+        e._client.write("/test", "first")
+        e._last_value = "first"
+
+        # Watch the key directly rather than through the shared watch
+        e.watch_prefix = lambda: None
+
+        writer = Thread(target=self.write_burst, args=(e._client,))
+        writer.start()
+        start = time()
+        value = e.update_from_etcd()
+        writer.join()
+
+        # Only the last value in the burst is returned, and no later than the
+        # end of the window
+        self.assertEqual("fourth", value)
+        self.assertEqual(4, e._index)
+        self.assertTrue(e._metrics.counter("coalesced_changes").value >= 1)
+        self.assertTrue(time() - start < 2)
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_plugin_default(self):
+        # The plugin can defer to the synchronizer's default
+        e = EtcdSynchronizer(DummyPlugin(None), "10.0.0.1")
+        self.assertEqual(EtcdSynchronizer.COALESCING_WINDOW,
+                         e.coalescing_window())
+        e = EtcdSynchronizer(CoalescingPlugin(None), "10.0.0.1")
+        self.assertEqual(1, e.coalescing_window())
@@ -21,7 +21,8 @@ class TestContention(BaseClusterTest):
     @unittest.skipIf(os.environ.get("ETCD_IP"),
                      "Relies on in-memory etcd implementation")
     @unittest.skipUnless(os.environ.get("SLOW"), "SLOW=T not set")
-    @patch("etcd.Client", new=SlowMockEtcdClient)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=SlowMockEtcdClient)
     def test_write_contention(self):
         # Create a cluster of 30 nodes, using a plugin that asserts if any work
         # is repeated (e.g. if on_cluster_changing() is called twice without the
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import etcd
+import os
+import shutil
+import tempfile
+import unittest
+from time import sleep, time
+from metaswitch.clearwater.etcd_shared.etcd_cluster_client import \
+    EtcdClusterClient
+
+
+class FakeMember(object):
+    """Stands in for a python-etcd client talking to one etcd member."""
+    members = {}
+
+    # The IP of the member that all the members say is the leader.
+    leader_ip = None
+
+    def __init__(self, host, port):
+        self.host = host
+        self.error = None
+        self.delay = 0
+        self.requests = 0
+        FakeMember.members[host] = self
+
+    def read(self, key, **kwargs):
+        self.requests += 1
+        sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.host
+
+    def write(self, key, value, **kwargs):
+        return self.read(key)
+
+    @property
+    def leader(self):
+        if FakeMember.leader_ip is None:
+            raise etcd.EtcdException("No leader")
+        return {"clientURLs": ["http://{}:4000".format(FakeMember.leader_ip)]}
+
+
+class TestEtcdClusterClient(unittest.TestCase):
+    def setUp(self):
+        FakeMember.members = {}
+        FakeMember.leader_ip = None
+        self.dir = tempfile.mkdtemp()
+        self.members_file = os.path.join(self.dir, "healthy_etcd_members")
+        with open(self.members_file, "w") as f:
+            f.write("10.0.0.2,10.0.0.1,10.0.0.3,")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def client(self, hedge_reads=False, leader_writes=False):
+        return EtcdClusterClient("10.0.0.1",
+                                 client_factory=FakeMember,
+                                 hedge_reads=hedge_reads,
+                                 leader_writes=leader_writes,
+                                 members_file=self.members_file)
+
+    def test_prefers_local_member(self):
+        client = self.client()
+        self.assertEqual(["10.0.0.1", "10.0.0.2", "10.0.0.3"],
+                         sorted(e.host for e in client.endpoints()))
+        self.assertEqual("10.0.0.1", client.read("/test"))
+        self.assertEqual("10.0.0.1", client.write("/test", "value"))
+
+    def test_fails_over_from_sick_member(self):
+        client = self.client()
+        client.endpoints()
+        local = FakeMember.members["10.0.0.1"]
+        local.error = etcd.EtcdConnectionFailed("Connection refused")
+
+        # The read is retried against another member, and later requests go
+        # straight there
+        self.assertNotEqual("10.0.0.1", client.read("/test"))
+        self.assertNotEqual("10.0.0.1", client.read("/test"))
+        self.assertNotEqual("10.0.0.1", client.write("/test", "value"))
+        self.assertEqual(1, local.requests)
+
+    def test_answers_are_not_failures(self):
+        client = self.client()
+        client.endpoints()
+        local = FakeMember.members["10.0.0.1"]
+        local.error = etcd.EtcdKeyNotFound("Key not found")
+
+        # etcd has answered, so there's no point asking another member
+        self.assertRaises(etcd.EtcdKeyNotFound, client.read, "/test")
+        self.assertRaises(etcd.EtcdKeyNotFound, client.read, "/test")
+        self.assertEqual(2, local.requests)
+
+    def test_hedged_read(self):
+        client = self.client(hedge_reads=True)
+        client.endpoints()
+        FakeMember.members["10.0.0.1"].delay = 1
+
+        start = time()
+        self.assertNotEqual("10.0.0.1", client.read("/test"))
+        self.assertTrue(time() - start < 0.5)
+
+    def test_members_change(self):
+        client = self.client()
+        client.endpoints()
+        client.MEMBERS_REFRESH_INTERVAL = 0
+        with open(self.members_file, "w") as f:
+            f.write("10.0.0.2,10.0.0.4")
+        os.utime(self.members_file, (time() + 10, time() + 10))
+
+        # The local member is always kept
+        self.assertEqual(["10.0.0.1", "10.0.0.2", "10.0.0.4"],
+                         sorted(e.host for e in client.endpoints()))
+
+    def test_leader_writes(self):
+        FakeMember.leader_ip = "10.0.0.3"
+        client = self.client(leader_writes=True)
+
+        # Writes go to the leader, but reads stay local
+        self.assertEqual("10.0.0.3", client.write("/test", "value"))
+        self.assertEqual("10.0.0.1", client.read("/test"))
+
+        # If the leader fails, the write fails, but the next one goes to the
+        # new leader
+        FakeMember.members["10.0.0.3"].error = \
+            etcd.EtcdConnectionFailed("Connection refused")
+        FakeMember.leader_ip = "10.0.0.2"
+        self.assertRaises(etcd.EtcdConnectionFailed,
+                          client.write, "/test", "value")
+        self.assertEqual("10.0.0.2", client.write("/test", "value"))
+
+    def test_leader_unknown(self):
+        # Until the leader is known, writes go to the best member
+        client = self.client(leader_writes=True)
+        self.assertEqual("10.0.0.1", client.write("/test", "value"))
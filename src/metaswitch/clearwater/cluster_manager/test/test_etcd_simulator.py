@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import etcd
+import unittest
+from threading import Thread
+from time import sleep, time
+from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import \
+    EtcdSimulator, MockEtcdClient
+
+
+class TestEtcdSimulator(unittest.TestCase):
+    def setUp(self):
+        self.simulator = EtcdSimulator()
+        self.client = MockEtcdClient(None, None, simulator=self.simulator)
+
+    def test_keys_are_independent(self):
+        self.client.write("/a/one", "1")
+        self.client.write("/a/two", "2")
+        self.client.write("/a/one", "3")
+
+        result = self.client.read("/a/two")
+        self.assertEqual("2", result.value)
+        self.assertEqual(2, result.modifiedIndex)
+        self.assertEqual(3, result.etcd_index)
+
+        result = self.client.read("/a/one")
+        self.assertEqual("3", result.value)
+        self.assertEqual(1, result.createdIndex)
+        self.assertEqual(3, result.modifiedIndex)
+
+        self.assertRaises(etcd.EtcdKeyNotFound, self.client.read, "/b")
+        self.assertRaises(etcd.EtcdNotFile, self.client.write, "/a", "x")
+        self.assertRaises(etcd.EtcdNotDir, self.client.write, "/a/one/x", "x")
+
+    def test_recursive_read(self):
+        self.client.write("/a/one", "1")
+        self.client.write("/a/b/two", "2")
+
+        result = self.client.read("/a/", recursive=True)
+        self.assertTrue(result.dir)
+        self.assertEqual([("/a/b/two", "2"), ("/a/one", "1")],
+                         sorted((r.key, r.value) for r in result.leaves))
+
+        # Without recursive, subdirectories are listed but not their contents
+        result = self.client.read("/a")
+        self.assertEqual(["/a/b", "/a/one"],
+                         [node["key"] for node in result._children])
+
+        self.client.delete("/a", recursive=True)
+        self.assertRaises(etcd.EtcdKeyNotFound, self.client.read, "/a/one")
+
+    def test_compare_and_swap(self):
+        self.client.write("/key", "first", prevExist=False)
+        self.assertRaises(etcd.EtcdAlreadyExist,
+                          self.client.write, "/key", "second", prevExist=False)
+        self.assertRaises(etcd.EtcdCompareFailed,
+                          self.client.write, "/key", "second", prevIndex=2)
+        self.assertRaises(etcd.EtcdKeyNotFound,
+                          self.client.write, "/other", "second", prevIndex=1)
+
+        result = self.client.write("/key", "second", prevIndex=1)
+        self.assertEqual("compareAndSwap", result.action)
+        self.assertEqual("second", self.client.read("/key").value)
+
+    def test_watch(self):
+        self.client.write("/a/one", "1")
+        self.client.write("/a/two", "2")
+
+        # Watches are answered from the history
+        result = self.client.read("/a/two", wait=True, waitIndex=1)
+        self.assertEqual(2, result.modifiedIndex)
+        result = self.client.read("/a", wait=True, waitIndex=1, recursive=True)
+        self.assertEqual("/a/one", result.key)
+
+        # ... or wait for a change
+        self.assertRaises(etcd.EtcdWatchTimedOut,
+                          self.client.read, "/a/one", wait=True, waitIndex=3)
+        writer = Thread(target=lambda: (sleep(0.05),
+                                        self.client.write("/a/one", "3")))
+        writer.start()
+        result = self.client.read("/a/one", wait=True, waitIndex=3)
+        writer.join()
+        self.assertEqual("3", result.value)
+
+    def test_history_compaction(self):
+        self.simulator.HISTORY_SIZE = 5
+        self.simulator.clear()
+        for value in range(10):
+            self.client.write("/key", str(value))
+
+        self.assertEqual("5", self.client.read("/key",
+                                               wait=True,
+                                               waitIndex=6).value)
+        try:
+            self.client.read("/key", wait=True, waitIndex=5)
+            self.fail("Expected EtcdEventIndexCleared")
+        except etcd.EtcdEventIndexCleared as e:
+            self.assertEqual(10, e.payload["index"])
+
+    def test_ttl(self):
+        self.client.write("/key", "value", ttl=0.1)
+        self.assertEqual(1, self.client.read("/key").ttl)
+
+        self.simulator.MAX_WATCH_TIME = None
+        result = self.client.read("/key", wait=True, waitIndex=2, timeout=1)
+        self.assertEqual("expire", result.action)
+        self.assertRaises(etcd.EtcdKeyNotFound, self.client.read, "/key")
+
+    def test_faults_and_latency(self):
+        self.client.write("/key", "value")
+        self.simulator.add_fault(etcd.EtcdConnectionFailed("Down"),
+                                 operation="read",
+                                 count=1)
+        self.assertRaises(etcd.EtcdConnectionFailed, self.client.read, "/key")
+        self.assertEqual("value", self.client.read("/key").value)
+
+        self.simulator.latency = 0.1
+        start = time()
+        self.client.read("/key")
+        self.assertTrue(time() - start >= 0.1)
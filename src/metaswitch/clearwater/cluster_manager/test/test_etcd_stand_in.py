@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import etcd
+import httplib
+import unittest
+from threading import Thread
+from time import sleep
+from metaswitch.clearwater.etcd_tests.etcdstandin import EtcdStandInServer
+
+
+class TestEtcdStandIn(unittest.TestCase):
+    def setUp(self):
+        self.server = EtcdStandInServer("127.0.0.251")
+        self.client = self.server.client()
+
+    def tearDown(self):
+        self.server.exit()
+
+    def test_keys(self):
+        self.assertRaises(etcd.EtcdKeyNotFound, self.client.read, "/test")
+        result = self.client.write("/test", "first", prevExist=False)
+        self.assertTrue(result.newKey)
+        self.assertRaises(etcd.EtcdAlreadyExist,
+                          self.client.write, "/test", "second", prevExist=False)
+        self.assertRaises(etcd.EtcdCompareFailed,
+                          self.client.write, "/test", "second", prevIndex=5)
+        self.client.write("/test", "second", prevIndex=result.modifiedIndex)
+
+        result = self.client.read("/test", quorum=True)
+        self.assertEqual("second", result.value)
+        self.assertEqual(2, result.etcd_index)
+
+        self.client.delete("/test")
+        self.assertRaises(etcd.EtcdKeyNotFound, self.client.read, "/test")
+
+    def test_watch(self):
+        self.client.write("/dir/key", "first")
+        writer = Thread(target=lambda: (sleep(0.2),
+                                        self.client.write("/dir/key", "new")))
+        writer.start()
+        result = self.client.read("/dir",
+                                  wait=True,
+                                  waitIndex=2,
+                                  recursive=True,
+                                  timeout=5)
+        writer.join()
+        self.assertEqual("new", result.value)
+
+        self.assertRaises(etcd.EtcdWatchTimedOut,
+                          self.client.read, "/dir/key",
+                          wait=True, waitIndex=3, timeout=0.2)
+
+    def test_watch_headers_sent_early(self):
+        # Like etcd, a watch's headers are sent before anything has changed
+        self.client.write("/key", "first")
+        connection = httplib.HTTPConnection("127.0.0.251", 4000, timeout=5)
+        try:
+            connection.request("GET", "/v2/keys/key?wait=true&waitIndex=2")
+            response = connection.getresponse()
+            self.assertEqual(200, response.status)
+            self.assertEqual("1", response.getheader("X-Etcd-Index"))
+
+            self.client.write("/key", "second")
+            self.assertTrue('"value":"second"' in response.read())
+        finally:
+            connection.close()
+
+    def test_cluster(self):
+        # A second server joins the first's cluster, and shares its keys
+        second = EtcdStandInServer("127.0.0.252", existing=self.server._ip)
+        try:
+            self.client.write("/test", "value")
+            self.assertEqual("value", second.client().read("/test").value)
+            self.assertEqual(2, len(second.memberList()))
+            self.assertTrue(self.server.isLeader())
+            self.assertFalse(second.isLeader())
+            self.assertTrue(second.isAlive())
+        finally:
+            second.exit()
+        self.assertEqual(1, len(self.server.memberList()))
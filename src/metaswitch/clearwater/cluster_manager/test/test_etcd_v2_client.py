@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import errno
+import etcd
+import httplib
+import socket
+import unittest
+from threading import Thread
+from time import sleep
+from mock import patch
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
+from metaswitch.clearwater.etcd_tests.etcdstandin import \
+    EtcdStandInServer, StandInRequestHandler
+
+
+class TestEtcdV2Client(unittest.TestCase):
+    def setUp(self):
+        self.server = EtcdStandInServer("127.0.0.253")
+        self.client = EtcdV2Client("127.0.0.253", 4000)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.exit()
+
+    def test_keys(self):
+        self.assertRaises(etcd.EtcdKeyNotFound, self.client.read, "/test")
+        result = self.client.write("/test", u"first", prevExist=False)
+        self.assertTrue(result.newKey)
+        self.assertEqual("first", result.value)
+        self.assertRaises(etcd.EtcdAlreadyExist,
+                          self.client.write, "/test", "second", prevExist=False)
+        self.assertRaises(etcd.EtcdCompareFailed,
+                          self.client.write, "/test", "second", prevIndex=5)
+        self.client.write("/test", "second", prevIndex=result.modifiedIndex)
+
+        result = self.client.read("/test", quorum=True)
+        self.assertEqual("second", result.value)
+        self.assertEqual(2, result.modifiedIndex)
+        self.assertEqual(2, result.etcd_index)
+
+        self.client.delete("/test", prevValue="second")
+        self.assertRaises(etcd.EtcdKeyNotFound, self.client.read, "/test")
+
+        # All of that went over a single persistent connection
+        self.assertEqual(1, self.client.connections_established)
+
+    def test_recursive_read(self):
+        self.client.write("/dir/a", "1")
+        self.client.write("/dir/b", "2")
+        result = self.client.read("/dir", recursive=True)
+        self.assertTrue(result.dir)
+        self.assertEqual(["1", "2"],
+                         sorted(leaf.value for leaf in result.leaves))
+
+    def test_watch(self):
+        self.client.write("/dir/key", "first")
+        writer = Thread(target=lambda: (sleep(0.2),
+                                        self.client.write("/dir/key", "new")))
+        writer.start()
+        result = self.client.read("/dir",
+                                  wait=True,
+                                  waitIndex=2,
+                                  recursive=True,
+                                  timeout=5)
+        writer.join()
+        self.assertEqual("new", result.value)
+
+        self.assertRaises(etcd.EtcdWatchTimedOut,
+                          self.client.read, "/dir/key",
+                          wait=True, waitIndex=3, timeout=0.2)
+
+        # The timed out watch's connection was thrown away, but the client
+        # still works
+        self.assertEqual("new", self.client.read("/dir/key").value)
+
+    def break_idle_connection(self, when):
+        # Makes the next request on the client's idle connection fail, as if
+        # the connection had dropped - before the request was sent, before
+        # etcd answered it, or part way through the answer.
+        connection = self.client._idle[-1]
+        request = connection.request
+        getresponse = connection.getresponse
+
+        def fail_read(*args):
+            raise socket.error(errno.ECONNRESET, "Connection reset by peer")
+
+        def fail_request(*args, **kwargs):
+            if when == "request":
+                raise socket.error(errno.EPIPE, "Broken pipe")
+            request(*args, **kwargs)
+
+        def fail_response(**kwargs):
+            if when == "status":
+                raise httplib.BadStatusLine("")
+            response = getresponse(**kwargs)
+            response.read = fail_read
+            return response
+
+        connection.request = fail_request
+        connection.getresponse = fail_response
+
+    def test_dropped_connection(self):
+        self.client.write("/test", "first")
+
+        # A read is retried on a new connection, wherever it failed
+        self.break_idle_connection("status")
+        self.assertEqual("first", self.client.read("/test").value)
+        self.assertEqual(2, self.client.connections_established)
+
+        # So is a write that failed to send
+        self.break_idle_connection("request")
+        self.client.write("/test", "second")
+        self.assertEqual(3, self.client.connections_established)
+
+        # But a write that etcd has started answering has happened, so isn't
+        # repeated
+        self.break_idle_connection("body")
+        self.assertRaises(etcd.EtcdConnectionFailed,
+                          self.client.write, "/test", "third")
+        result = self.client.read("/test")
+        self.assertEqual("third", result.value)
+        self.assertEqual(3, result.modifiedIndex)
+
+    def test_server_closed_idle_connection(self):
+        # etcd closes the connection while it's sitting in the pool. A write
+        # on it goes out, but etcd never answers - so it's safe to resend.
+        with patch.object(StandInRequestHandler, "timeout", 0.2):
+            self.client.write("/test", "first")
+            sleep(0.5)
+            self.client.write("/test", "second")
+
+        result = self.client.read("/test")
+        self.assertEqual("second", result.value)
+        self.assertEqual(2, result.modifiedIndex)
+        self.assertEqual(2, self.client.connections_established)
+
+    def test_members(self):
+        members = self.client.members
+        self.assertEqual([self.server._id], members.keys())
+        self.assertEqual(self.server._id, self.client.leader["id"])
+
+    def test_no_server(self):
+        client = EtcdV2Client("127.0.0.254", 4000)
+        self.assertRaises(etcd.EtcdConnectionFailed, client.read, "/test")
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import unittest
+import base64
+import etcd
+import json
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread, Condition
+from time import sleep, time
+from metaswitch.clearwater.etcd_shared.etcd_v3_client import \
+    EtcdV3Client, prefix_range_end
+
+
+class FakeGateway(ThreadingMixIn, HTTPServer):
+    """Just enough of etcd's v3 JSON gateway to test the client against."""
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), FakeGatewayHandler)
+        self.condition = Condition()
+        self.revision = 1
+        self.kvs = {}
+        self.history = []
+        self.stopped = False
+
+
+class FakeGatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        request = json.loads(body)
+        server = self.server
+
+        if self.path == "/v3alpha/watch":
+            return self.watch(request["create_request"])
+
+        with server.condition:
+            if self.path == "/v3alpha/kv/range":
+                kvs = [kv for key, kv in sorted(server.kvs.items())
+                       if self.in_range(key, request)]
+                response = {"kvs": kvs}
+            elif self.path == "/v3alpha/kv/txn":
+                compare = request["compare"]
+                succeeded = all(self.compare(c) for c in compare)
+                ops = request["success" if succeeded else "failure"]
+                responses = []
+                for op in ops:
+                    if "request_put" in op:
+                        self.put(op["request_put"])
+                    else:
+                        key = base64.b64decode(op["request_range"]["key"])
+                        kv = server.kvs.get(key)
+                        responses.append({"response_range":
+                                          {"kvs": [kv] if kv else []}})
+                response = {"succeeded": succeeded, "responses": responses}
+            response["header"] = {"revision": str(server.revision)}
+
+        self.send_json(json.dumps(response))
+
+    def in_range(self, key, request):
+        start = base64.b64decode(request["key"])
+        if "range_end" not in request:
+            return key == start
+        return start <= key < base64.b64decode(request["range_end"])
+
+    def compare(self, compare):
+        kv = self.server.kvs.get(base64.b64decode(compare["key"]), {})
+        if compare["target"] == "MOD":
+            return kv.get("mod_revision") == compare["mod_revision"]
+        if compare["result"] == "EQUAL":
+            return not kv
+        return bool(kv)
+
+    def put(self, put):
+        server = self.server
+        server.revision += 1
+        key = base64.b64decode(put["key"])
+        kv = {"key": put["key"],
+              "value": put["value"],
+              "mod_revision": str(server.revision),
+              "create_revision": server.kvs.get(key, {}).get(
+                  "create_revision", str(server.revision))}
+        server.kvs[key] = kv
+        server.history.append((server.revision, key, kv))
+        server.condition.notify_all()
+
+    def send_json(self, data):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunk(self, data):
+        self.wfile.write("{:x}\r\n{}\r\n".format(len(data), data))
+        self.wfile.flush()
+
+    def watch(self, create_request):
+        server = self.server
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.send_chunk(json.dumps({"result": {"created": True}}) + "\n")
+
+        next_revision = int(create_request.get("start_revision", 0))
+        while not server.stopped:
+            with server.condition:
+                events = [{"kv": kv} for revision, key, kv in server.history
+                          if revision >= next_revision and
+                          self.in_range(key, create_request)]
+                next_revision = server.revision + 1
+                if not events:
+                    server.condition.wait(0.1)
+                    continue
+                header = {"revision": str(server.revision)}
+
+            try:
+                self.send_chunk(json.dumps({"result": {"header": header,
+                                                       "events": events}}))
+            except Exception:
+                return
+
+
+class TestEtcdV3Client(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeGateway()
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = EtcdV3Client("127.0.0.1", self.server.server_port)
+
+    def tearDown(self):
+        self.server.stopped = True
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_prefix_range_end(self):
+        self.assertEqual("/prefix0", prefix_range_end("/prefix/"))
+        self.assertEqual("/b", prefix_range_end("/a\xff"))
+
+    def test_read_and_write(self):
+        self.assertRaises(etcd.EtcdKeyNotFound, self.client.read, "/key")
+
+        self.client.write("/key", "first", prevExist=False)
+        result = self.client.read("/key", quorum=True)
+        self.assertEqual("first", result.value)
+        self.assertEqual(2, result.modifiedIndex)
+        self.assertEqual(2, result.etcd_index)
+
+        # Compare-and-swap writes behave like their v2 equivalents
+        self.assertRaises(etcd.EtcdAlreadyExist,
+                          self.client.write, "/key", "second", prevExist=False)
+        self.assertRaises(ValueError,
+                          self.client.write, "/key", "second", prevIndex=1)
+        result = self.client.write("/key", "second", prevIndex=2)
+        self.assertEqual(3, result.modifiedIndex)
+        self.assertEqual("second", self.client.read("/key").value)
+
+    def test_watch_stream(self):
+        self.client.write("/prefix/a", "1")
+        stream = self.client.watch_transport()
+
+        # Nothing has changed since the write
+        self.assertRaises(etcd.EtcdWatchTimedOut,
+                          stream.watch, "/prefix/", 3, True, 0.2)
+
+        self.client.write("/prefix/a", "2")
+        self.client.write("/prefix/b", "3")
+        result = stream.watch("/prefix/", 3, True, 1)
+        self.assertEqual(("/prefix/a", "2", 3),
+                         (result.key, result.value, result.modifiedIndex))
+        result = stream.watch("/prefix/", 4, True, 1)
+        self.assertEqual(("/prefix/b", "3", 4),
+                         (result.key, result.value, result.modifiedIndex))
+
+        # The stream stayed open across the timeout and both events
+        self.assertEqual(1, stream.connections_established)
+        stream.close()
+
+    def test_concurrent_watches(self):
+        # A long watch on one key doesn't hold up a watch on another
+        self.client.write("/a", "1")
+        self.client.write("/b", "1")
+        errors = []
+
+        def watch_a():
+            try:
+                self.client.read("/a", wait=True, waitIndex=4, timeout=2)
+            except etcd.EtcdWatchTimedOut:
+                pass
+            except Exception as e: # pragma: no cover
+                errors.append(e)
+
+        watcher = Thread(target=watch_a)
+        watcher.start()
+        sleep(0.2)
+
+        self.client.write("/b", "2")
+        start = time()
+        result = self.client.read("/b", wait=True, waitIndex=4, timeout=1)
+        self.assertEqual("2", result.value)
+        self.assertTrue(time() - start < 1)
+
+        watcher.join()
+        self.assertEqual([], errors)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import threading
+import unittest
+from time import sleep
+from metaswitch.clearwater.etcd_shared.event_loop import EventLoop, Priority
+from metaswitch.clearwater.etcd_shared.metrics import metrics
+
+
+class TestEventLoop(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoop("Test loop")
+        self.calls = []
+        metrics.clear()
+
+    def tearDown(self):
+        self.loop.stop(1)
+
+    def test_callbacks_run_in_order(self):
+        self.loop.call_later(0.2, self.calls.append, "late")
+        self.loop.call_later(0.1, self.calls.append, "early")
+        self.loop.call_soon(self.calls.append, "soon")
+        self.loop.call_soon(self.calls.append, "also soon")
+        sleep(0.3)
+
+        self.assertEqual(["soon", "also soon", "early", "late"], self.calls)
+
+    def test_cancel(self):
+        handle = self.loop.call_later(0.1, self.calls.append, "cancelled")
+        self.loop.call_later(0.1, self.calls.append, "kept")
+        self.assertEqual(2, self.loop.pending())
+        handle.cancel()
+        self.assertEqual(1, self.loop.pending())
+        sleep(0.2)
+
+        self.assertEqual(["kept"], self.calls)
+
+    def test_exception_in_callback(self):
+        # An exception doesn't stop the loop running later callbacks
+        self.loop.call_soon(lambda: 1 / 0)
+        self.loop.call_later(0.1, self.calls.append, "after")
+        sleep(0.2)
+
+        self.assertEqual(["after"], self.calls)
+
+    def test_run_in_executor(self):
+        future = self.loop.run_in_executor(lambda x: x * 2, 21)
+        self.assertEqual(42, future.result(1))
+
+    def test_priorities(self):
+        # Block the only worker, then queue work at each priority. It runs
+        # highest priority first, and in order within a priority.
+        self.loop.MAX_WORKERS = 1
+        started = threading.Event()
+        blocked = threading.Event()
+        self.loop.submit(Priority.NORMAL,
+                         lambda: (started.set(), blocked.wait(1)))
+        started.wait(1)
+        self.loop.submit(Priority.LOW, self.calls.append, "low")
+        self.loop.submit(Priority.NORMAL, self.calls.append, "normal")
+        self.loop.submit(Priority.HIGH, self.calls.append, "high")
+        self.loop.submit(Priority.HIGH, self.calls.append, "also high")
+        last = self.loop.submit(Priority.LOW, self.calls.append, "also low")
+        self.assertEqual(5, self.loop.queued())
+        blocked.set()
+        last.result(1)
+
+        self.assertEqual(["high", "also high", "normal", "low", "also low"],
+                         self.calls)
+        self.assertEqual(1, len(self.loop._workers))
+
+    def test_worker_count_bounded(self):
+        release = threading.Event()
+        work = [self.loop.submit(Priority.NORMAL, release.wait, 1)
+                for _ in range(10)]
+        self.assertEqual(self.loop.MAX_WORKERS, len(self.loop._workers))
+        release.set()
+        for future in work:
+            future.result(1)
+
+        # Idle workers are reused rather than new ones started.
+        self.loop.submit(Priority.NORMAL, self.calls.append, "again").result(1)
+        self.assertEqual(self.loop.MAX_WORKERS, len(self.loop._workers))
+
+    def test_exception_in_work(self):
+        future = self.loop.submit(Priority.HIGH, lambda: 1 / 0)
+        self.assertRaises(ZeroDivisionError, future.result, 1)
+        self.assertEqual(42, self.loop.run_in_executor(lambda: 42).result(1))
+
+    def test_latency_recorded(self):
+        self.loop.call_soon(self.calls.append, "timer")
+        self.loop.submit(Priority.LOW, self.calls.append, "work").result(1)
+        sleep(0.1)
+
+        recorded = dict((m["name"], m) for m in metrics.snapshot())
+        self.assertEqual(1, recorded["scheduler_timer_lateness_seconds"]["count"])
+        self.assertEqual({"loop": "Test loop", "priority": "low"},
+                         recorded["scheduler_queue_seconds"]["labels"])
+        self.assertEqual(1, recorded["scheduler_queue_seconds"]["count"])
+
+    def test_stop(self):
+        self.loop.call_later(0.1, self.calls.append, "dropped")
+
+        # Block the only worker until the loop is being stopped
+        self.loop.MAX_WORKERS = 1
+        blocked = threading.Event()
+        running = self.loop.submit(Priority.NORMAL, blocked.wait, 1)
+        queued = self.loop.submit(Priority.NORMAL, self.calls.append, "queued")
+        threading.Timer(0.1, blocked.set).start()
+        self.loop.stop(1)
+
+        # The loop's threads have all finished. The work that had started
+        # completed, but the callback and the queued work never ran
+        self.assertFalse(self.loop._thread.is_alive())
+        self.assertFalse(any(t.is_alive() for t in self.loop._workers))
+        self.assertTrue(running.result(0))
+        self.assertTrue(queued.cancelled())
+        sleep(0.2)
+        self.assertEqual([], self.calls)
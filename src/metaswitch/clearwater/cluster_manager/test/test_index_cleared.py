@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import etcd
+from mock import patch
+from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import MockEtcdClient
+from metaswitch.clearwater.cluster_manager.etcd_synchronizer import \
+    EtcdSynchronizer
+from .dummy_plugin import DummyPlugin
+from .test_base import BaseClusterTest
+
+
+class IndexClearedMockEtcdClient(MockEtcdClient):
+    """The first watch finds that the key has changed more times than etcd
+    keeps history for."""
+    cleared = False
+
+    def read(self, key, wait=False, **kwargs):
+        if wait and not IndexClearedMockEtcdClient.cleared:
+            IndexClearedMockEtcdClient.cleared = True
+            self.write(key, "missed")
+            raise etcd.EtcdEventIndexCleared(
+                "The event in requested index is outdated and cleared")
+        return super(IndexClearedMockEtcdClient, self).read(key,
+                                                            wait=wait,
+                                                            **kwargs)
+
+
+class TestIndexCleared(BaseClusterTest):
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=IndexClearedMockEtcdClient)
+    def test_reread_after_index_cleared(self):
+        IndexClearedMockEtcdClient.cleared = False
+        e = EtcdSynchronizer(DummyPlugin(None), "10.0.0.1")
+        e._client.write("/test", "first")
+        e._last_value = "first"
+
+        # Watch the key directly rather than through the shared watch
+        e.watch_prefix = lambda: None
+
+        with patch.object(e, "pause") as mock_pause:
+            value, index = e.read_from_etcd(wait=True)
+
+        # The synchronizer re-reads the key straight away, rather than
+        # pausing as it would for other errors
+        self.assertEqual("missed", value)
+        self.assertEqual(2, index)
+        self.assertEqual(
+            1, e._metrics.counter("etcd_index_cleared").value)
+        self.assertFalse(mock_pause.called)
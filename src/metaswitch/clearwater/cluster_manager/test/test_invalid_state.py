@@ -18,8 +18,10 @@ class TestInvalidState(BaseClusterTest):
 
     def tearDown(self):
         self.close_synchronizers()
+        super(TestInvalidState, self).tearDown()
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_invalid_state(self):
         """Force an invalid etcd state, and check that the clients don't try to
         change it"""
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from metaswitch.clearwater.etcd_shared.metrics import MetricsRegistry, metrics
+from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import EtcdFactory
+from metaswitch.clearwater.cluster_manager.etcd_synchronizer import \
+    EtcdSynchronizer
+from metaswitch.clearwater.cluster_manager.cluster_state import ClusterInfo
+from .dummy_plugin import DummyPlugin
+from .test_base import BaseClusterTest
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_labels(self):
+        # Metrics with the same name but different labels are distinct
+        self.registry.counter("writes", plugin="a").inc()
+        self.registry.counter("writes", plugin="a").inc()
+        self.registry.labelled(plugin="b").counter("writes").inc(5)
+
+        self.assertEqual(2, self.registry.counter("writes", plugin="a").value)
+        self.assertEqual(5, self.registry.counter("writes", plugin="b").value)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("latency")
+        histogram.observe(0.002)
+        histogram.observe(1000)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(2, snapshot["count"])
+        self.assertEqual(1000, snapshot["max"])
+        self.assertEqual(1, snapshot["buckets"]["0.005"])
+        self.assertEqual(1, snapshot["buckets"]["+Inf"])
+
+    def test_write_stats_file(self):
+        self.registry.counter("writes", plugin="a").inc()
+        path = os.path.join(self.dir, "test.stats")
+        self.registry.write_stats_file(path)
+
+        with open(path) as f:
+            stats = json.load(f)
+        self.assertEqual([{"name": "writes",
+                           "labels": {"plugin": "a"},
+                           "type": "counter",
+                           "value": 1}], stats)
+
+
+class TestSynchronizerMetrics(BaseClusterTest):
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_read_and_write_metrics(self):
+        e = EtcdSynchronizer(DummyPlugin(None), "10.0.0.1")
+        view = json.dumps({"10.0.0.1": "normal"})
+        e._client.write("/test", view)
+        e.read_from_etcd(wait=False)
+
+        self.assertEqual(1, e._metrics.histogram(
+            "etcd_read_seconds", consistency="quorum").count)
+
+        # A contended write is counted
+        e.write_to_etcd(ClusterInfo(view),
+                        {"10.0.0.1": "normal"},
+                        with_index=1000)
+        self.assertEqual(1, e._metrics.counter("etcd_write_contention").value)
+        self.assertEqual(1, e._metrics.histogram("etcd_write_seconds").count)
+
+        names = set(m["name"] for m in metrics.snapshot())
+        self.assertTrue("etcd_read_seconds" in names)
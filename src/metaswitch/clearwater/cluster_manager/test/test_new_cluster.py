@@ -13,6 +13,15 @@ from mock import patch
 from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import EtcdFactory, SlowMockEtcdClient
 import json
 import os
+from threading import current_thread
+from time import sleep
+from metaswitch.clearwater.cluster_manager.cluster_state import ClusterInfo
+from metaswitch.clearwater.cluster_manager.etcd_synchronizer import \
+    EtcdSynchronizer
+from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import \
+    ReadConsistency
+from metaswitch.clearwater.etcd_shared.watch_hub import release_watch_hub
+from .dummy_plugin import DummyPlugin
 from .test_base import BaseClusterTest
 
 
@@ -20,8 +29,10 @@ class TestNewCluster(BaseClusterTest):
 
     def tearDown(self):
         self.close_synchronizers()
+        super(TestNewCluster, self).tearDown()
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_new_cluster(self):
         """Create a new 3-node cluster and check that they all end up
         in NORMAL state"""
@@ -34,7 +45,8 @@ class TestNewCluster(BaseClusterTest):
         self.assertEqual("normal", end.get("10.0.0.1"))
         self.assertEqual("normal", end.get("10.0.0.2"))
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_large_new_cluster(self):
         """Create a new 30-node cluster and check that they all end up
         in NORMAL state"""
@@ -47,10 +59,83 @@ class TestNewCluster(BaseClusterTest):
         self.assertEqual("normal", end.get("10.0.0.19"))
         self.assertEqual("normal", end.get("10.0.0.29"))
 
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_own_writes_not_read_back(self):
+        """Create a new 1-node cluster, and check that the node doesn't
+        re-read the states that it writes itself on its way to NORMAL"""
+        self.make_and_start_synchronizers(1)
+        mock_client = self.syncs[0]._client
+        self.wait_for_all_normal(mock_client, required_number=1)
+        sleep(0.2)
+
+        sync_metrics = self.syncs[0]._metrics
+        writes = sync_metrics.histogram("etcd_write_seconds").count
+        reads = sync_metrics.histogram("etcd_read_seconds",
+                                       consistency="quorum").count
+        self.assertTrue(writes > 1)
+        self.assertEqual(writes,
+                         sync_metrics.counter("etcd_reads_skipped").value)
+
+        # The only read was the one that found there was no cluster yet
+        self.assertEqual(1, reads)
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_read_between_write_and_watch(self):
+        """Check that a read from another thread (e.g. when leaving) between
+        the main loop's write and its next watch doesn't make the main loop
+        read back its own write"""
+        e = EtcdSynchronizer(DummyPlugin(None), "10.0.0.1")
+
+        # This thread plays the part of the synchronizer's main loop
+        e.thread = current_thread()
+        e._client.write("/test", "{}")
+        e.update_from_etcd()
+        e.write_to_etcd(ClusterInfo(e._last_value, e.key(), e._index),
+                        "waiting to join")
+        e.update_from_etcd()
+
+        e.read_from_etcd(wait=False, consistency=ReadConsistency.QUORUM)
+        reads = e._metrics.histogram("etcd_read_seconds",
+                                     consistency="quorum").count
+
+        e._client.write("/test",
+                        json.dumps({"10.0.0.1": "waiting to join",
+                                    "10.0.0.2": "waiting to join"}))
+        self.assertTrue("10.0.0.2" in e.update_from_etcd())
+        self.assertEqual(reads,
+                         e._metrics.histogram("etcd_read_seconds",
+                                              consistency="quorum").count)
+        release_watch_hub(e._watch_hub)
+
+    def test_skipped_read_leaves_probe(self):
+        """Check that when the main loop skips reading back its own write, it
+        doesn't use up the circuit breaker's single half-open probe"""
+        e = EtcdSynchronizer(DummyPlugin(None), "10.0.0.1")
+        e.thread = current_thread()
+        e._client.write("/test", "{}")
+        e.update_from_etcd()
+        e.write_to_etcd(ClusterInfo(e._last_value, e.key(), e._index),
+                        "waiting to join")
+
+        # The breaker opens, and its open period passes
+        breaker = e._retry_policy._breaker
+        for _ in range(breaker.FAILURE_THRESHOLD):
+            breaker.record_failure()
+        breaker._opened_at -= breaker._open_time
+
+        # Skip the read back, and abort the watch before it starts
+        e._abort_read = True
+        e.read_from_etcd()
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+
     @unittest.skipIf(os.environ.get("ETCD_IP"),
                      "Relies on in-memory etcd implementation")
     @unittest.skipUnless(os.environ.get("SLOW"), "SLOW=T not set")
-    @patch("etcd.Client", new=SlowMockEtcdClient)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=SlowMockEtcdClient)
     def test_large_new_cluster_with_delays(self):
         """Create a new 30-node cluster and check that they all end up
         in NORMAL state, even if etcd writes have a random delay that causes
@@ -22,7 +22,8 @@ from .test_base import BaseClusterTest
 
 class TestNodeFailure(BaseClusterTest):
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_failure(self):
 
         # Create synchronisers, using a FailPlugin for one which will crash and
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import json
+import os
+import unittest
+from mock import patch
+from threading import Thread
+from time import sleep
+from metaswitch.clearwater.etcd_shared.metrics import metrics
+from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import \
+    EtcdFactory, MockEtcdClient, default_simulator
+from metaswitch.clearwater.etcd_shared.watch_hub import release_watch_hub
+from metaswitch.clearwater.cluster_manager.etcd_synchronizer import \
+    EtcdSynchronizer
+from .dummy_plugin import DummyPlugin
+from .test_base import BaseClusterTest
+
+
+class TestReactionJitter(BaseClusterTest):
+    def tearDown(self):
+        self.close_synchronizers()
+        default_simulator.latency = 0
+        super(TestReactionJitter, self).tearDown()
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_delay_is_per_node(self):
+        EtcdSynchronizer.REACTION_JITTER = 2
+        delays = [EtcdSynchronizer(DummyPlugin(None),
+                                   "10.0.0.%d" % i).reaction_delay()
+                  for i in range(10)]
+
+        # Each node's delay is within the jitter, the same every time, and
+        # different from the other nodes'
+        self.assertTrue(all(0 <= delay < 2 for delay in delays))
+        self.assertEqual(delays[3],
+                         EtcdSynchronizer(DummyPlugin(None),
+                                          "10.0.0.3").reaction_delay())
+        self.assertEqual(10, len(set(delays)))
+
+        EtcdSynchronizer.REACTION_JITTER = 0
+        self.assertEqual(0, EtcdSynchronizer(DummyPlugin(None),
+                                             "10.0.0.3").reaction_delay())
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_change_while_waiting(self):
+        e = EtcdSynchronizer(DummyPlugin(None), "10.0.0.1")
+        e.reaction_delay = lambda: 0.5
+        e._index = e._client.write("/test", "first").modifiedIndex
+
+        # Nothing changes, so the node goes ahead
+        self.assertEqual(None, e.wait_to_react())
+
+        # Another node writes first, so the node gets its value instead
+        writer = Thread(target=lambda: (sleep(0.1),
+                                        e._client.write("/test", "second")))
+        writer.start()
+        result = e.wait_to_react()
+        writer.join()
+        self.assertEqual("second", result.value)
+        self.assertEqual(1, e._metrics.counter("reactions_superseded").value)
+        release_watch_hub(e._watch_hub)
+
+    def contention_forming_cluster(self, jitter):
+        # Forms a new cluster, returning the number of contended writes
+        MockEtcdClient.clear()
+        metrics.clear()
+        EtcdSynchronizer.REACTION_JITTER = jitter
+        self.make_and_start_synchronizers(10)
+        self.wait_for_all_normal(self.syncs[0]._client,
+                                 required_number=10,
+                                 tries=200)
+        end = json.loads(self.syncs[0]._client.read("/test").value)
+        self.assertEqual(10, len(end))
+        self.assertTrue(all(state == "normal" for state in end.values()))
+        self.close_synchronizers()
+        return metrics.counter("etcd_write_contention",
+                               plugin="DummyPlugin").value
+
+    @unittest.skipUnless(os.environ.get("SLOW"), "SLOW=T not set")
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_less_contention(self):
+        # Every etcd request takes a moment, as it would over the network, so
+        # nodes that react at the same time contend.
+        default_simulator.latency = 0.01
+        without_jitter = self.contention_forming_cluster(0)
+        with_jitter = self.contention_forming_cluster(1)
+        self.assertTrue(with_jitter < without_jitter / 2)
@@ -20,7 +20,8 @@ class TestResilience(BaseClusterTest):
 
     @unittest.skipIf(os.environ.get("ETCD_IP"),
                      "Relies on in-memory etcd implementation")
-    @patch("etcd.Client", new=ExceptionMockEtcdClient)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=ExceptionMockEtcdClient)
     def test_resilience_to_exceptions(self):
         self.make_and_start_synchronizers(15)
         mock_client = self.syncs[0]._client
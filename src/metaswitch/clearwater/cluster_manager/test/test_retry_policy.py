@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import unittest
+from mock import patch
+from metaswitch.clearwater.etcd_shared.retry_policy import \
+    RetryPolicy, CircuitBreaker, EtcdCircuitOpen
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_backoff_grows_with_jitter(self):
+        policy = RetryPolicy("backoff", 0.1, 1)
+
+        with patch("random.uniform", side_effect=lambda low, high: high):
+            caps = [policy.next_delay() for _ in range(6)]
+        self.assertEqual([0.1, 0.2, 0.4, 0.8, 1, 1], caps)
+
+        for _ in range(20):
+            self.assertTrue(0 <= policy.next_delay() <= 1)
+
+        # Success resets the backoff
+        policy.succeeded()
+        with patch("random.uniform", side_effect=lambda low, high: high):
+            self.assertEqual(0.1, policy.next_delay())
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker("breaker")
+
+        for _ in range(CircuitBreaker.FAILURE_THRESHOLD - 1):
+            breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state())
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state())
+        self.assertFalse(breaker.allow_request())
+
+        # Once the open period has passed a single probe is let through
+        breaker._opened_at -= CircuitBreaker.INITIAL_OPEN_TIME
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state())
+        self.assertFalse(breaker.allow_request())
+
+        # The probe failing re-opens the breaker for longer
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state())
+        breaker._opened_at -= CircuitBreaker.INITIAL_OPEN_TIME
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_success()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state())
+        self.assertTrue(breaker.allow_request())
+
+    def test_open_circuit_refuses_requests(self):
+        policy = RetryPolicy("refuse", 0.1, 1)
+        error = IOError()
+        for _ in range(CircuitBreaker.FAILURE_THRESHOLD):
+            policy.failed(error)
+        self.assertRaises(EtcdCircuitOpen, policy.check)
+
+        # Refused requests don't count as further failures
+        policy.failed(EtcdCircuitOpen())
+        policy.succeeded()
+        policy.check()
@@ -20,7 +20,8 @@ from time import sleep
 
 class TestScaleDown(BaseClusterTest):
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_scale_down(self):
         # Start with a stable cluster of four nodes
         syncs = [EtcdSynchronizer(DummyPlugin(None), ip) for ip in
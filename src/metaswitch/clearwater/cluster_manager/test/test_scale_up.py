@@ -19,7 +19,8 @@ from .test_base import BaseClusterTest
 
 class TestScaleUp(BaseClusterTest):
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_scale_up(self):
         # Create an existing cluster of two nodes, and a third new node
         sync1 = EtcdSynchronizer(DummyPlugin(None), '10.0.0.1')
@@ -38,7 +39,8 @@ class TestScaleUp(BaseClusterTest):
         for s in [sync1, sync2, sync3]:
             s.terminate()
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_two_new_nodes(self):
         # Create an existing cluster of two nodes, and a third and fourth new
         # node at the same time
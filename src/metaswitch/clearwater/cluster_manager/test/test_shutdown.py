@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import etcd
+from mock import patch
+from threading import Thread
+from time import sleep
+from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import EtcdFactory
+from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import \
+    shutdown_time
+from metaswitch.clearwater.etcd_shared.watch_hub import release_watch_hub
+from metaswitch.clearwater.cluster_manager.etcd_synchronizer import \
+    EtcdSynchronizer
+from .dummy_plugin import DummyPlugin
+from .test_base import BaseClusterTest
+
+
+class TestShutdown(BaseClusterTest):
+    def interrupted(self, e, target):
+        # Runs target on another thread, tells the synchronizer to terminate
+        # once it's blocked, and returns how long it then took to return
+        thread = Thread(target=target)
+        thread.start()
+        sleep(0.2)
+        e._terminate_flag = True
+        thread.join(5)
+        self.assertFalse(thread.isAlive())
+        return shutdown_time([e])
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_pause_interrupted(self):
+        e = EtcdSynchronizer(DummyPlugin(None), "10.0.0.1")
+        self.assertEqual(0, shutdown_time([e]))
+        self.assertTrue(self.interrupted(e, lambda: e.interruptible_sleep(10))
+                        < 1)
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_watch_interrupted(self):
+        e = EtcdSynchronizer(DummyPlugin(None), "10.0.0.1")
+        e._client.write("/test", "first")
+
+        errors = []
+
+        def watch():
+            try:
+                e.watch_for_change(2, 10)
+            except etcd.EtcdWatchTimedOut as error:
+                errors.append(error)
+
+        # The watch gives up as soon as we're told to terminate, rather than
+        # waiting out its timeout
+        self.assertTrue(self.interrupted(e, watch) < 1)
+        self.assertEqual(1, len(errors))
+
+        # The synchronizer's thread would normally release the shared watch
+        release_watch_hub(e._watch_hub)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import os
+import shutil
+import tempfile
+from mock import patch
+from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import EtcdFactory
+from metaswitch.clearwater.etcd_shared import state_cache
+from metaswitch.clearwater.etcd_shared.state_cache import StateCache
+from metaswitch.clearwater.etcd_shared.watch_hub import release_watch_hub
+from metaswitch.clearwater.cluster_manager.cluster_state import ClusterInfo
+from metaswitch.clearwater.cluster_manager.etcd_synchronizer import \
+    EtcdSynchronizer
+from .dummy_plugin import DummyPlugin
+from .test_base import BaseClusterTest
+
+
+class RecordingPlugin(DummyPlugin):
+    def __init__(self, params):
+        super(RecordingPlugin, self).__init__(params)
+        self.calls = []
+        self.up_to_date = True
+
+    def on_startup(self, cluster_view):
+        self.calls.append("on_startup")
+
+    def on_stable_cluster(self, cluster_view):
+        self.calls.append("on_stable_cluster")
+
+    def is_up_to_date(self, cluster_view):
+        return self.up_to_date
+
+
+class TestStateCache(BaseClusterTest):
+    def setUp(self):
+        super(TestStateCache, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.state")
+
+    def tearDown(self):
+        state_cache._state_cache = None
+        shutil.rmtree(self.dir)
+        super(TestStateCache, self).tearDown()
+
+    def test_persisted(self):
+        cache = StateCache(self.path)
+        self.assertFalse(cache.matches("/key", 1, "value"))
+        cache.record("/key", 1, u"value")
+
+        # A new cache (as after a restart) reads what was recorded
+        cache = StateCache(self.path)
+        self.assertTrue(cache.matches("/key", 1, "value"))
+        self.assertFalse(cache.matches("/key", 2, "value"))
+        self.assertFalse(cache.matches("/key", 1, "other value"))
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_corrupt_file_ignored(self):
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        self.assertFalse(StateCache(self.path).matches("/key", 1, "value"))
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_unchanged_since_restart(self):
+        state_cache.configure_state_cache(os.path.join(self.dir, "test.pid"))
+        e = EtcdSynchronizer(DummyPlugin(None), "10.0.0.1")
+        result = e._client.write("/test", "{}")
+        state_cache.get_state_cache().record("/test",
+                                             result.modifiedIndex,
+                                             "{}")
+
+        e.update_from_etcd()
+        self.assertTrue(e.unchanged_since_restart())
+
+        # Only the first value after a restart counts
+        e._client.write("/test", "{\"10.0.0.2\": \"normal\"}")
+        e.update_from_etcd()
+        self.assertFalse(e.unchanged_since_restart())
+
+        # Having handled the first value, the synchronizer watched for the
+        # second rather than reading it
+        release_watch_hub(e._watch_hub)
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_restart_in_steady_state(self):
+        state_cache.configure_state_cache(os.path.join(self.dir, "test.pid"))
+        plugin = RecordingPlugin(None)
+        e = EtcdSynchronizer(plugin, "10.0.0.1")
+        value = "{\"10.0.0.1\": \"normal\"}"
+        result = e._client.write("/test", value)
+        state_cache.get_state_cache().record("/test",
+                                             result.modifiedIndex,
+                                             value)
+        e.update_from_etcd()
+        cluster_info = ClusterInfo(e._last_value, e.key(), e._index)
+
+        # The plugin isn't asked to reapply the stable cluster, but is still
+        # told that we've started
+        self.assertTrue(e.already_handled(cluster_info))
+        e._fsm.next(cluster_info.local_state("10.0.0.1"),
+                    cluster_info.cluster_state,
+                    cluster_info.view,
+                    already_handled=True)
+        self.assertEqual(["on_startup"], plugin.calls)
+
+        # Unless it says it's out of date
+        plugin.up_to_date = False
+        self.assertFalse(e.already_handled(cluster_info))
+        e._fsm.next(cluster_info.local_state("10.0.0.1"),
+                    cluster_info.cluster_state,
+                    cluster_info.view)
+        self.assertEqual(["on_startup", "on_stable_cluster"], plugin.calls)
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_plugin_gets_own_view(self):
+        # The parsed view is shared, but a plugin can change its copy
+        class ChangingPlugin(RecordingPlugin):
+            def on_stable_cluster(self, cluster_view):
+                cluster_view["10.0.0.1"] = "changed"
+                self.calls.append("on_stable_cluster")
+
+        plugin = ChangingPlugin(None)
+        e = EtcdSynchronizer(plugin, "10.0.0.1")
+        value = "{\"10.0.0.1\": \"normal\"}"
+        cluster_info = ClusterInfo(value, "/test", 1)
+        e._fsm.next("normal", cluster_info.cluster_state, cluster_info.view)
+
+        self.assertEqual(["on_startup", "on_stable_cluster"], plugin.calls)
+        self.assertEqual("normal",
+                         ClusterInfo(value, "/test", 1).local_state("10.0.0.1"))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import unittest
+from metaswitch.clearwater.etcd_shared.value_cache import \
+    ValueCache, encode, thaw
+
+
+class TestValueCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ValueCache()
+
+    def test_parse_once(self):
+        value = '{"queue": [{"id": "a"}]}'
+        first = self.cache.decode("/test", 1, value)
+        self.assertIs(first, self.cache.decode("/test", 1, value))
+        self.assertEqual(1, self.cache.misses)
+        self.assertEqual(1, self.cache.hits)
+
+        # A new revision is parsed again
+        second = self.cache.decode("/test", 2, value)
+        self.assertIsNot(first, second)
+        self.assertEqual(first, second)
+
+        # Values without an index aren't cached
+        self.assertIsNot(self.cache.decode("/test", None, value),
+                         self.cache.decode("/test", None, value))
+
+    def test_mismatched_value(self):
+        # A different value at the same index isn't mistaken for the cached one
+        self.cache.decode("/test", 1, '{"a": 1}')
+        self.assertEqual({"a": 2}, self.cache.decode("/test", 1, '{"a": 2}'))
+
+    def test_immutable(self):
+        value = self.cache.decode("/test", 1, '{"queue": [{"id": "a"}]}')
+        self.assertRaises(TypeError, value.__setitem__, "queue", [])
+        self.assertRaises(TypeError, value.pop, "queue")
+        self.assertRaises(TypeError, value["queue"].append, {"id": "b"})
+        self.assertRaises(TypeError, value["queue"][0].update, {"id": "b"})
+
+        # A thawed copy can be changed, and compares equal until it is
+        mutable = thaw(value)
+        self.assertEqual(value, mutable)
+        mutable["queue"].append({"id": "b"})
+        self.assertNotEqual(value, mutable)
+
+    def test_canonical_encoding(self):
+        value = self.cache.decode("/test", 1, '{"b": 1, "a": [2, 1]}')
+        self.assertEqual('{"a": [2, 1], "b": 1}', encode(value))
+        self.assertIs(encode(value), encode(value))
+        self.assertEqual(encode(value), encode(thaw(value)))
+
+    def test_eviction(self):
+        self.cache.MAX_ENTRIES = 2
+        for index in range(3):
+            self.cache.decode("/test", index, "{}")
+        self.cache.decode("/test", 0, "{}")
+        self.assertEqual(4, self.cache.misses)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import unittest
+from metaswitch.clearwater.etcd_shared.value_codec import \
+    decode_value, encode_value, is_compressed, ValueDecodeError, MAGIC_PREFIX
+
+
+class TestValueCodec(unittest.TestCase):
+    def test_round_trip(self):
+        value = u"<ifc>\x80" + u"repeated " * 10000 + u"</ifc>"
+        encoded = encode_value(value)
+        self.assertTrue(is_compressed(encoded))
+        self.assertTrue(len(encoded) < len(value) / 10)
+        self.assertEqual(value, decode_value(encoded))
+
+    def test_plain_values(self):
+        # Small values, and values written without compression, are stored
+        # and read as they are
+        self.assertEqual("small", encode_value("small"))
+        large = "x" * 100000
+        self.assertEqual(large, encode_value(large, compress=False))
+        self.assertEqual(large, decode_value(large))
+        self.assertEqual(None, decode_value(None))
+
+    def test_corrupt_value(self):
+        self.assertRaises(ValueDecodeError,
+                          decode_value,
+                          MAGIC_PREFIX + "bm90IHpsaWI=")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import logging
+import unittest
+from mock import MagicMock
+from metaswitch.clearwater.etcd_shared.metrics import Counter
+from metaswitch.clearwater.etcd_shared.value_log import \
+    FullValueLog, ValueSummary
+
+
+class TestValueLog(unittest.TestCase):
+    def test_summary(self):
+        self.assertEqual("key=/test index=3 size=5 crc32=3610a686",
+                         str(ValueSummary("/test", 3, "hello")))
+        self.assertEqual("key=/test index=None no value",
+                         str(ValueSummary("/test", None, None)))
+
+    def test_full_values_rate_limited(self):
+        logger = MagicMock()
+        logger.isEnabledFor.return_value = True
+        suppressed = Counter()
+        log = FullValueLog(logger, suppressed)
+
+        log.log("/test", 1, "first")
+        log.log("/test", 2, "second")
+        log.log("/other", 1, "other")
+        self.assertEqual(2, logger.debug.call_count)
+        self.assertEqual(1, suppressed.value)
+
+        # Once the interval has passed, the next value is logged along with
+        # how many weren't
+        log.FULL_VALUE_INTERVAL = 0
+        log.log("/test", 3, "third")
+        self.assertEqual(1, logger.debug.call_args[0][2])
+        self.assertEqual("third", logger.debug.call_args[0][3])
+
+    def test_nothing_done_unless_debugging(self):
+        logger = MagicMock()
+        logger.isEnabledFor.side_effect = lambda level: level > logging.DEBUG
+        suppressed = Counter()
+        log = FullValueLog(logger, suppressed)
+        log.log("/test", 1, "first")
+        log.log("/test", 2, "second")
+        self.assertFalse(logger.debug.called)
+        self.assertEqual(0, suppressed.value)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import unittest
+import etcd
+from time import sleep, time
+from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import MockEtcdClient
+from metaswitch.clearwater.etcd_shared.retry_policy import RetryPolicy
+from metaswitch.clearwater.etcd_shared.watch_hub import \
+    acquire_watch_hub, release_watch_hub
+
+
+class FailingClient(object):
+    base_uri = "http://failing:4000"
+
+    def read(self, *args, **kwargs):
+        raise etcd.EtcdConnectionFailed("Connection refused")
+
+
+class TestWatchHub(unittest.TestCase):
+    def setUp(self):
+        MockEtcdClient.clear()
+        self.client = MockEtcdClient(None, None)
+
+    def test_shared_between_users(self):
+        hub1 = acquire_watch_hub(self.client, "/prefix/")
+        hub2 = acquire_watch_hub(self.client, "/prefix/")
+        other = acquire_watch_hub(self.client, "/other/")
+        self.assertIs(hub1, hub2)
+        self.assertIsNot(hub1, other)
+        for hub in [hub1, hub2, other]:
+            release_watch_hub(hub)
+
+        # Once all users have gone a fresh hub is created
+        hub3 = acquire_watch_hub(self.client, "/prefix/")
+        self.assertIsNot(hub1, hub3)
+        release_watch_hub(hub3)
+
+    def test_delivers_change(self):
+        self.client.write("/prefix/key", "first")
+        hub = acquire_watch_hub(self.client, "/prefix/")
+
+        # Nothing has changed since the first write
+        self.assertRaises(etcd.EtcdWatchTimedOut,
+                          hub.wait_for_change, "/prefix/key", 2, 0)
+
+        self.client.write("/prefix/key", "second")
+        result = hub.wait_for_change("/prefix/key", 2, 1)
+        self.assertEqual("second", result.value)
+        self.assertEqual(2, result.modifiedIndex)
+
+        # The hub doesn't know about changes from before it started watching
+        self.assertIsNone(hub.wait_for_change("/prefix/key", 1, 0))
+        release_watch_hub(hub)
+
+    def test_is_current(self):
+        self.client.write("/prefix/key", "first")
+        hub = acquire_watch_hub(self.client, "/prefix/")
+
+        # The hub can't vouch for anything until it's watching
+        self.assertFalse(hub.is_current("/prefix/key", 1, 1))
+
+        # Once the watch has completed a round without errors, it can
+        self.assertRaises(etcd.EtcdWatchTimedOut,
+                          hub.wait_for_change, "/prefix/key", 2, 0)
+        for _ in range(10):
+            if hub.is_current("/prefix/key", 1, 1):
+                break
+            sleep(0.1)
+        self.assertTrue(hub.is_current("/prefix/key", 1, 1))
+
+        # A value read before the hub started watching can't be vouched for
+        self.assertFalse(hub.is_current("/prefix/key", 0, 0))
+
+        self.client.write("/prefix/key", "second")
+        hub.wait_for_change("/prefix/key", 2, 1)
+        self.assertFalse(hub.is_current("/prefix/key", 1, 1))
+        self.assertTrue(hub.is_current("/prefix/key", 2, 2))
+        release_watch_hub(hub)
+
+    def test_stop_during_back_off(self):
+        hub = acquire_watch_hub(FailingClient(), "/prefix/")
+        hub._retry_policy = RetryPolicy(FailingClient.base_uri, 30, 30)
+        try:
+            hub.wait_for_change("/prefix/key", 1, 0.2)
+        except etcd.EtcdWatchTimedOut:
+            pass
+
+        # The hub's thread is backing off after its watch failed, but
+        # releasing the hub cuts that short and waits for the thread to exit
+        start = time()
+        release_watch_hub(hub)
+        self.assertFalse(hub._thread.is_alive())
+        self.assertLess(time() - start, hub.STOP_TIMEOUT)
+
+    def test_failing_watch(self):
+        hub = acquire_watch_hub(FailingClient(), "/prefix/")
+        hub._retry_policy = RetryPolicy(FailingClient.base_uri, 30, 30)
+
+        # Waiters are told to watch for themselves as soon as the hub's watch
+        # fails, rather than waiting out the hub's back-off
+        start = time()
+        self.assertIsNone(hub.wait_for_change("/prefix/key", 1, 5))
+        self.assertLess(time() - start, 1)
+        self.assertIsNone(hub.wait_for_change("/prefix/key", 1, 5))
+        release_watch_hub(hub)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import unittest
+from time import sleep, time
+from metaswitch.clearwater.etcd_shared.metrics import metrics
+from metaswitch.clearwater.etcd_shared.watch_lag import \
+    LatestIndex, WatchLagMonitor
+
+
+class TestWatchLag(unittest.TestCase):
+    def setUp(self):
+        metrics.clear()
+        self.latest = LatestIndex()
+        self.monitor = WatchLagMonitor("TestPlugin",
+                                       metrics.labelled(plugin="test"),
+                                       latest=self.latest)
+
+    def test_staleness(self):
+        # While watching, the synchronizer is up to date however long it waits
+        with self.monitor.watching(5):
+            self.assertFalse(self.monitor.check(time() + 1000))
+        self.assertFalse(self.monitor.check())
+
+        # It falls behind if it doesn't watch again for too long
+        self.assertTrue(self.monitor.check(time() + 200))
+        self.assertEqual(1, metrics.gauge("watch_lagging",
+                                          plugin="test").value)
+        self.assertTrue(metrics.gauge("watch_staleness_seconds",
+                                      plugin="test").value > 100)
+
+        # Still lagging, but that's only counted once
+        self.assertTrue(self.monitor.check(time() + 300))
+        self.assertEqual(1, metrics.counter("watch_lag_events",
+                                            plugin="test").value)
+
+        with self.monitor.watching(5):
+            self.assertFalse(self.monitor.check())
+        self.assertEqual(0, metrics.gauge("watch_lagging",
+                                          plugin="test").value)
+
+    def test_index_lag(self):
+        with self.monitor.watching(11):
+            pass
+        self.monitor.saw_index(20)
+        self.assertEqual(10, self.monitor.lag()[1])
+        self.assertFalse(self.monitor.check())
+
+        # Another synchronizer sees the cluster has moved a long way on
+        self.latest.update(2000)
+        self.assertTrue(self.monitor.check())
+        self.assertEqual(1990, metrics.gauge("watch_lag_indexes",
+                                             plugin="test").value)
+
+    def test_periodic_check(self):
+        self.monitor.CHECK_INTERVAL = 0.05
+        self.monitor.STALENESS_THRESHOLD = 0.1
+        self.monitor.start()
+        try:
+            sleep(0.5)
+        finally:
+            self.monitor.stop()
+        self.assertEqual(1, metrics.gauge("watch_lagging",
+                                          plugin="test").value)
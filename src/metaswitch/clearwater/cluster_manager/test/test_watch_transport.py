@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+
+import etcd
+import unittest
+from time import time
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
+from metaswitch.clearwater.etcd_shared.metrics import metrics
+from metaswitch.clearwater.etcd_shared.retry_policy import \
+    CircuitBreaker, circuit_breaker_for
+from metaswitch.clearwater.etcd_shared.watch_hub import \
+    acquire_watch_hub, release_watch_hub
+from metaswitch.clearwater.etcd_shared.watch_transport import \
+    KeepAliveWatchTransport
+from metaswitch.clearwater.etcd_tests.etcdstandin import EtcdStandInServer
+
+SERVER_IP = "127.0.0.248"
+
+
+class TestKeepAliveWatchTransport(unittest.TestCase):
+    # The stand-in server sends a watch's headers straight away, as etcd
+    # does, so these check that the transport copes with a watch whose headers
+    # have arrived but whose body hasn't.
+    def setUp(self):
+        self.server = EtcdStandInServer(SERVER_IP)
+        self.client = EtcdV2Client(SERVER_IP, 4000)
+        self.transport = KeepAliveWatchTransport(SERVER_IP, 4000)
+        self.transport.READ_TIMEOUT = 0.5
+
+    def tearDown(self):
+        self.transport.close()
+        self.client.close()
+        self.server.exit()
+
+    def test_idle_watch(self):
+        self.client.write("/key", "first")
+
+        # The watch stays idle for well over READ_TIMEOUT, which is fine
+        deadline = time() + 1.5
+        while time() < deadline:
+            self.assertRaises(etcd.EtcdWatchTimedOut,
+                              self.transport.watch, "/key", 2, timeout=0.2)
+
+        self.client.write("/key", "second")
+        result = self.transport.watch("/key", 2, timeout=1)
+        self.assertEqual("second", result.value)
+
+        # That all happened on the same connection
+        self.assertEqual(1, self.transport.connections_established)
+
+    def test_change_already_happened(self):
+        self.client.write("/key", "first")
+        self.client.write("/key", "second")
+        self.assertEqual("first",
+                         self.transport.watch("/key", 1, timeout=1).value)
+        self.assertEqual("second",
+                         self.transport.watch("/key", 2, timeout=1).value)
+
+    def test_idle_hub(self):
+        # A shared watch on a quiet key doesn't count as failing
+        metrics.clear()
+        self.client.write("/prefix/key", "first")
+        hub = acquire_watch_hub(self.client, "/prefix/")
+        hub._transport.READ_TIMEOUT = 0.5
+        hub.WATCH_TIMEOUT = 0.2
+        try:
+            deadline = time() + 1.5
+            while time() < deadline:
+                self.assertRaises(etcd.EtcdWatchTimedOut,
+                                  hub.wait_for_change, "/prefix/key", 2, 0.2)
+
+            self.assertTrue(hub.is_current("/prefix/key", 1, 1))
+            self.assertEqual(CircuitBreaker.CLOSED,
+                             circuit_breaker_for(self.client.base_uri).state())
+            self.assertEqual(0, metrics.counter(
+                "etcd_watch_errors", watch_prefix="/prefix/").value)
+            self.assertEqual(1, hub.connections_established())
+
+            self.client.write("/prefix/key", "second")
+            result = hub.wait_for_change("/prefix/key", 2, 1)
+            self.assertEqual("second", result.value)
+        finally:
+            release_watch_hub(hub)
@@ -26,8 +26,10 @@ class TestWatcherPlugin(BaseClusterTest):
 
     def tearDown(self):
         self.close_synchronizers()
+        super(TestWatcherPlugin, self).tearDown()
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_watcher(self):
         """Create a new 3-node cluster with one plugin not in the cluster and
         check that the main three all end up in NORMAL state"""
@@ -52,7 +54,8 @@ class TestWatcherPlugin(BaseClusterTest):
 
         e.terminate()
 
-    @patch("etcd.Client")
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client")
     def test_leaving(self, client):
         """Create a plugin not in the cluster and try to leave the cluster.
         Nothing should be written to etcd."""
@@ -64,7 +67,8 @@ class TestWatcherPlugin(BaseClusterTest):
 
         e.terminate()
 
-    @patch("etcd.Client")
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client")
     def test_mark_failed(self, client):
         """Create a plugin not in the cluster and try to mark it as failed.
         Nothing should be written to etcd."""
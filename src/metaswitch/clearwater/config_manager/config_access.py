@@ -18,6 +18,9 @@ import datetime
 import time
 import collections
 from metaswitch.clearwater.config_manager.config_type_plugin_loader import load_plugins_in_dir
+from metaswitch.clearwater.etcd_shared.etcd_cluster_client import EtcdClusterClient
+from metaswitch.clearwater.etcd_shared.value_codec import \
+    decode_value, encode_value, ValueDecodeError
 from metaswitch.common.logging_config import configure_syslog
 from metaswitch.common.user_access_control import get_user_name
 from metaswitch.common.user_access_control import audit_log
@@ -56,6 +59,9 @@ CANT_COMPARE_WITH_MASTER = ("Unable to compare with master configuration "
 UNABLE_TO_UPLOAD = ("Unable to upload {} to the configuration database. The "
 "upload has failed.")
 
+CANT_DECODE_REMOTE_CONFIG = ("Unable to decode {} from the configuration "
+"database. The stored value may be corrupt.")
+
 NO_CONFIG_FOUND = "There are no ConfigType plugins found at {}".format(
     PLUGIN_DIR)
 
@@ -131,12 +137,16 @@ class ConfigLoader(object):
     ETCD_UNHEALTHY_INDICATORS = ["cluster is unhealthy",
                                  "cluster may be unhealthy"]
 
-    def __init__(self, etcd_client, etcd_key, site):
+    def __init__(self, etcd_client, etcd_key, site, compress=False):
         # In addition to standard init, we store off the URL to query on the
         # etcd API that will get us our config.
         self._etcd_client = etcd_client
         self.prefix = "/".join(["", etcd_key, site, "configuration"])
 
+        # Whether to store large config values compressed. Compressed values
+        # are always read correctly, whatever this is set to.
+        self._compress = compress
+
         # Make sure that the etcd process is actually contactable.
         self._check_connection()
 
@@ -212,7 +222,14 @@ class ConfigLoader(object):
             first_index = 0
             return first_value, first_index
 
-        return download.value, download.modifiedIndex
+        try:
+            value = decode_value(download.value)
+        except ValueDecodeError:
+            log.error("Unable to decode %s from etcd", key_path)
+            raise ConfigDownloadFailed(
+                CANT_DECODE_REMOTE_CONFIG.format(selected_config.name))
+
+        return value, download.modifiedIndex
 
     def write_config_to_etcd(self,
                              local_store,
@@ -223,6 +240,7 @@ class ConfigLoader(object):
         Raises a ConfigUploadFailed exception if unsuccessful.
         """
         key_path = "/".join([self.prefix, selected_config.name])
+        upload = encode_value(upload, self._compress)
 
         try:
             if prev_revision == 0:
@@ -363,12 +381,13 @@ def main(args, config_filename):
     # leave unused files on disk.
     delete_outdated_config_files()
 
-    # Create an etcd client for interacting with the database.
+    # Create an etcd client for interacting with the database. This uses
+    # whichever etcd member is answering best, so that cw-config still works
+    # if the local member is struggling.
     try:
         log.debug("Getting etcdClient with parameters %s, 4000",
                   args.management_ip)
-        etcd_client = etcd.client.Client(host=args.management_ip,
-                                         port=4000)
+        etcd_client = EtcdClusterClient(host=args.management_ip, port=4000)
         local_store = LocalStore(args.download_dir)
 
         config_location = local_store.config_location(config_filename)
@@ -376,7 +395,8 @@ def main(args, config_filename):
         selected_config = lookup_config_type(args.config_type, config_location)
         config_loader = ConfigLoader(etcd_client=etcd_client,
                                      etcd_key=args.etcd_key,
-                                     site=args.site)
+                                     site=args.site,
+                                     compress=(args.compress_config == "Y"))
     except (etcd.EtcdException, EtcdConnectionFailed):
         log.error("etcd cluster uncontactable")
         sys.exit("Unable to contact the etcd cluster.")
@@ -508,6 +528,9 @@ def parse_arguments():
                         help=argparse.SUPPRESS)
     parser.add_argument("--site", required=True, help=argparse.SUPPRESS)
     parser.add_argument("--etcd_key", required=True, help=argparse.SUPPRESS)
+    parser.add_argument("--compress_config",
+                        default="N",
+                        help=argparse.SUPPRESS)
 
     args = parser.parse_args()
     config_filename = next(config.file_download_name for config in config_classes
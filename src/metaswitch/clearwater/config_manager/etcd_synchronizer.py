@@ -5,11 +5,12 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
-from hashlib import sha512
-
 from .pdlogs import FILE_CHANGED
+from .plugin_base import FileStatus
 from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import CommonEtcdSynchronizer
-from metaswitch.common import utils
+from metaswitch.clearwater.etcd_shared.value_codec import \
+    decode_value, ValueDecodeError
+from metaswitch.clearwater.etcd_shared.value_log import ValueSummary
 import logging
 
 _log = logging.getLogger("config_manager.etcd_synchronizer")
@@ -26,21 +27,46 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
         # Continue looping while the service is running.
         while not self._terminate_flag:
             # This blocks on changes to the watched key in etcd.
-            _log.debug("Waiting for change from etcd for key {}".format(
-                         self._plugin.key()))
+            _log.debug("Waiting for change from etcd for key %s",
+                       self._plugin.key())
             old_value = self._last_value
             value = self.update_from_etcd()
             if self._terminate_flag:
                 break
 
-            if value and value != old_value:
-                _log.info("Got new config value from etcd - filename {}, file size {}, SHA512 hash {}".format(
-                    self._plugin.file(),
-                    len(value),
-                    sha512(utils.safely_encode(value)).hexdigest()))
-                _log.debug("Got new config value from etcd:\n{}".format(
-                           utils.safely_encode(value)))
-                self._plugin.on_config_changed(value, self._alarm)
+            if not value or (value == old_value and
+                             not self.unchanged_since_restart()):
+                continue
+
+            # Large values may be stored compressed. We only decompress them
+            # once we know we need to look at them.
+            try:
+                decoded_value = decode_value(value)
+            except ValueDecodeError as e:
+                _log.error("Unable to decode config value for {}: {}".format(
+                    self._plugin.file(), e))
+                continue
+
+            if (self.unchanged_since_restart() and
+                self._plugin.status(decoded_value) == FileStatus.UP_TO_DATE):
+                # We'd already written this value to disk before we restarted,
+                # so there's nothing to do.
+                _log.info("Config file {} is unchanged since restart".format(
+                    self._plugin.file()))
+                if self._alarm:
+                    self._alarm.update_file(self._plugin.file())
+            else:
+                _log.info("Got new config value from etcd - filename %s, "
+                          "file size %d (%s)",
+                          self._plugin.file(),
+                          len(decoded_value),
+                          ValueSummary(self.key(), self._index, value))
+                self._full_value_log.log(self.key(),
+                                         self._index,
+                                         decoded_value)
+                with self._metrics.histogram("plugin_hook_seconds",
+                                             hook="on_config_changed").time():
+                    self._plugin.on_config_changed(decoded_value, self._alarm)
                 FILE_CHANGED.log(filename=self._plugin.file())
 
     def key(self):
@@ -12,6 +12,7 @@
 Usage:
   main.py --local-ip=IP --local-site=SITE --etcd-key=KEY [--foreground]
           [--log-level=LVL] [--log-directory=DIR] [--pidfile=FILE]
+          [--etcd-api=VERSION] [--etcd-endpoints=MODE]
 
 Options:
   -h --help                   Show this screen.
@@ -22,12 +23,18 @@ Options:
   --log-level=LVL             Level to log at, 0-4 [default: 3]
   --log-directory=DIR         Directory to log to [default: ./]
   --pidfile=FILE              Pidfile to write [default: ./config-manager.pid]
+  --etcd-api=VERSION          Etcd API to use, v2 or v3 [default: v2]
+  --etcd-endpoints=MODE       Etcd members to use: local, cluster, hedged or leader [default: local]
 
 """
 
 from docopt import docopt, DocoptExit
 
 from metaswitch.common import logging_config, utils
+from metaswitch.clearwater.etcd_shared.state_cache import configure_state_cache
+from metaswitch.clearwater.etcd_shared.metrics import export_stats_file
+from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import \
+    shutdown_time
 from metaswitch.clearwater.etcd_shared.plugin_loader \
     import load_plugins_in_dir
 from metaswitch.clearwater.config_manager.etcd_synchronizer \
@@ -65,6 +72,8 @@ def main(args):
     etcd_key = arguments['--etcd-key']
     log_dir = arguments['--log-directory']
     log_level = LOG_LEVELS.get(arguments['--log-level'], logging.DEBUG)
+    EtcdSynchronizer.ETCD_API = arguments['--etcd-api']
+    EtcdSynchronizer.ETCD_ENDPOINTS = arguments['--etcd-endpoints']
 
     stdout_err_log = os.path.join(log_dir, "config-manager.output.log")
 
@@ -94,6 +103,13 @@ def main(args):
         # We failed to take the lock - another process is already running
         exit(1)
 
+    # Keep track of what we've handled in a file alongside the pidfile, so
+    # that a restart doesn't redo work unnecessarily.
+    configure_state_cache(arguments['--pidfile'])
+
+    # Periodically write out performance metrics alongside the pidfile.
+    export_stats_file(arguments['--pidfile'])
+
     plugins_dir = "/usr/share/clearwater/clearwater-config-manager/plugins/"
     plugins = load_plugins_in_dir(plugins_dir)
     plugins.sort(key=lambda x: x.key())
@@ -125,8 +141,9 @@ def main(args):
                 thr.join(1)
 
     while not utils.should_quit:
-        sleep(1)
+        sleep(0.1)
 
     _log.info("Clearwater Configuration Manager shutting down")
-    pdlogs.EXITING.log()
+    pdlogs.EXITING.log(
+        shutdown_time="{:.3f}".format(shutdown_time(synchronizers)))
     syslog.closelog()
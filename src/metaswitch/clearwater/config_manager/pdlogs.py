@@ -17,7 +17,7 @@ STARTUP = PDLog(
 EXITING = PDLog(
     number=PDLog.CL_CONFIG_MGR_ID+2,
     desc="clearwater-config-manager is exiting.",
-    cause="The application is exiting.",
+    cause="The application is exiting. Stopping it took {shutdown_time} seconds.",
     effect="Configuration management services are no longer available.",
     action="This occurs normally when the application is stopped. Wait for monit "+\
       "to restart the application.",
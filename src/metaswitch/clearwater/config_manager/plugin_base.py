@@ -46,3 +46,9 @@ class ConfigPluginBase(object): # pragma : no cover
         should also report the status of the controlled file to the alarm
         manager."""
         pass
+
+    def coalescing_window(self):
+        """How long (in seconds) to wait for further changes to the key
+        before calling on_config_changed, or None to use the config manager's
+        default."""
+        return None
@@ -12,6 +12,7 @@ import unittest
 from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import EtcdFactory
 from metaswitch.clearwater.config_manager.etcd_synchronizer import \
     EtcdSynchronizer
+from metaswitch.clearwater.etcd_shared.value_codec import encode_value
 from .plugin import TestPlugin
 from mock import patch
 from threading import Thread
@@ -19,7 +20,8 @@ from time import sleep
 
 
 class BasicTest(unittest.TestCase):
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_synchronisation(self):
         p = TestPlugin()
         e = EtcdSynchronizer(p, "10.0.0.1", "local", None, "clearwater")
@@ -41,7 +43,8 @@ class BasicTest(unittest.TestCase):
         e._terminate_flag = True
         sleep(1)
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_key_not_present(self):
         p = TestPlugin()
         e = EtcdSynchronizer(p, "10.0.0.1", "local", None, "clearwater")
@@ -57,7 +60,8 @@ class BasicTest(unittest.TestCase):
         e._terminate_flag = True
         sleep(1)
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_non_ascii(self):
         p = TestPlugin()
         e = EtcdSynchronizer(p, "10.0.0.1", "local", None, "clearwater")
@@ -78,3 +82,28 @@ class BasicTest(unittest.TestCase):
         # Allow the EtcdSynchronizer to exit
         e._terminate_flag = True
         sleep(1)
+
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_synchronisation_of_compressed_value(self):
+        p = TestPlugin()
+        e = EtcdSynchronizer(p, "10.0.0.1", "local", None, "clearwater")
+        # Write some initial data into the key
+        e._client.write("/clearwater/local/configuration/test", "initial data")
+
+        thread = Thread(target=e.main_wrapper)
+        thread.daemon=True
+        thread.start()
+
+        sleep(1)
+        # Write a large, compressed value into etcd, and check that the plugin
+        # is called with the original value
+        value = "<xml>" + "large config " * 10000 + "</xml>"
+        e._client.write("/clearwater/local/configuration/test",
+                        encode_value(value))
+        sleep(1)
+        p._on_config_changed.assert_called_with(value, None)
+
+        # Allow the EtcdSynchronizer to exit
+        e._terminate_flag = True
+        sleep(1)
@@ -0,0 +1,61 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import etcd
+import logging
+import os
+
+_log = logging.getLogger(__name__)
+
+
+def _normalise(key):
+    return key if key.startswith("/") else "/" + key
+
+
+def _common_prefix(keys):
+    # The key itself if there's only one, and otherwise the deepest directory
+    # containing all of them.
+    if len(keys) == 1:
+        return keys[0]
+    prefix = os.path.commonprefix(keys)
+    return prefix[:prefix.rfind("/")] or "/"
+
+
+def read_all(client, prefix="/", keys=None):
+    """Reads every key under prefix, or just the given keys, in a single
+    recursive quorum read.
+
+    Returns a dict mapping each key found to its (value, modifiedIndex), and
+    the etcd index the read was made at - so the values are all from the same
+    moment, and a watch from the index after it sees every later change.
+    Requested keys that don't exist are left out of the dict. Any etcd
+    exception other than the prefix not existing is raised."""
+    if keys is not None:
+        keys = set(_normalise(key) for key in keys)
+        if not keys:
+            return {}, None
+        prefix = _common_prefix(list(keys))
+    prefix = _normalise(prefix)
+
+    try:
+        result = client.read(prefix, recursive=True, quorum=True)
+    except etcd.EtcdKeyNotFound as e:
+        payload = e.payload if isinstance(e.payload, dict) else {}
+        return {}, payload.get("index")
+
+    values = {}
+    for node in result.leaves:
+        if node.dir:
+            # An empty directory.
+            continue
+        if keys is None or node.key in keys:
+            values[node.key] = (node.value, node.modifiedIndex)
+
+    _log.debug("Read {} keys under {} at index {}".format(len(values),
+                                                          prefix,
+                                                          result.etcd_index))
+    return values, result.etcd_index
@@ -7,259 +7,193 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
-# This file contains code from the urllib3 project
-# (https://github.com/shazow/urllib3) licensed under the MIT License:
-#
-# Copyright 2008-2014 Andrey Petrov and contributors
-#
-# Permission is hereby granted, free of charge, to any person obtaining a copy of this
-# software and associated documentation files (the "Software"), to deal in the Software
-# without restriction, including without limitation the rights to use, copy, modify, merge,
-# publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons
-# to whom the Software is furnished to do so, subject to the following conditions:
-#
-# The above copyright notice and this permission notice shall be included in all copies or
-# substantial portions of the Software.
-#
-# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
-# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
-# PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE
-# FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR
-# OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
-# DEALINGS IN THE SOFTWARE.
-
 import etcd
-from threading import Thread
-from concurrent import futures
-from time import sleep
-from functools import wraps
+from threading import Event, Thread, current_thread
+from time import time
 import logging
 import traceback
+import zlib
 import os
 import signal
-from metaswitch.common import utils
+from .watch_hub import acquire_watch_hub, release_watch_hub
+from .retry_policy import RetryPolicy
+from .etcd_v2_client import EtcdV2Client
+from .etcd_v3_client import EtcdV3Client
+from .etcd_cluster_client import EtcdClusterClient
+from .state_cache import get_state_cache
+from .metrics import metrics
+from .value_log import FullValueLog, ValueSummary
+from .watch_lag import WatchLagMonitor
 
 _log = logging.getLogger(__name__)
 
 
-# Monkey patch urllib3 to close connections that time out.  Otherwise
-# etcd will leak socket handles when we time out watches.
-import urllib3
-from contextlib import contextmanager
-from socket import timeout as SocketTimeout
-from socket import error as SocketError
-from urllib3.exceptions import ReadTimeoutError, ProtocolError, MaxRetryError, HTTPError
-from urllib3.connection import HTTPException, BaseSSLError
-@contextmanager
-def _error_catcher(self): # pragma: no cover
-    """
-    Catch low-level python exceptions, instead re-raising urllib3
-    variants, so that low-level exceptions are not leaked in the
-    high-level api.
-    On exit, release the connection back to the pool.
-    """
-    try:
-        try:
-            yield
-
-        except SocketTimeout:
-            # FIXME: Ideally we'd like to include the url in the ReadTimeoutError but
-            # there is yet no clean way to get at it from this context.
-            raise ReadTimeoutError(self._pool, None, 'Read timed out.')
-
-        except BaseSSLError as e:
-            # FIXME: Is there a better way to differentiate between SSLErrors?
-            if 'read operation timed out' not in str(e):  # Defensive:
-                # This shouldn't happen but just in case we're missing an edge
-                # case, let's avoid swallowing SSL errors.
-                raise
-
-            raise ReadTimeoutError(self._pool, None, 'Read timed out.')
-
-        except HTTPException as e:
-            # This includes IncompleteRead.
-            raise ProtocolError('Connection broken: %r' % e, e)
-    except Exception:
-        # The response may not be closed but we're not going to use it anymore
-        # so close it now to ensure that the connection is released back to the pool.
-        if self._original_response and not self._original_response.isclosed():
-            self._original_response.close()
-
-        # Before returning the socket, close it.  From the server's point of view, this
-        # socket is in the middle of handling an SSL handshake/HTTP request so it we
-        # were to try and re-use the connection later, we'd see undefined behaviour.
-        #
-        # Still return the connection to the pool (it will be re-established next time
-        # it is used).
-        self._connection.close()
-
-        raise
-    finally:
-        if self._original_response and self._original_response.isclosed():
-            self.release_conn()
-urllib3.HTTPResponse._error_catcher = _error_catcher
-
-# Monkeypatch python-etcd to catch MaxRetryErrors. This is a hacky fix to cover
-# https://github.com/jplana/python-etcd/issues/160 (it doesn't cover why
-# urllib3 is hitting a MaxRetryError in the first place). We should remove this
-# if we update the python-etcd version.
-# The change in this code (see the PATCHED section below) is to catch
-# MaxRetryErrors and convert them to EtcdWatchTimedOut errors - this stops a
-# worrying error log evey 5 seconds. No other code has been changed (the
-# api* functions are only included in this patch so that they can be decorated
-# with our patched decorator).
-def _patched_wrap_request(payload): # pragma: no cover
-    @wraps(payload)
-    def wrapper(self, path, method, params=None, timeout=None):
-        some_request_failed = False
-        response = False
-
-        if timeout is None:
-            timeout = self.read_timeout
-
-        if timeout == 0:
-            timeout = None
-
-        if not path.startswith('/'):
-            raise ValueError('Path does not start with /')
-
-        while not response:
-            try:
-                response = payload(self, path, method,
-                                   params=params, timeout=timeout)
-                # Check the cluster ID hasn't changed under us.  We use
-                # preload_content=False above so we can read the headers
-                # before we wait for the content of a watch.
-                self._check_cluster_id(response)
-                # Now force the data to be preloaded in order to trigger any
-                # IO-related errors in this method rather than when we try to
-                # access it later.
-                _ = response.data # noqa
-                # urllib3 doesn't wrap all httplib exceptions and earlier versions
-                # don't wrap socket errors either.
-            except (HTTPError, MaxRetryError, HTTPException, SocketError) as e:
-                # PATCHED
-                if (isinstance(params, dict) and
-                    params.get("wait") == "true" and
-                    (isinstance(e,
-                                urllib3.exceptions.MaxRetryError) or
-                     isinstance(e,
-                                urllib3.exceptions.ReadTimeoutError))):
-                    _log.debug("Watch timed out.")
-                    raise etcd.EtcdWatchTimedOut(
-                        "Watch timed out: %r" % e,
-                        cause=e
-                    )
-                _log.error("Request to server %s failed: %r",
-                           self._base_uri, e)
-
-                if self._allow_reconnect:
-                    _log.info("Reconnection allowed, looking for another "
-                              "server.")
-                    # _next_server() raises EtcdException if there are no
-                    # machines left to try, breaking out of the loop.
-                    self._base_uri = self._next_server(cause=e)
-                    some_request_failed = True
-                    # if exception is raised on _ = response.data
-                    # the condition for while loop will be False
-                    # but we should retry
-                    response = False
-                else:
-                    _log.debug("Reconnection disabled, giving up.")
-                    raise etcd.EtcdConnectionFailed(
-                        "Connection to etcd failed due to %r" % e,
-                        cause=e
-                    )
-            except etcd.EtcdClusterIdChanged as e:
-                _log.warning(e)
-                raise
-            except:
-                _log.exception("Unexpected request failure, re-raising.")
-                raise
-
-            if some_request_failed:
-                if not self._use_proxies:
-                    # The cluster may have changed since last invocation
-                    self._machines_cache = self.machines
-                self._machines_cache.remove(self._base_uri)
-        return self._handle_server_response(response)
-    return wrapper
-
-@_patched_wrap_request
-def api_execute_json_with_patched_decorator(self, path, method, params=None, timeout=None): # pragma: no cover
-    url = self._base_uri + path
-    json_payload = json.dumps(params) # noqa
-    headers = self._get_headers()
-    headers['Content-Type'] = 'application/json'
-    return self.http.urlopen(method,
-                             url,
-                             body=json_payload,
-                             timeout=timeout,
-                             redirect=self.allow_redirect,
-                             headers=headers,
-                             preload_content=False)
-etcd.Client.api_execute_json = api_execute_json_with_patched_decorator
-
-@_patched_wrap_request
-def api_execute_with_patched_decorator(self, path, method, params=None, timeout=None): # pragma: no cover
-    """ Executes the query. """
-    url = self._base_uri + path
-    if (method == self._MGET) or (method == self._MDELETE):
-        return self.http.request(
-            method,
-            url,
-            timeout=timeout,
-            fields=params,
-            redirect=self.allow_redirect,
-            headers=self._get_headers(),
-            preload_content=False)
-
-    elif (method == self._MPUT) or (method == self._MPOST):
-        return self.http.request_encode_body(
-            method,
-            url,
-            fields=params,
-            timeout=timeout,
-            encode_multipart=False,
-            redirect=self.allow_redirect,
-            headers=self._get_headers(),
-            preload_content=False)
-    else:
-        raise etcd.EtcdException(
-            'HTTP method {} not supported'.format(method))
-etcd.Client.api_execute = api_execute_with_patched_decorator
+def shutdown_time(synchronizers):
+    """Returns how long it's been (in seconds) since the first of the
+    synchronizers was told to terminate, or 0 if none of them have been."""
+    requested = [s.terminate_requested_at() for s in synchronizers
+                 if s.terminate_requested_at() is not None]
+    if not requested:
+        return 0
+    return time() - min(requested)
+
+
+# How read_from_etcd should read the current value of the key.
+class ReadConsistency:
+    # A linearizable read, handled by the Raft leader.
+    QUORUM = "quorum"
+    # A read served by whichever etcd member we're connected to. This may be
+    # slightly out of date.
+    SERIALIZABLE = "serializable"
+    # The last value this synchronizer read, if the shared watch shows that it
+    # hasn't changed since - otherwise a quorum read. This is only suitable
+    # before a compare-and-swap write, which catches any change the watch
+    # hasn't reported yet.
+    CACHED = "cached"
 
 class CommonEtcdSynchronizer(object):
+    # After an error talking to etcd we back off exponentially (with jitter)
+    # from INITIAL_PAUSE_BEFORE_RETRY up to PAUSE_BEFORE_RETRY_ON_EXCEPTION.
+    INITIAL_PAUSE_BEFORE_RETRY = 0.05
     PAUSE_BEFORE_RETRY_ON_EXCEPTION = 30
     PAUSE_BEFORE_RETRY_ON_MISSING_KEY = 5
     TIMEOUT_ON_WATCH = 5
 
+    # After the key changes, how long (in seconds) to wait for further changes
+    # before handing the value on, so that a burst of changes is handled once
+    # rather than revision by revision. 0 turns this off. Plugins can choose
+    # their own window by returning it from coalescing_window().
+    COALESCING_WINDOW = 0
+
+    # The most (in seconds) that a node waits before acting on a change that
+    # every node in the deployment sees at once. Each node waits a fixed
+    # fraction of this, so they write one after another rather than all
+    # contending for the same index. 0 turns this off. Plugins can choose
+    # their own value by returning it from reaction_jitter().
+    REACTION_JITTER = 0
+
+    # Which etcd API to use - "v2" (through python-etcd) or "v3" (through
+    # etcd's JSON gateway). This is set from the command line.
+    ETCD_API = "v2"
+
+    # Which etcd members to talk to - "local" (just the one on this node),
+    # "cluster" (whichever member is currently answering best), "hedged" (as
+    # for "cluster", but sending slow reads to a second member as well) or
+    # "leader" (reading from the local member, but sending writes straight to
+    # the leader). This is set from the command line.
+    ETCD_ENDPOINTS = "local"
+
     def __init__(self, plugin, ip, etcd_ip=None):
         self._plugin = plugin
         self._ip = ip
         cxn_ip = etcd_ip or ip
-        self._client = etcd.Client(cxn_ip, 4000)
+        client_factory = EtcdV3Client if self.ETCD_API == "v3" else EtcdV2Client
+        if self.ETCD_ENDPOINTS in ["cluster", "hedged", "leader"]:
+            self._client = EtcdClusterClient(
+                cxn_ip,
+                4000,
+                client_factory=client_factory,
+                hedge_reads=(self.ETCD_ENDPOINTS == "hedged"),
+                leader_writes=(self.ETCD_ENDPOINTS == "leader"))
+        else:
+            self._client = client_factory(cxn_ip, 4000)
+        self._retry_policy = RetryPolicy(getattr(self._client, "base_uri", None),
+                                         self.INITIAL_PAUSE_BEFORE_RETRY,
+                                         self.PAUSE_BEFORE_RETRY_ON_EXCEPTION)
         self._index = None
         self._last_value = None
 
+        # The (value, modified index, etcd index) of the last value we read.
+        # This is a single tuple so that other threads always see a consistent
+        # snapshot of it.
+        self._last_read = None
+
+        # The (value, modified index) that the main thread has just written,
+        # which the next update_from_etcd returns without reading it back.
+        # The index that the next update_from_etcd should watch from, having
+        # already handled the value before it (skipping the read that would
+        # normally come first).
+        self._written = None
+        self._watch_from = None
+
+        # Whether the value last read by update_from_etcd is the first one
+        # since we started, and is the same as the one we'd finished handling
+        # before we last restarted.
+        self._first_update = True
+        self._unchanged_since_restart = False
+
+        # This synchronizer's counters and latency histograms.
+        self._metrics = metrics.labelled(plugin=self.thread_name())
+
+        # Values are summarised when logged - the full text is only logged
+        # occasionally.
+        self._full_value_log = FullValueLog(
+            _log, self._metrics.counter("logged_values_suppressed"))
+
+        # Tracks whether we've fallen behind etcd, while the thread runs.
+        self._lag_monitor = WatchLagMonitor(self.thread_name(), self._metrics)
+
+        # The shared watch on this synchronizer's key prefix. This is acquired
+        # the first time we watch, and released when the thread exits.
+        self._watch_hub = None
+
         # Set the terminate flag and the abort read flag to false initially
         # The terminate flag controls whether the synchronizer as a whole
-        # should terminate, the abort flag ensures that any synchronizer
-        # threads controlled by a futures is shut down fully
+        # should terminate, the abort flag cuts short the current read (for
+        # example when a queue timer pops). The terminate
+        # flag is backed by an event, so that waits can be cut short by it.
+        self._terminate_event = Event()
+        self._terminate_requested_at = None
         self._terminate_flag = False
         self._abort_read = False
         self.thread = Thread(target=self.main_wrapper, name=self.thread_name())
 
     def start_thread(self):
         self.thread.daemon = True
+        self._lag_monitor.start()
         self.thread.start()
 
+    @property
+    def _terminate_flag(self):
+        return self._terminate_event.is_set()
+
+    @_terminate_flag.setter
+    def _terminate_flag(self, value):
+        if not value:
+            self._terminate_event.clear()
+            return
+
+        if not self._terminate_event.is_set():
+            self._terminate_requested_at = time()
+        self._terminate_event.set()
+        self.wake_watch()
+
     def terminate(self):
         self._terminate_flag = True
         self.thread.join()
 
-    def pause(self):
-        sleep(self.PAUSE_BEFORE_RETRY_ON_EXCEPTION)
+    # Returns when we were asked to terminate, or None if we haven't been.
+    def terminate_requested_at(self):
+        return self._terminate_requested_at
+
+    # Cut short any watch this synchronizer is waiting on, so it notices that
+    # it's been told to stop (or to abort the read).
+    def wake_watch(self):
+        hub = self._watch_hub
+        if hub is not None:
+            hub.wake()
+
+    # Wait for delay seconds, or until we're told to terminate.
+    def interruptible_sleep(self, delay):
+        self._terminate_event.wait(delay)
+
+    # Back off after a failed etcd request. Passing the error lets the circuit
+    # breaker for our etcd endpoint count it.
+    def pause(self, error=None):
+        if error is not None:
+            self._retry_policy.failed(error)
+        self._metrics.counter("pauses").inc()
+        self.interruptible_sleep(self._retry_policy.next_delay())
 
     def main_wrapper(self): # pragma: no cover
         # This function should be the entry point when we start an
@@ -274,6 +208,11 @@ class CommonEtcdSynchronizer(object):
             # handler for catching the SIGTERM.
             _log.error(traceback.format_exc())
             os.kill(os.getpid(), signal.SIGTERM)
+        finally:
+            self._lag_monitor.stop()
+            if self._watch_hub is not None:
+                release_watch_hub(self._watch_hub)
+                self._watch_hub = None
 
     def main(self): pass
 
@@ -283,36 +222,203 @@ class CommonEtcdSynchronizer(object):
 
     def thread_name(self): return self._plugin.__class__.__name__
 
+    def coalescing_window(self):
+        window = None
+        if hasattr(self._plugin, "coalescing_window"):
+            window = self._plugin.coalescing_window()
+        return self.COALESCING_WINDOW if window is None else window
+
+    def reaction_jitter(self):
+        jitter = None
+        if hasattr(self._plugin, "reaction_jitter"):
+            jitter = self._plugin.reaction_jitter()
+        return self.REACTION_JITTER if jitter is None else jitter
+
+    # Identifies this node among the others running the same plugin.
+    def node_id(self):
+        return self._ip
+
+    # How long this node waits before reacting to a change. This is derived
+    # from the node ID and plugin, so it's the same every time, and spread
+    # evenly over [0, reaction_jitter()) across the deployment.
+    def reaction_delay(self):
+        jitter = self.reaction_jitter()
+        if not jitter:
+            return 0
+        seed = "{}/{}".format(self.node_id(), self.thread_name())
+        return jitter * (zlib.crc32(seed) & 0xffffffff) / float(1 << 32)
+
+    # Waits for this node's reaction delay before it acts on the value it has
+    # just read. Returns None if the key didn't change in the meantime, and
+    # otherwise the latest value (which the caller should act on instead, as
+    # a compare-and-swap based on the old one would just fail). Changes don't
+    # cut the wait short - otherwise every node would wake up and act on the
+    # first one at once.
+    def wait_to_react(self):
+        delay = self.reaction_delay()
+        if not delay or self._index is None:
+            return None
+
+        latest = None
+        index = self._index
+        deadline = time() + delay
+
+        while not self._terminate_flag and not self._abort_read:
+            remaining = deadline - time()
+            if remaining <= 0:
+                break
+
+            try:
+                result = self.watch_for_change(index + 1, timeout=remaining)
+            except etcd.EtcdWatchTimedOut:
+                continue
+            except Exception as e:
+                # Any other error shows up again when we write, so just carry
+                # on with what we've got.
+                _log.debug("Error waiting to react to {}: {!r}".format(
+                    self.key(), e))
+                break
+
+            self.record_read(result, result.modifiedIndex)
+            latest = result
+            index = result.modifiedIndex
+
+        if latest is not None:
+            self._metrics.counter("reactions_superseded").inc()
+        return latest
+
+    # The prefix watched by the shared watch hub that this synchronizer's key
+    # lives under. Synchronizers in the same process with the same prefix share
+    # one recursive watch. Returning None makes this synchronizer watch its key
+    # directly.
+    def watch_prefix(self):
+        return self.key().rsplit("/", 1)[0] + "/"
+
+    # Block until the key changes at or after wait_index, or until timeout
+    # (by default TIMEOUT_ON_WATCH) passes, in which case this raises a timeout
+    # exception.
+    def watch_for_change(self, wait_index, timeout=None):
+        if timeout is None:
+            timeout = self.TIMEOUT_ON_WATCH
+
+        if self._watch_hub is None:
+            prefix = self.watch_prefix()
+            if prefix is not None:
+                self._watch_hub = acquire_watch_hub(self._client, prefix)
+
+        if self._watch_hub is not None:
+            result = self._watch_hub.wait_for_change(
+                self.key(),
+                wait_index,
+                timeout,
+                cancelled=lambda: self._terminate_flag or self._abort_read)
+            if result is not None:
+                return result
+
+        # The shared watch can't tell us about changes this old (or is
+        # failing), so watch the key ourselves. Any error is then ours to
+        # handle.
+        return self._client.read(self.key(),
+                                 timeout=timeout,
+                                 waitIndex=wait_index,
+                                 wait=True,
+                                 recursive=False)
+
     # Read the state of the cluster from etcd (optionally waiting for a changed
     # state). Returns None if nothing could be read.
-    def read_from_etcd(self, wait=True, timeout=None):
+    def read_from_etcd(self,
+                       wait=True,
+                       timeout=None,
+                       consistency=ReadConsistency.QUORUM):
         result = None
         wait_index = None
 
-        try:
-            result = self._client.read(self.key(), quorum=True, timeout=timeout)
-            wait_index = result.etcd_index + 1
-
-            if wait:
-                # If the cluster view hasn't changed since we last saw it, then
-                # wait for it to change before doing anything else.
-                _log.info("Read value {} from etcd, "
-                          "comparing to last value {}".format(
-                              utils.safely_encode(result.value),
-                              utils.safely_encode(self._last_value)))
-
-                if result.value == self._last_value:
-                    _log.info("Watching for changes with {}".format(wait_index))
+        # If the last value we handled was our own write, we already know
+        # what's in etcd, so only need to watch for changes after it. Only
+        # the main loop waits, so other threads' reads leave this alone.
+        watch_from = None
+        if wait:
+            watch_from, self._watch_from = self._watch_from, None
+            if self._last_value is None:
+                watch_from = None
+
+        if consistency == ReadConsistency.CACHED and not wait:
+            cached = self.cached_read()
+            if cached is not None:
+                self._metrics.counter("etcd_cached_reads").inc()
+                return cached
+            consistency = ReadConsistency.QUORUM
 
+        try:
+            if watch_from is not None:
+                wait_index = watch_from
+            else:
+                # Only consult the circuit breaker when we're actually about
+                # to send a request, as it may let just the one probe through.
+                self._retry_policy.check()
+                with self._metrics.histogram("etcd_read_seconds",
+                                             consistency=consistency).time():
+                    result = self._client.read(
+                        self.key(),
+                        quorum=(consistency == ReadConsistency.QUORUM),
+                        timeout=timeout)
+                self._retry_policy.succeeded()
+                self.record_read(result, result.etcd_index)
+                wait_index = result.etcd_index + 1
+
+            if wait and result is not None:
+                _log.info("Read value (%s) from etcd, comparing to last "
+                          "value (%s)",
+                          ValueSummary(self.key(),
+                                       result.modifiedIndex,
+                                       result.value),
+                          ValueSummary(self.key(),
+                                       self._index,
+                                       self._last_value))
+                self._full_value_log.log(self.key(),
+                                         result.modifiedIndex,
+                                         result.value)
+
+            # If the cluster view hasn't changed since we last saw it, then
+            # wait for it to change before doing anything else.
+            if wait and (result is None or result.value == self._last_value):
+                _log.info("Watching for changes with %d", wait_index)
+                watch_start = time()
+
+                with self._lag_monitor.watching(wait_index):
                     while not self._terminate_flag and not self._abort_read and self.is_running():
                         _log.debug("Started a new watch")
                         try:
-                            result = self._client.read(self.key(),
-                                                       timeout=self.TIMEOUT_ON_WATCH,
-                                                       waitIndex=wait_index,
-                                                       wait=True,
-                                                       recursive=False)
+                            result = self.watch_for_change(wait_index)
+                            self.record_read(result, result.modifiedIndex)
+                            self._metrics.counter("etcd_watch_wakeups").inc()
+                            self._metrics.histogram("etcd_watch_seconds").observe(
+                                time() - watch_start)
                             break
+                        except etcd.EtcdWatchTimedOut:
+                            pass
+                        except etcd.EtcdEventIndexCleared:
+                            # etcd no longer has the events from wait_index
+                            # onwards, so we can't carry on watching from
+                            # there. Re-read the current value straight away
+                            # and watch from its index instead.
+                            index_cleared = self._metrics.counter(
+                                "etcd_index_cleared")
+                            index_cleared.inc()
+                            _log.warning("Events on {} from index {} have been "
+                                         "cleared - re-reading (happened {} "
+                                         "times)".format(
+                                             self.key(),
+                                             wait_index,
+                                             index_cleared.value))
+                            result = self._client.read(self.key(),
+                                                       quorum=True,
+                                                       timeout=timeout)
+                            self.record_read(result, result.etcd_index)
+                            wait_index = result.etcd_index + 1
+
+                            if result.value != self._last_value:
+                                break
                         except etcd.EtcdException as e:
                             if "Read timed out" in e.message:
                                 # Timeouts after TIMEOUT_ON_WATCH seconds are expected, so
@@ -322,13 +428,22 @@ class CommonEtcdSynchronizer(object):
                             else:
                                 raise
 
-                    _log.debug("Finished watching")
+                _log.debug("Finished watching")
 
-                    # Return if we're terminating.
-                    if self._terminate_flag:
-                        return self.tuple_from_result(result)
+                # If we stopped watching without reading anything (because
+                # we're terminating, or the read was aborted), nothing has
+                # changed since the value we last handled.
+                if result is None:
+                    return (self._last_value, self._index)
+
+                # Return if we're terminating.
+                if self._terminate_flag:
+                    return self.tuple_from_result(result)
 
         except etcd.EtcdKeyError:
+            # etcd answered us, so this counts as success as far as backing off
+            # is concerned.
+            self._retry_policy.succeeded()
             _log.info("Key {} doesn't exist in etcd yet".format(self.key()))
             # Use any value on disk first, but the default value if not found
             try:
@@ -342,12 +457,14 @@ class CommonEtcdSynchronizer(object):
                 # The prevExist set to False will fail the write if it finds a
                 # key already in etcd. This stops us overwriting a manually
                 # uploaded file with the default template.
-                self._client.write(self.key(), value, prevExist=False)
-                return (value, None)
+                # Return the index we created it with, so that our first
+                # write can go straight on top of it.
+                result = self._client.write(self.key(), value, prevExist=False)
+                return (value, result.modifiedIndex)
             except:  # pragma: no cover
                 _log.debug("Failed to create new key in the etcd store")
                 # Sleep briefly to avoid hammering a non-existent key
-                sleep(self.PAUSE_BEFORE_RETRY_ON_MISSING_KEY)
+                self.interruptible_sleep(self.PAUSE_BEFORE_RETRY_ON_MISSING_KEY)
                 # Return 'None' so that plugins do not write config to disk
                 # that does not exist in the etcd store, leaving us out of sync
                 return (None, None)
@@ -355,16 +472,47 @@ class CommonEtcdSynchronizer(object):
         except Exception as e:
             # Catch-all error handler (for invalid requests, timeouts, etc -
             # start over.
+            self._metrics.counter("etcd_read_errors").inc()
             _log.error("{} caught {!r} when trying to read with index {}"
                        " - pause before retry".
                        format(self._ip, e, wait_index))
             # Sleep briefly to avoid hammering a failed server
-            self.pause()
+            self.pause(e)
             # The main loop (which reads from etcd in a loop) should call this
             # function again after we return, causing the read to be retried.
 
         return self.tuple_from_result(result)
 
+    # Records that the main thread has just written value to etcd, getting
+    # back result. The next update_from_etcd returns it straight away rather
+    # than reading it back, and then watches for changes after it. Writes from
+    # other threads are picked up by the main thread's watch like anyone
+    # else's.
+    def record_write(self, value, result):
+        if current_thread() is not self.thread:
+            return
+        self.record_read(result, result.modifiedIndex)
+        self._written = (value, result.modifiedIndex)
+
+    def record_read(self, result, as_of):
+        self._lag_monitor.saw_index(getattr(result, "etcd_index", None))
+        if result.value is not None:
+            self._last_read = (result.value, result.modifiedIndex, as_of)
+
+    # Returns the (value, index) that we last read, if the shared watch shows
+    # that the key hasn't changed since then. Returns None otherwise.
+    def cached_read(self):
+        last_read = self._last_read
+        if last_read is None or self._watch_hub is None:
+            return None
+
+        value, index, as_of = last_read
+        if not self._watch_hub.is_current(self.key(), index, as_of):
+            return None
+
+        _log.debug("Using cached value of %s with index %d", self.key(), index)
+        return (value, index)
+
     def tuple_from_result(self, result):
         if result is None:
             return (None, None)
@@ -384,19 +532,84 @@ class CommonEtcdSynchronizer(object):
     # Only the main thread should call update_from_etcd to avoid race conditions
     # or missed reads.
     def update_from_etcd(self):
-        self._last_value, self._index = self.read_from_etcd(wait=True)
+        state_cache = get_state_cache()
+
+        # The main loop has finished handling the previous value by the time
+        # it asks for the next one, so remember it in case we restart.
+        if (state_cache is not None and
+            self._last_value is not None and
+            self._index is not None):
+            state_cache.record(self.key(), self._index, self._last_value)
+
+        written, self._written = self._written, None
+        if written is not None:
+            _log.debug("Using our own write to %s with index %d",
+                       self.key(), written[1])
+            self._metrics.counter("etcd_reads_skipped").inc()
+            self._last_value, self._index = written
+        else:
+            self._last_value, self._index = self.read_from_etcd(wait=True)
+        self._coalesce_changes()
+
+        # We know the value at this index, so next time round we only need to
+        # watch for changes after it - unless we write, in which case that
+        # takes over.
+        if self._last_value is not None and self._index is not None:
+            self._watch_from = self._index + 1
+
+        self._unchanged_since_restart = (
+            self._first_update and
+            state_cache is not None and
+            self._last_value is not None and
+            state_cache.matches(self.key(), self._index, self._last_value))
+        if self._last_value is not None:
+            self._first_update = False
+
         return self._last_value
 
-    # Use this class instead of the class futures.ThreadPoolExecutor to log any exceptions
-    # that occur inside 'background-started' threads
-    class ThreadPoolExecutorWithExceptionHandler(futures.ThreadPoolExecutor):
-        def submit(self, func):
-            future = super(CommonEtcdSynchronizer.ThreadPoolExecutorWithExceptionHandler, self).submit(func)
-            future.add_done_callback(self.log_exception)
-            return future
+    # Having just seen the key change, wait up to the coalescing window for it
+    # to change again, moving on to the latest value each time. Any error just
+    # ends the window early - the next read will deal with it.
+    def _coalesce_changes(self):
+        window = self.coalescing_window()
+        if not window or self._last_value is None or self._index is None:
+            return
+
+        deadline = time() + window
+        coalesced = 0
+
+        while not self._terminate_flag and not self._abort_read:
+            remaining = deadline - time()
+            if remaining <= 0:
+                break
 
-        def log_exception(self, future):
             try:
-                future.result()
-            except Exception as e: #pragma: no cover
-                _log.exception("%s: %s", type(e).__name__, e.__str__())
+                result = self.watch_for_change(self._index + 1,
+                                               timeout=remaining)
+            except etcd.EtcdWatchTimedOut:
+                continue
+            except etcd.EtcdException as e:
+                if "Read timed out" in e.message:
+                    continue
+                break
+            except Exception:
+                break
+
+            if result.value is None:
+                break
+
+            self.record_read(result, result.modifiedIndex)
+            self._last_value, self._index = result.value, result.modifiedIndex
+            coalesced += 1
+
+        if coalesced:
+            _log.info("Coalesced {} further change(s) to {}, now at index "
+                      "{}".format(coalesced, self.key(), self._index))
+            self._metrics.counter("coalesced_changes").inc(coalesced)
+
+    # Returns True if the value just returned by update_from_etcd is the first
+    # since this process started, and is the same value (at the same index)
+    # that we'd already handled before restarting. Subclasses can use this to
+    # skip redoing work that a restart doesn't need.
+    def unchanged_since_restart(self):
+        return self._unchanged_since_restart
@@ -0,0 +1,367 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import etcd
+import logging
+import os
+from concurrent import futures
+from threading import Lock
+from time import time
+from urlparse import urlparse
+from .etcd_v2_client import EtcdV2Client
+from .event_loop import get_event_loop, Priority
+
+_log = logging.getLogger(__name__)
+
+# Written by poll_etcd_cluster.sh - a comma-separated list of the IPs of the
+# etcd members that were healthy when it last ran.
+HEALTHY_MEMBERS_FILE = "/var/lib/clearwater-etcd/healthy_etcd_members"
+
+
+def is_endpoint_failure(error):
+    """Returns True if error means the etcd member itself is in trouble, as
+    opposed to it giving a valid answer (e.g. that a key doesn't exist, or that
+    a compare-and-swap failed)."""
+    if isinstance(error, etcd.EtcdWatchTimedOut):
+        return False
+    if isinstance(error, (etcd.EtcdConnectionFailed,
+                          etcd.EtcdLeaderElectionInProgress,
+                          etcd.EtcdClusterIdChanged)):
+        return True
+    if isinstance(error, (etcd.EtcdException, ValueError)):
+        # Any other etcd error is an answer, unless it's the generic error
+        # python-etcd raises for garbled responses.
+        return type(error) is etcd.EtcdException
+    return True
+
+
+class Endpoint(object):
+    """A client for one etcd member, tracking how quickly and reliably it has
+    been answering.
+
+    Latency and error rate are exponentially weighted moving averages. The
+    error rate also decays over time, so that a member that failed a while ago
+    is tried again rather than being shunned forever."""
+
+    # The weight given to each new sample.
+    ALPHA = 0.2
+
+    # How long it takes the error rate to halve with no further requests.
+    ERROR_HALF_LIFE = 30
+
+    # How much worse an endpoint with a 100% error rate scores.
+    ERROR_PENALTY = 100
+
+    # The latency assumed for an endpoint we haven't heard from yet.
+    INITIAL_LATENCY = 0.01
+
+    def __init__(self, host, client, local=False):
+        self.host = host
+        self.client = client
+        self.local = local
+        self._lock = Lock()
+        self.latency = self.INITIAL_LATENCY
+        self._error_rate = 0.0
+        self._error_rate_at = time()
+
+    def error_rate(self, now=None):
+        now = now or time()
+        with self._lock:
+            elapsed = max(0, now - self._error_rate_at)
+            return self._error_rate * (0.5 ** (elapsed / self.ERROR_HALF_LIFE))
+
+    def record_success(self, latency):
+        self._record(0.0, latency)
+
+    def record_failure(self, latency):
+        self._record(1.0, latency)
+
+    def score(self, local_preference):
+        """Lower is better. The local member's score is scaled by
+        local_preference, so we stick with it unless it's noticeably worse
+        than the others."""
+        score = self.latency * (1 + self.ERROR_PENALTY * self.error_rate())
+        if self.local:
+            score *= local_preference
+        return score
+
+    def _record(self, error, latency):
+        now = time()
+        error_rate = self.error_rate(now)
+        with self._lock:
+            self._error_rate = error_rate + self.ALPHA * (error - error_rate)
+            self._error_rate_at = now
+            self.latency += self.ALPHA * (latency - self.latency)
+
+
+class EtcdClusterClient(object):
+    """An etcd client that spreads requests across all the members of the
+    etcd cluster, rather than just the local one.
+
+    Each request goes to the member that has recently been answering fastest
+    and most reliably (preferring the local member when it's healthy). Reads
+    that fail because a member is in trouble are retried against the next
+    best member. Writes aren't retried, as they may have taken effect - the
+    next request goes to a better member instead.
+
+    If hedged reads are enabled, a read that the best member hasn't answered
+    within HEDGE_DELAY is also sent to the next best, and whichever answers
+    first wins.
+
+    If leader writes are enabled, reads only go to the local member (which
+    may be a proxy), and writes and deletes go straight to the leader of the
+    etcd cluster. Any other member (or proxy) would just forward them there.
+    The leader is looked up every LEADER_REFRESH_INTERVAL, or after a write
+    to it fails - until it's known, writes go to the best member.
+
+    The set of members comes from the healthy members file written by
+    poll_etcd_cluster.sh, or from etcd's member list if that file doesn't
+    exist."""
+
+    # How often to look for changes to the cluster membership.
+    MEMBERS_REFRESH_INTERVAL = 30
+
+    # How much to favour the local member - its score is multiplied by this.
+    LOCAL_PREFERENCE = 0.5
+
+    # How many members to try for each read.
+    READ_ATTEMPTS = 2
+
+    # How long to wait for the best member before hedging a read.
+    HEDGE_DELAY = 0.05
+
+    # How often to check which member is the leader, if leader writes are
+    # enabled.
+    LEADER_REFRESH_INTERVAL = 10
+
+    def __init__(self,
+                 host,
+                 port=4000,
+                 client_factory=None,
+                 hedge_reads=False,
+                 leader_writes=False,
+                 members_file=HEALTHY_MEMBERS_FILE):
+        self.host = host
+        self.port = port
+        self.base_uri = "cluster:http://{}:{}".format(host, port)
+        self._client_factory = client_factory or EtcdV2Client
+        self._hedge_reads = hedge_reads
+        self._leader_writes = leader_writes
+        self._members_file = members_file
+
+        self._lock = Lock()
+        self._endpoints = {}
+        self._add_endpoint(host, local=True)
+        self._members_checked_at = None
+        self._members_mtime = None
+        self._leader = None
+        self._leader_checked_at = None
+
+    def read(self, key, **kwargs):
+        if self._leader_writes:
+            return self._call(self._local_endpoint(), "read", key, **kwargs)
+
+        if kwargs.get("wait"):
+            # Long-polls don't tell us anything useful about latency, so just
+            # send them to the best member. Watch indexes are cluster-wide, so
+            # it doesn't matter which member a watch goes to.
+            return self._call(self.endpoints()[0], "read", key, **kwargs)
+
+        if self._hedge_reads:
+            return self._hedged_read(key, **kwargs)
+
+        endpoints = self.endpoints()[:self.READ_ATTEMPTS]
+        for endpoint in endpoints:
+            try:
+                return self._call(endpoint, "read", key, **kwargs)
+            except Exception as e:
+                if endpoint is endpoints[-1] or not is_endpoint_failure(e):
+                    raise
+                _log.warning("Read of {} from etcd at {} failed ({!r}) - "
+                             "trying another member".format(key,
+                                                           endpoint.host,
+                                                           e))
+
+    def write(self, key, value, **kwargs):
+        return self._call_writer("write", key, value, **kwargs)
+
+    def delete(self, key, **kwargs):
+        return self._call_writer("delete", key, **kwargs)
+
+    def endpoints(self):
+        """Returns the known etcd members, best first."""
+        self._refresh_members()
+        with self._lock:
+            endpoints = self._endpoints.values()
+        return sorted(endpoints,
+                      key=lambda e: e.score(self.LOCAL_PREFERENCE))
+
+    def _call_writer(self, method, *args, **kwargs):
+        endpoint = self._leader_endpoint() if self._leader_writes else None
+        if endpoint is None:
+            return self._call(self.endpoints()[0], method, *args, **kwargs)
+
+        try:
+            return self._call(endpoint, method, *args, **kwargs)
+        except Exception as e:
+            if is_endpoint_failure(e):
+                # Leadership may have moved, so look again before the next
+                # write.
+                _log.warning("Write to etcd leader at {} failed ({!r})".format(
+                    endpoint.host, e))
+                with self._lock:
+                    self._leader_checked_at = None
+            raise
+
+    def _call(self, endpoint, method, *args, **kwargs):
+        start = time()
+        try:
+            result = getattr(endpoint.client, method)(*args, **kwargs)
+        except Exception as e:
+            if is_endpoint_failure(e):
+                endpoint.record_failure(time() - start)
+            elif not kwargs.get("wait"):
+                endpoint.record_success(time() - start)
+            raise
+
+        if not kwargs.get("wait"):
+            endpoint.record_success(time() - start)
+        return result
+
+    def _hedged_read(self, key, **kwargs):
+        endpoints = self.endpoints()[:self.READ_ATTEMPTS]
+        pending = [self._submit(self._call, endpoints[0], "read", key,
+                                **kwargs)]
+        done, _ = futures.wait(pending, timeout=self.HEDGE_DELAY)
+
+        if not done and len(endpoints) > 1:
+            _log.debug("etcd at {} is slow to answer - also reading {} from "
+                       "{}".format(endpoints[0].host, key, endpoints[1].host))
+            pending.append(self._submit(self._call, endpoints[1], "read",
+                                        key, **kwargs))
+
+        # Return the first answer we get. If a member fails, wait for the
+        # other one (if there is one) instead.
+        while True:
+            done, not_done = futures.wait(
+                pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    return future.result()
+                if not not_done or not is_endpoint_failure(error):
+                    raise error
+            pending = list(not_done)
+
+    def _submit(self, func, *args, **kwargs):
+        # Hedged reads run on the shared event loop's workers. A synchronizer
+        # is blocked until they finish, so they go ahead of other work.
+        return get_event_loop().submit(Priority.HIGH,
+                                       lambda: func(*args, **kwargs))
+
+    def _local_endpoint(self):
+        with self._lock:
+            return self._endpoints[self.host]
+
+    def _leader_endpoint(self):
+        # Returns the endpoint for the leader, or None if we don't know which
+        # member that is.
+        self._refresh_members()
+        now = time()
+        with self._lock:
+            if (self._leader_checked_at is not None and
+                    now < self._leader_checked_at +
+                    self.LEADER_REFRESH_INTERVAL):
+                return self._endpoints.get(self._leader)
+            self._leader_checked_at = now
+
+        leader = self._find_leader()
+        with self._lock:
+            if leader != self._leader:
+                _log.info("etcd leader is now {}".format(leader))
+                self._leader = leader
+            if leader is None:
+                return None
+            self._add_endpoint(leader)
+            return self._endpoints[leader]
+
+    def _find_leader(self):
+        # Asks the local member (or proxy), and then the next best member,
+        # which member is the leader.
+        endpoints = [self._local_endpoint()]
+        endpoints += [e for e in self.endpoints() if not e.local]
+        for endpoint in endpoints[:self.READ_ATTEMPTS]:
+            try:
+                urls = endpoint.client.leader.get("clientURLs", [])
+                if urls:
+                    return urlparse(urls[0]).hostname
+            except Exception as e:
+                _log.debug("Unable to find etcd leader from {}: {!r}".format(
+                    endpoint.host, e))
+        return None
+
+    def _add_endpoint(self, host, local=False):
+        # Must be called with the lock held (or before any other thread can
+        # see this client).
+        if host not in self._endpoints:
+            _log.info("Using etcd member at {}:{}".format(host, self.port))
+            self._endpoints[host] = Endpoint(
+                host, self._client_factory(host, self.port), local)
+
+    def _refresh_members(self):
+        now = time()
+        with self._lock:
+            if (self._members_checked_at is not None and
+                    now < self._members_checked_at +
+                    self.MEMBERS_REFRESH_INTERVAL):
+                return
+            self._members_checked_at = now
+
+        members = self._read_members_file()
+        if members is None:
+            members = self._read_member_list()
+        if not members:
+            return
+
+        with self._lock:
+            for host in members:
+                self._add_endpoint(host)
+
+            # Forget members that have been removed, but always keep the local
+            # one and the leader.
+            for host in self._endpoints.keys():
+                if (host not in members and
+                        host not in (self.host, self._leader)):
+                    _log.info("No longer using etcd member at {}".format(host))
+                    del self._endpoints[host]
+
+    def _read_members_file(self):
+        try:
+            mtime = os.stat(self._members_file).st_mtime
+            if mtime == self._members_mtime:
+                with self._lock:
+                    return self._endpoints.keys()
+
+            with open(self._members_file) as f:
+                members = [ip.strip() for ip in f.read().split(",")
+                           if ip.strip()]
+            self._members_mtime = mtime
+            return members
+        except (IOError, OSError):
+            return None
+
+    def _read_member_list(self):
+        try:
+            local_client = self._endpoints[self.host].client
+            members = []
+            for member in local_client.members.values():
+                for url in member.get("clientURLs", []):
+                    members.append(urlparse(url).hostname)
+            return members
+        except Exception as e:
+            _log.debug("Unable to read etcd member list: {!r}".format(e))
+            return None
@@ -0,0 +1,339 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import errno
+import etcd
+import httplib
+import json
+import logging
+import socket
+import urllib
+from threading import Lock
+
+_log = logging.getLogger(__name__)
+
+# The path that etcd serves the v2 keys API on.
+KEYS_PREFIX = "/v2/keys"
+
+_decode_json = json.JSONDecoder().decode
+
+
+class V2Result(object):
+    """A node from a v2 response.
+
+    This has the same attributes as python-etcd's EtcdResult, so can be used
+    in its place, but is built straight from the parsed JSON. The children of
+    a recursive read are only turned into results if someone asks for
+    them."""
+    __slots__ = ("action",
+                 "key",
+                 "value",
+                 "expiration",
+                 "ttl",
+                 "modifiedIndex",
+                 "createdIndex",
+                 "newKey",
+                 "dir",
+                 "etcd_index",
+                 "raft_index",
+                 "_children")
+
+    def __init__(self, action, node):
+        get = node.get
+        self.action = action
+        self.key = get("key")
+        self.value = get("value")
+        self.expiration = get("expiration")
+        self.ttl = get("ttl")
+        self.modifiedIndex = get("modifiedIndex")
+        self.createdIndex = get("createdIndex")
+        self.newKey = get("newKey", False)
+        self.dir = get("dir", False)
+        self._children = get("nodes", []) if self.dir else []
+        self.etcd_index = None
+        self.raft_index = None
+
+    def get_subtree(self, leaves_only=False):
+        if not self._children:
+            yield self
+            return
+
+        if not leaves_only:
+            yield self
+        for child in self._children:
+            for node in V2Result(None, child).get_subtree(leaves_only):
+                yield node
+
+    @property
+    def leaves(self):
+        return self.get_subtree(leaves_only=True)
+
+    @property
+    def children(self):
+        return self.leaves
+
+    def __repr__(self):
+        return "V2Result(action={!r}, key={!r}, modifiedIndex={!r})".format(
+            self.action, self.key, self.modifiedIndex)
+
+
+def result_from_response(response, data):
+    """Turns a v2 keys response (an httplib response and its body) into a
+    V2Result, raising the python-etcd exception that matches any error."""
+    try:
+        payload = _decode_json(data)
+    except (TypeError, ValueError) as e:
+        raise etcd.EtcdException(
+            "Server response was not valid JSON: {!r}".format(e))
+
+    if response.status not in (200, 201):
+        if not isinstance(payload, dict):
+            payload = {"message": payload}
+        payload["status"] = response.status
+        etcd.EtcdError.handle(payload)
+
+    result = V2Result(payload.get("action"), payload.get("node", {}))
+    if response.status == 201:
+        result.newKey = True
+    result.etcd_index = int(response.getheader("x-etcd-index", 1))
+    result.raft_index = int(response.getheader("x-raft-index", 1))
+    return result
+
+
+def _closed_unanswered(error):
+    # Whether error, raised while waiting for the response to a request, shows
+    # that the server closed the connection without answering it.
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    return (isinstance(error, socket.error) and
+            error.errno in (errno.ECONNRESET, errno.EPIPE))
+
+
+def _as_param(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class EtcdV2Client(object):
+    """A client for the parts of etcd's v2 keys API that we use - reads
+    (including watches), compare-and-swap writes and deletes.
+
+    This presents the same interface as python-etcd's Client (as far as we
+    use it), raising the same exceptions, but without its per-request
+    overheads. Requests go over a small pool of persistent connections, and
+    results are parsed straight from the response body.
+
+    Timeouts are per request. A read, write or delete that etcd doesn't
+    answer within timeout seconds (READ_TIMEOUT by default) fails with
+    EtcdConnectionFailed. A watch waits up to timeout seconds (or forever if
+    it's None) for a change, and then raises EtcdWatchTimedOut."""
+
+    READ_TIMEOUT = 10
+
+    # The most connections kept open while idle. More than this may be open
+    # at once if several threads are using the client.
+    MAX_IDLE_CONNECTIONS = 4
+
+    def __init__(self, host, port=4000):
+        self.host = host
+        self.port = port
+        self.base_uri = "http://{}:{}".format(host, port)
+        self._lock = Lock()
+        self._idle = []
+
+        # The number of TCP connections this client has opened.
+        self.connections_established = 0
+
+    def read(self,
+             key,
+             wait=False,
+             waitIndex=None,
+             recursive=False,
+             timeout=None,
+             quorum=False,
+             **kwargs):
+        params = []
+        if recursive:
+            params.append(("recursive", "true"))
+        if quorum:
+            params.append(("quorum", "true"))
+        if wait:
+            params.append(("wait", "true"))
+            if waitIndex:
+                params.append(("waitIndex", waitIndex))
+        return self._request("GET", key, params, timeout=timeout, wait=wait)
+
+    def get(self, key):
+        return self.read(key)
+
+    def write(self,
+              key,
+              value,
+              ttl=None,
+              prevValue=None,
+              prevIndex=None,
+              prevExist=None,
+              timeout=None,
+              **kwargs):
+        fields = [("value", value)]
+        if ttl is not None:
+            fields.append(("ttl", ttl))
+        if prevValue is not None:
+            fields.append(("prevValue", prevValue))
+        if prevIndex:
+            fields.append(("prevIndex", prevIndex))
+        if prevExist is not None:
+            fields.append(("prevExist", prevExist))
+        body = urllib.urlencode([(name, _as_param(field))
+                                 for name, field in fields])
+        return self._request("PUT", key, [], body=body, timeout=timeout)
+
+    def set(self, key, value, ttl=None):
+        return self.write(key, value, ttl=ttl)
+
+    def delete(self,
+               key,
+               recursive=False,
+               prevValue=None,
+               prevIndex=None,
+               timeout=None,
+               **kwargs):
+        params = []
+        if recursive:
+            params.append(("recursive", "true"))
+        if prevValue is not None:
+            params.append(("prevValue", _as_param(prevValue)))
+        if prevIndex:
+            params.append(("prevIndex", prevIndex))
+        return self._request("DELETE", key, params, timeout=timeout)
+
+    @property
+    def members(self):
+        """The members of the etcd cluster, by ID, as python-etcd's Client
+        returns them."""
+        return dict((member["id"], member)
+                    for member in self._get_json("/v2/members")["members"])
+
+    @property
+    def leader(self):
+        """The current leader of the etcd cluster, as an entry from
+        members."""
+        stats = self._get_json("/v2/stats/self")
+        return self.members[stats["leaderInfo"]["leader"]]
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def _request(self, method, key, params, body=None, timeout=None,
+                 wait=False):
+        if not key.startswith("/"):
+            key = "/" + key
+        path = KEYS_PREFIX + urllib.quote(key)
+        if params:
+            path += "?" + urllib.urlencode(params)
+        response, data = self._send(method, path, body, timeout, wait)
+        return result_from_response(response, data)
+
+    def _get_json(self, path):
+        response, data = self._send("GET", path)
+        if response.status != 200:
+            raise etcd.EtcdException(
+                "Unable to read {} from etcd: status {}".format(
+                    path, response.status))
+        try:
+            return _decode_json(data)
+        except ValueError as e:
+            raise etcd.EtcdException(
+                "Server response was not valid JSON: {!r}".format(e))
+
+    def _send(self, method, path, body=None, timeout=None, wait=False):
+        # Returns the response and its body.
+        headers = {}
+        if body is not None:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if timeout is None and not wait:
+            timeout = self.READ_TIMEOUT
+
+        for attempt in range(2):
+            connection, reused = self._get_connection()
+            sent = answered = False
+            try:
+                connection.sock.settimeout(timeout)
+                connection.request(method, path, body, headers)
+                sent = True
+                # Without buffering, httplib reads the headers a byte at a
+                # time.
+                response = connection.getresponse(buffering=True)
+                answered = True
+                data = response.read()
+                break
+            except socket.timeout:
+                # The request is still outstanding on the connection, so it
+                # can't be used again.
+                connection.close()
+                if wait:
+                    raise etcd.EtcdWatchTimedOut(
+                        "Watch timed out: Read timed out")
+                raise etcd.EtcdConnectionFailed(
+                    "Request to etcd at {} timed out: Read timed out".format(
+                        self.base_uri))
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+
+                # etcd may have closed an idle connection, so retry once on a
+                # fresh one. A write or delete is only resent if etcd can't
+                # have acted on it - either it wasn't sent, or etcd closed the
+                # connection without starting to answer. Otherwise leave it to
+                # the caller to find out what happened.
+                resendable = (method == "GET" or
+                              not sent or
+                              (not answered and _closed_unanswered(e)))
+                if not reused or attempt > 0 or not resendable:
+                    raise etcd.EtcdConnectionFailed(
+                        "Connection to etcd failed due to {!r}".format(e),
+                        cause=e)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._put_connection(connection)
+
+        return response, data
+
+    def _get_connection(self):
+        # Returns a connection, and whether it's been used before.
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+
+        connection = httplib.HTTPConnection(self.host,
+                                            self.port,
+                                            timeout=self.READ_TIMEOUT)
+        try:
+            connection.connect()
+        except socket.error as e:
+            raise etcd.EtcdConnectionFailed(
+                "Unable to connect to etcd at {}: {!r}".format(self.base_uri,
+                                                               e),
+                cause=e)
+
+        with self._lock:
+            self.connections_established += 1
+        return connection, False
+
+    def _put_connection(self, connection):
+        with self._lock:
+            if len(self._idle) < self.MAX_IDLE_CONNECTIONS:
+                self._idle.append(connection)
+                return
+        connection.close()
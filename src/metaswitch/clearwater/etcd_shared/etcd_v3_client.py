@@ -0,0 +1,437 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import base64
+import etcd
+import httplib
+import json
+import logging
+import socket
+from collections import deque
+from threading import Lock, local
+from time import time
+
+_log = logging.getLogger(__name__)
+
+# The path that etcd 3.1's JSON gateway serves the v3 API on.
+API_PREFIX = "/v3alpha"
+
+
+def _encode(data):
+    if isinstance(data, unicode):
+        data = data.encode("utf-8")
+    return base64.b64encode(data)
+
+
+def _decode(data):
+    if data is None:
+        return None
+    return base64.b64decode(data).decode("utf-8")
+
+
+def prefix_range_end(prefix):
+    """Returns the end of the range of keys that start with prefix, for use as
+    a v3 range_end."""
+    for i in reversed(range(len(prefix))):
+        if prefix[i] != "\xff":
+            return prefix[:i] + chr(ord(prefix[i]) + 1)
+
+    # Every key is in the range.
+    return "\0"
+
+
+def _key_range(key, recursive):
+    request = {"key": _encode(key)}
+    if recursive:
+        request["range_end"] = _encode(prefix_range_end(key))
+    return request
+
+
+def _node_from_kv(kv):
+    # The gateway leaves out fields with default values, and sends 64-bit
+    # integers as strings.
+    return {"key": _decode(kv["key"]),
+            "value": _decode(kv.get("value", "")),
+            "modifiedIndex": int(kv.get("mod_revision", 0)),
+            "createdIndex": int(kv.get("create_revision", 0))}
+
+
+def _result(action, node, revision):
+    result = etcd.EtcdResult(action=action, node=node)
+    result.etcd_index = revision
+    result.raft_index = revision
+    return result
+
+
+def _result_from_event(event, revision):
+    kv = event["kv"]
+    if event.get("type", "PUT") == "DELETE":
+        node = {"key": _decode(kv["key"]),
+                "modifiedIndex": int(kv.get("mod_revision", 0))}
+        return _result("delete", node, revision)
+
+    return _result("set", _node_from_kv(kv), revision)
+
+
+def _raise_for_error(status, data):
+    try:
+        message = json.loads(data).get("error", data)
+    except (TypeError, ValueError):
+        message = data
+    raise etcd.EtcdException(
+        "etcd v3 request failed with status {}: {}".format(status, message))
+
+
+class EtcdV3Client(object):
+    """Talks to etcd's v3 API through its JSON gateway.
+
+    This presents the subset of python-etcd's Client interface that the
+    synchronizers use (read, write and delete), raising the same exceptions,
+    so that it can be used in place of a v2 client. Revisions stand in for
+    v2 indexes - a key's modifiedIndex is its mod_revision, and a result's
+    etcd_index is the store revision it was read at.
+
+    Waiting reads (watches) go over a watch stream per thread, so that
+    synchronizers watching different keys don't hold each other up or keep
+    re-opening each other's streams.
+
+    Note that the v2 and v3 APIs have separate keyspaces, so every node in a
+    deployment must use the same API."""
+
+    READ_TIMEOUT = 10
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.base_uri = "http://{}:{}".format(host, port)
+        self._lock = Lock()
+        self._connection = None
+        self._watch_streams = local()
+
+    def read(self,
+             key,
+             wait=False,
+             waitIndex=None,
+             recursive=False,
+             timeout=None,
+             quorum=True,
+             **kwargs):
+        if wait:
+            return self._watch_stream().watch(key,
+                                              waitIndex,
+                                              recursive=recursive,
+                                              timeout=timeout)
+
+        request = _key_range(key, recursive)
+        if not quorum:
+            request["serializable"] = True
+
+        response = self._post("/kv/range", request, timeout)
+        revision = int(response["header"]["revision"])
+        kvs = response.get("kvs", [])
+
+        if recursive:
+            node = {"key": key,
+                    "dir": True,
+                    "nodes": [_node_from_kv(kv) for kv in kvs]}
+            return _result("get", node, revision)
+
+        if not kvs:
+            raise etcd.EtcdKeyNotFound("Key not found : {}".format(key))
+
+        return _result("get", _node_from_kv(kvs[0]), revision)
+
+    def write(self, key, value, prevIndex=None, prevExist=None, **kwargs):
+        """Sets key to value. As in v2, if prevIndex is given the write only
+        succeeds if the key was last modified at that index, and if prevExist
+        is given it only succeeds if the key does (or doesn't) exist."""
+        compare = []
+        if prevIndex:
+            compare.append({"key": _encode(key),
+                            "target": "MOD",
+                            "result": "EQUAL",
+                            "mod_revision": str(prevIndex)})
+        elif prevExist is not None:
+            compare.append({"key": _encode(key),
+                            "target": "VERSION",
+                            "result": "GREATER" if prevExist else "EQUAL",
+                            "version": "0"})
+
+        request = {"compare": compare,
+                   "success": [{"request_put": {"key": _encode(key),
+                                                "value": _encode(value)}}],
+                   "failure": [{"request_range": {"key": _encode(key)}}]}
+        response = self._post("/kv/txn", request, kwargs.get("timeout"))
+        revision = int(response["header"]["revision"])
+
+        if not response.get("succeeded", False):
+            if prevIndex:
+                raise etcd.EtcdCompareFailed(
+                    "Compare failed : [{} != {}]".format(
+                        prevIndex, self._current_revision(response)))
+            elif prevExist:
+                raise etcd.EtcdKeyNotFound("Key not found : {}".format(key))
+            else:
+                raise etcd.EtcdAlreadyExist(
+                    "Key already exists : {}".format(key))
+
+        node = {"key": key,
+                "value": value,
+                "modifiedIndex": revision,
+                "createdIndex": revision}
+        return _result("set", node, revision)
+
+    def delete(self, key, recursive=False, **kwargs):
+        request = _key_range(key, recursive)
+        response = self._post("/kv/deleterange", request, kwargs.get("timeout"))
+        revision = int(response["header"]["revision"])
+
+        if int(response.get("deleted", 0)) == 0:
+            raise etcd.EtcdKeyNotFound("Key not found : {}".format(key))
+
+        return _result("delete", {"key": key, "modifiedIndex": revision},
+                       revision)
+
+    def watch_transport(self):
+        """Returns a new watch stream to the same etcd server, for the shared
+        watch hub to use."""
+        return V3WatchStream(self.host, self.port)
+
+    def _watch_stream(self):
+        # Returns this thread's watch stream, opening it if need be.
+        stream = getattr(self._watch_streams, "stream", None)
+        if stream is None:
+            stream = V3WatchStream(self.host, self.port)
+            self._watch_streams.stream = stream
+        return stream
+
+    def _current_revision(self, response):
+        # Pull the key's current mod_revision out of the failure branch of a
+        # transaction.
+        for op in response.get("responses", []):
+            kvs = op.get("response_range", {}).get("kvs", [])
+            if kvs:
+                return int(kvs[0].get("mod_revision", 0))
+        return None
+
+    def _post(self, path, request, timeout):
+        body = json.dumps(request)
+
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._connection is None:
+                        self._connection = httplib.HTTPConnection(
+                            self.host, self.port, timeout=self.READ_TIMEOUT)
+                        self._connection.connect()
+
+                    self._connection.sock.settimeout(timeout or
+                                                     self.READ_TIMEOUT)
+                    self._connection.request(
+                        "POST",
+                        API_PREFIX + path,
+                        body,
+                        {"Content-Type": "application/json"})
+                    response = self._connection.getresponse()
+                    data = response.read()
+                    break
+                except (httplib.HTTPException, socket.error) as e:
+                    self._connection.close()
+                    self._connection = None
+
+                    # etcd may have closed an idle connection, so retry once
+                    # on a fresh one.
+                    if attempt > 0:
+                        raise etcd.EtcdConnectionFailed(
+                            "Connection to etcd failed due to {!r}".format(e),
+                            cause=e)
+
+        if response.status != 200:
+            _raise_for_error(response.status, data)
+
+        return json.loads(data)
+
+
+class V3WatchStream(object):
+    """A v3 watch, streamed over a single long-lived HTTP response.
+
+    This has the same interface as the v2 KeepAliveWatchTransport. The first
+    call opens a stream watching from wait_index onwards, and etcd then sends
+    every event on the watched keys down it. Later calls return the next
+    event at or after their wait_index, so there's no need to re-arm the
+    watch after each event or timeout. The stream is only re-opened if the
+    caller asks for something it doesn't cover (e.g. different keys, or an
+    index before the one it started at)."""
+
+    RECEIVE_SIZE = 4096
+
+    def __init__(self, host, port):
+        self._host = host
+        self._port = port
+        self._sock = None
+        self._request = None
+        self._start_index = None
+        self._buffer = ""
+        self._body = ""
+        self._chunked = False
+        self._headers_read = False
+        self._events = deque()
+
+        # The number of TCP connections this stream has opened.
+        self.connections_established = 0
+
+    def watch(self, key, wait_index, recursive=False, timeout=None):
+        """Returns an EtcdResult for the next change to key at or after
+        wait_index. Raises EtcdWatchTimedOut if there isn't one within
+        timeout seconds, leaving the stream open for the next call."""
+        request = (key, recursive)
+        if (self._sock is None or
+            self._request != request or
+            wait_index < self._start_index):
+            self.close()
+            self._open(key, wait_index, recursive)
+            self._request = request
+            self._start_index = wait_index
+
+        deadline = None if timeout is None else time() + timeout
+
+        while True:
+            while self._events:
+                result = self._events.popleft()
+                if result.modifiedIndex >= wait_index:
+                    return result
+
+            remaining = None if deadline is None else deadline - time()
+            if remaining is not None and remaining <= 0:
+                raise etcd.EtcdWatchTimedOut("Read timed out")
+
+            self._receive(remaining)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._request = None
+        self._buffer = ""
+        self._body = ""
+        self._headers_read = False
+        self._events.clear()
+
+    def _open(self, key, wait_index, recursive):
+        create_request = _key_range(key, recursive)
+        if wait_index:
+            create_request["start_revision"] = str(wait_index)
+        body = json.dumps({"create_request": create_request})
+
+        try:
+            self._sock = socket.create_connection((self._host, self._port),
+                                                  EtcdV3Client.READ_TIMEOUT)
+            self.connections_established += 1
+            self._sock.sendall(
+                "POST {}/watch HTTP/1.1\r\n"
+                "Host: {}:{}\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {}\r\n"
+                "\r\n"
+                "{}".format(API_PREFIX, self._host, self._port, len(body), body))
+        except socket.error as e:
+            self.close()
+            raise etcd.EtcdConnectionFailed(
+                "Unable to open watch stream to etcd at {}:{}: {!r}".format(
+                    self._host, self._port, e), cause=e)
+
+    def _receive(self, timeout):
+        self._sock.settimeout(timeout)
+        try:
+            data = self._sock.recv(self.RECEIVE_SIZE)
+        except socket.timeout:
+            raise etcd.EtcdWatchTimedOut("Read timed out")
+        except socket.error as e:
+            self.close()
+            raise etcd.EtcdConnectionFailed(
+                "Watch stream failed: {!r}".format(e), cause=e)
+
+        if not data:
+            # etcd has closed the stream. Re-open it next time round.
+            _log.debug("etcd closed watch stream to {}:{}".format(self._host,
+                                                                 self._port))
+            self.close()
+            raise etcd.EtcdWatchTimedOut("Read timed out")
+
+        self._buffer += data
+        if not self._headers_read:
+            self._parse_headers()
+        if self._headers_read:
+            self._parse_body()
+
+    def _parse_headers(self):
+        end = self._buffer.find("\r\n\r\n")
+        if end == -1:
+            return
+
+        lines = self._buffer[:end].split("\r\n")
+        self._buffer = self._buffer[end + 4:]
+        self._headers_read = True
+
+        status = int(lines[0].split(" ", 2)[1])
+        self._chunked = any(line.lower().startswith("transfer-encoding:") and
+                            "chunked" in line.lower() for line in lines[1:])
+
+        if status != 200:
+            data = self._buffer
+            self.close()
+            _raise_for_error(status, data)
+
+    def _parse_body(self):
+        if self._chunked:
+            while True:
+                line_end = self._buffer.find("\r\n")
+                if line_end == -1:
+                    break
+                size = int(self._buffer[:line_end].split(";")[0], 16)
+                chunk_end = line_end + 2 + size + 2
+                if len(self._buffer) < chunk_end:
+                    break
+                self._body += self._buffer[line_end + 2:line_end + 2 + size]
+                self._buffer = self._buffer[chunk_end:]
+        else:
+            self._body += self._buffer
+            self._buffer = ""
+
+        decoder = json.JSONDecoder()
+        while True:
+            self._body = self._body.lstrip()
+            if not self._body:
+                break
+            try:
+                message, end = decoder.raw_decode(self._body)
+            except ValueError:
+                # We don't have the whole message yet.
+                break
+            self._body = self._body[end:]
+            self._handle_message(message)
+
+    def _handle_message(self, message):
+        if "error" in message:
+            self.close()
+            raise etcd.EtcdException(
+                "etcd v3 watch failed: {}".format(message["error"]))
+
+        result = message.get("result", {})
+        if int(result.get("compact_revision", 0)) != 0:
+            # The revision we asked to watch from has been compacted away.
+            # Events are available again from the compaction revision, so
+            # report the index before it (as v2 reports its current index).
+            compact_revision = int(result["compact_revision"])
+            self.close()
+            raise etcd.EtcdEventIndexCleared(
+                "The event in requested index is outdated and cleared",
+                payload={"index": compact_revision - 1})
+
+        revision = int(result.get("header", {}).get("revision", 0))
+        for event in result.get("events", []):
+            self._events.append(_result_from_event(event, revision))
@@ -0,0 +1,254 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import heapq
+import itertools
+import logging
+from concurrent import futures
+from threading import Thread, Condition, Lock, current_thread
+from time import time
+from .metrics import metrics
+
+_log = logging.getLogger(__name__)
+
+
+# The priorities of work run on an EventLoop's worker threads. Work with a
+# lower value runs first; work with the same priority runs in the order it was
+# submitted.
+class Priority:
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+    NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+
+class TimerHandle(object):
+    """A callback scheduled on an EventLoop, which can be cancelled until it
+    has run."""
+    def __init__(self, when, callback, args):
+        self.when = when
+        self._callback = callback
+        self._args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        if not self.cancelled:
+            self._callback(*self._args)
+
+
+class EventLoop(object):
+    """Runs timed callbacks on a single thread.
+
+    The daemons' timers (for example queue timers and clustering alarms) are
+    scheduled here rather than each having a thread of their own that sits in
+    a timed wait. Callbacks run on the loop's thread, so must be quick - any
+    blocking work should be handed to run_in_executor() or submit(), which run
+    it on a fixed pool of at most MAX_WORKERS worker threads, taking work from
+    a priority queue.
+
+    How late timers run, and how long work waits for a worker, are recorded
+    in the scheduler_timer_lateness_seconds and scheduler_queue_seconds
+    histograms."""
+
+    MAX_WORKERS = 4
+
+    def __init__(self, name="Event loop"):
+        self._name = name
+        self._condition = Condition()
+        self._timers = []
+        self._sequence = itertools.count()
+        self._thread = None
+        self._stopped = False
+
+        # The work waiting for a worker thread, as a heap of (priority,
+        # sequence number, submission time, future, function, arguments).
+        self._work_condition = Condition()
+        self._work = []
+        self._workers = []
+        self._idle_workers = 0
+
+    def call_later(self, delay, callback, *args):
+        """Runs callback(*args) on the loop after delay seconds. Returns a
+        handle that can be used to cancel it."""
+        handle = TimerHandle(time() + delay, callback, args)
+
+        with self._condition:
+            # The sequence number keeps callbacks due at the same time in the
+            # order they were scheduled.
+            heapq.heappush(self._timers,
+                           (handle.when, next(self._sequence), handle))
+            self._start()
+            self._condition.notify()
+
+        return handle
+
+    def call_soon(self, callback, *args):
+        return self.call_later(0, callback, *args)
+
+    def run_in_executor(self, func, *args):
+        """Runs func(*args) on one of the loop's worker threads, returning a
+        future for its result."""
+        return self.submit(Priority.NORMAL, func, *args)
+
+    def submit(self, priority, func, *args):
+        """Runs func(*args) on one of the loop's worker threads once any
+        work with a higher priority has been started, returning a future for
+        its result."""
+        future = futures.Future()
+
+        with self._work_condition:
+            if self._stopped:
+                future.cancel()
+                return future
+
+            heapq.heappush(self._work, (priority,
+                                        next(self._sequence),
+                                        time(),
+                                        future,
+                                        func,
+                                        args))
+            if (self._idle_workers == 0 and
+                len(self._workers) < self.MAX_WORKERS):
+                worker = Thread(target=self._run_worker,
+                                name="{} worker {}".format(
+                                    self._name, len(self._workers) + 1))
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+            self._work_condition.notify()
+
+        return future
+
+    def queued(self):
+        """Returns the amount of work waiting for a worker thread."""
+        with self._work_condition:
+            return len(self._work)
+
+    def pending(self):
+        """Returns the number of callbacks waiting to run."""
+        with self._condition:
+            return len([entry for entry in self._timers
+                        if not entry[2].cancelled])
+
+    def stop(self, timeout=None):
+        """Stops the loop's thread and its worker threads, waiting up to
+        timeout seconds for each to finish. Callbacks that haven't run yet
+        are dropped, and work that hasn't started is cancelled."""
+        with self._condition:
+            self._stopped = True
+            self._timers = []
+            self._condition.notify()
+            thread = self._thread
+
+        with self._work_condition:
+            work, self._work = self._work, []
+            workers = list(self._workers)
+            self._work_condition.notify_all()
+
+        for entry in work:
+            entry[3].cancel()
+
+        for t in [thread] + workers:
+            if t is not None and t is not current_thread():
+                t.join(timeout)
+
+    def _start(self):
+        # Must be called with the condition held.
+        if self._thread is None and not self._stopped:
+            self._thread = Thread(target=self._run, name=self._name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+
+                    # Throw away cancelled callbacks, so they don't build up.
+                    while self._timers and self._timers[0][2].cancelled:
+                        heapq.heappop(self._timers)
+
+                    if self._timers:
+                        delay = self._timers[0][0] - time()
+                        if delay <= 0:
+                            handle = heapq.heappop(self._timers)[2]
+                            break
+                        self._condition.wait(delay)
+                    else:
+                        self._condition.wait()
+
+            if not handle.cancelled:
+                metrics.histogram("scheduler_timer_lateness_seconds",
+                                  loop=self._name).observe(
+                                      time() - handle.when)
+
+            try:
+                handle.run()
+            except Exception:
+                _log.exception("Exception in callback on {}".format(
+                    self._name))
+
+    def _run_worker(self):
+        while True:
+            with self._work_condition:
+                self._idle_workers += 1
+                while not self._work and not self._stopped:
+                    self._work_condition.wait()
+                self._idle_workers -= 1
+                if self._stopped:
+                    return
+                priority, _, submitted, future, func, args = heapq.heappop(
+                    self._work)
+
+            metrics.histogram("scheduler_queue_seconds",
+                              loop=self._name,
+                              priority=Priority.NAMES.get(priority,
+                                                          str(priority))
+                              ).observe(time() - submitted)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                _log.exception("%s: %s", type(e).__name__, e.__str__())
+                future.set_exception(e)
+
+
+# The event loop shared by everything in this process.
+_loop = None
+_loop_lock = Lock()
+
+
+# How long to wait for the shared loop's threads to finish when stopping it.
+STOP_TIMEOUT = 1
+
+
+def get_event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = EventLoop()
+        return _loop
+
+
+def stop_event_loop():
+    """Stops the shared event loop, if it's been started (e.g. at the end of a
+    test). The next call to get_event_loop() creates a new one."""
+    global _loop
+    with _loop_lock:
+        loop, _loop = _loop, None
+
+    if loop is not None:
+        loop.stop(STOP_TIMEOUT)
@@ -0,0 +1,185 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import bisect
+import json
+import logging
+import os
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+
+_log = logging.getLogger(__name__)
+
+
+class Counter(object):
+    def __init__(self):
+        self._lock = Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {"type": "counter", "value": self.value}
+
+
+class Gauge(object):
+    """A value that can go up and down, such as how far behind something
+    is."""
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return {"type": "gauge", "value": self.value}
+
+
+class Histogram(object):
+    """Tracks the distribution of a latency (in seconds)."""
+
+    # The upper bounds of the buckets. Anything slower goes in a final
+    # overflow bucket.
+    BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300]
+
+    def __init__(self):
+        self._lock = Lock()
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.bucket_counts = [0] * (len(self.BUCKETS) + 1)
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+            self.bucket_counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+
+    @contextmanager
+    def time(self):
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(time() - start)
+
+    def snapshot(self):
+        with self._lock:
+            buckets = {str(bound): count for bound, count in
+                       zip(self.BUCKETS + ["+Inf"], self.bucket_counts)}
+            return {"type": "histogram",
+                    "count": self.count,
+                    "sum": self.sum,
+                    "max": self.max,
+                    "buckets": buckets}
+
+
+class MetricsRegistry(object):
+    """Holds all the counters, gauges and histograms in this process, each identified
+    by a name and a set of labels (such as the plugin it relates to)."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._metrics = {}
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name, **labels):
+        return self._get(Histogram, name, labels)
+
+    def labelled(self, **labels):
+        return LabelledMetrics(self, labels)
+
+    def clear(self):
+        with self._lock:
+            self._metrics = {}
+
+    def snapshot(self):
+        with self._lock:
+            metrics = self._metrics.items()
+
+        snapshot = []
+        for (name, labels), metric in sorted(metrics):
+            entry = metric.snapshot()
+            entry["name"] = name
+            entry["labels"] = dict(labels)
+            snapshot.append(entry)
+        return snapshot
+
+    def write_stats_file(self, path):
+        """Writes the current value of every metric to path, as JSON. The
+        file is replaced atomically, so readers never see a partial file."""
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.snapshot(), f, indent=2)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            _log.warning("Unable to write stats file {}: {!r}".format(path, e))
+
+    def _get(self, klass, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = klass()
+                self._metrics[key] = metric
+            return metric
+
+
+class LabelledMetrics(object):
+    """Gives access to the metrics in a registry with a fixed set of labels -
+    for example, those for a single synchronizer's plugin."""
+
+    def __init__(self, registry, labels):
+        self._registry = registry
+        self._labels = labels
+
+    def counter(self, name, **labels):
+        return self._registry.counter(name, **self._merge(labels))
+
+    def gauge(self, name, **labels):
+        return self._registry.gauge(name, **self._merge(labels))
+
+    def histogram(self, name, **labels):
+        return self._registry.histogram(name, **self._merge(labels))
+
+    def _merge(self, labels):
+        merged = dict(self._labels)
+        merged.update(labels)
+        return merged
+
+
+# The metrics for this process.
+metrics = MetricsRegistry()
+
+# How often to write out the stats file, in seconds.
+STATS_FILE_INTERVAL = 10
+
+
+def export_stats_file(pidfile, interval=STATS_FILE_INTERVAL):
+    """Periodically writes the process's metrics to a .stats file alongside
+    its pidfile."""
+    # The event loop records its own metrics, so is imported here.
+    from .event_loop import get_event_loop, Priority
+
+    path = os.path.splitext(pidfile)[0] + ".stats"
+    loop = get_event_loop()
+
+    def export():
+        loop.submit(Priority.LOW, metrics.write_stats_file, path)
+        loop.call_later(interval, export)
+
+    loop.call_soon(export)
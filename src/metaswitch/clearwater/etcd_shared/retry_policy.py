@@ -0,0 +1,147 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import etcd
+import logging
+import random
+from threading import Lock
+from time import time
+
+_log = logging.getLogger(__name__)
+
+
+class EtcdCircuitOpen(etcd.EtcdException):
+    """Raised instead of sending a request to an etcd endpoint that has been
+    failing consistently."""
+    pass
+
+
+class CircuitBreaker(object):
+    """Tracks consecutive failures against one etcd endpoint.
+
+    After FAILURE_THRESHOLD consecutive failures the breaker opens and
+    requests are refused without being sent. Once the open period has passed
+    a single probe request is let through (half-open): if it succeeds the
+    breaker closes, and if it fails the breaker re-opens for twice as long (up
+    to MAXIMUM_OPEN_TIME)."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    FAILURE_THRESHOLD = 5
+    INITIAL_OPEN_TIME = 1
+    MAXIMUM_OPEN_TIME = 30
+
+    def __init__(self, endpoint):
+        self._endpoint = endpoint
+        self._lock = Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._open_time = self.INITIAL_OPEN_TIME
+        self._opened_at = None
+
+    def state(self):
+        return self._state
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            # Let a probe through once the open period has passed. If we're
+            # already half-open but the probe never reported back, let another
+            # one through after the same period.
+            if time() >= self._opened_at + self._open_time:
+                _log.info("Probing etcd endpoint {} after {}s".format(
+                    self._endpoint, self._open_time))
+                self._state = self.HALF_OPEN
+                self._opened_at = time()
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                _log.info("etcd endpoint {} has recovered".format(
+                    self._endpoint))
+            self._state = self.CLOSED
+            self._failures = 0
+            self._open_time = self.INITIAL_OPEN_TIME
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+
+            if self._state == self.HALF_OPEN:
+                self._open_time = min(self._open_time * 2,
+                                      self.MAXIMUM_OPEN_TIME)
+                self._open(self._open_time)
+            elif (self._state == self.CLOSED and
+                  self._failures >= self.FAILURE_THRESHOLD):
+                self._open(self._open_time)
+
+    def _open(self, open_time):
+        # Must be called with the lock held.
+        _log.warning("{} consecutive failures talking to etcd endpoint {} - "
+                     "not sending requests for {}s".format(
+                         self._failures, self._endpoint, open_time))
+        self._state = self.OPEN
+        self._opened_at = time()
+
+
+# The circuit breakers for all the etcd endpoints used by this process.
+_breakers = {}
+_breakers_lock = Lock()
+
+
+def circuit_breaker_for(endpoint):
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint)
+            _breakers[endpoint] = breaker
+        return breaker
+
+
+class RetryPolicy(object):
+    """Decides how long to wait before retrying a failed etcd request.
+
+    Delays grow exponentially from initial_delay up to max_delay, with full
+    jitter (i.e. a uniformly random delay between zero and the current cap),
+    so that a brief blip is recovered from quickly while a deployment's worth
+    of nodes retrying against a struggling etcd spread their load out. The
+    policy also consults the circuit breaker for its endpoint."""
+
+    def __init__(self, endpoint, initial_delay, max_delay):
+        self._breaker = circuit_breaker_for(endpoint)
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._attempts = 0
+
+    def check(self):
+        """Raises EtcdCircuitOpen if requests to the endpoint are currently
+        being refused."""
+        if not self._breaker.allow_request():
+            raise EtcdCircuitOpen("Circuit breaker for etcd is open")
+
+    def succeeded(self):
+        self._attempts = 0
+        self._breaker.record_success()
+
+    def failed(self, error):
+        # Refusing to send a request isn't a new failure of the endpoint.
+        if not isinstance(error, EtcdCircuitOpen):
+            self._breaker.record_failure()
+
+    def next_delay(self):
+        # Stop counting once we're well past the maximum delay, so the
+        # exponent doesn't grow without bound during a long outage.
+        cap = min(self._max_delay, self._initial_delay * (2 ** self._attempts))
+        self._attempts = min(self._attempts + 1, 32)
+        return random.uniform(0, cap)
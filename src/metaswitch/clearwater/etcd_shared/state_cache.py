@@ -0,0 +1,86 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import json
+import logging
+import os
+from hashlib import sha256
+from threading import Lock
+
+_log = logging.getLogger(__name__)
+
+
+def _digest(value):
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return sha256(value).hexdigest()
+
+
+class StateCache(object):
+    """Remembers, across restarts, the last value of each etcd key that this
+    process finished handling.
+
+    For each key this stores the index the value was modified at and a digest
+    of the value. The file is rewritten atomically (by renaming a temporary
+    file over it) whenever anything changes, so a crash can't leave it half
+    written."""
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = Lock()
+        self._entries = {}
+
+        try:
+            with open(path) as f:
+                self._entries = json.load(f)
+        except IOError:
+            # There's no cache yet.
+            pass
+        except ValueError:
+            _log.warning("Ignoring corrupt state cache {}".format(path))
+
+    def matches(self, key, index, value):
+        """Returns True if value, modified at index, is what was last recorded
+        for key."""
+        with self._lock:
+            entry = self._entries.get(key)
+
+        return (entry is not None and
+                entry.get("index") == index and
+                entry.get("digest") == _digest(value))
+
+    def record(self, key, index, value):
+        entry = {"index": index, "digest": _digest(value)}
+
+        with self._lock:
+            if self._entries.get(key) == entry:
+                return
+            self._entries[key] = entry
+
+            tmp_path = self._path + ".tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(self._entries, f)
+                os.rename(tmp_path, self._path)
+            except (IOError, OSError) as e:
+                _log.warning("Unable to write state cache {}: {!r}".format(
+                    self._path, e))
+
+
+# The state cache for this process. This is None unless the daemon has
+# configured one.
+_state_cache = None
+
+
+def configure_state_cache(pidfile):
+    """Sets up the state cache, in a file alongside the daemon's pidfile."""
+    global _state_cache
+    _state_cache = StateCache(os.path.splitext(pidfile)[0] + ".state")
+
+
+def get_state_cache():
+    return _state_cache
@@ -5,81 +5,482 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
+from collections import deque
+from datetime import datetime
 from threading import Condition
 import etcd
-from etcd import EtcdResult, Client, EtcdException, EtcdKeyError
+import heapq
+import math
+from etcd import EtcdResult, Client
 from random import random, choice
-from time import sleep
+from time import sleep, time
 import os
-
-allowed_key = '/test'
-global_data = ""
-global_index = 0
-global_condvar = Condition()
+from metaswitch.clearwater.etcd_shared.etcd_v3_client import EtcdV3Client
 
 
 def EtcdFactory(*args, **kwargs):
     """Factory method, returning a connection to a real etcd if we need one for
-    FV, or to an in-memory implementation for UT."""
+    FV (using the v3 API if ETCD_API is "v3"), or to an in-memory
+    implementation for UT."""
     if os.environ.get('ETCD_IP'):
+        if os.environ.get('ETCD_API') == 'v3':
+            return EtcdV3Client(os.environ.get('ETCD_IP'),
+                                int(os.environ.get('ETCD_PORT', 4001)))
         return Client(os.environ.get('ETCD_IP'),
                       int(os.environ.get('ETCD_PORT', 4001)))
     else:
         return MockEtcdClient(None, None)
 
 
+def _normalize(key):
+    # etcd ignores repeated and trailing slashes.
+    return "/" + "/".join(part for part in key.split("/") if part)
+
+
+def _ancestors(key):
+    # The directories containing key, innermost first (not including "/").
+    parts = key.split("/")[1:-1]
+    return ["/" + "/".join(parts[:i]) for i in range(len(parts), 0, -1)]
+
+
+class EtcdSimulator(object):
+    """An in-memory model of an etcd v2 key space, shared by every
+    MockEtcdClient that uses it (as the members of an etcd cluster share
+    one).
+
+    It keeps the parts of etcd's behaviour that the synchronizers rely on:
+    - a single modification index, bumped by every change, with each key
+      remembering the indexes at which it was created and last modified
+    - a history of the last HISTORY_SIZE events, which watches are served
+      from, and which raises EtcdEventIndexCleared when a watch asks for an
+      event that has dropped out of it
+    - recursive reads and watches of directories
+    - compare-and-swap (prevIndex, prevValue and prevExist) and TTLs.
+
+    Requests return the body of etcd's response as a dict (with the index
+    etcd would return in the X-Etcd-Index header as etcd_index), and fail
+    with the exception python-etcd would raise.
+
+    Directories exist implicitly while they have keys in them, so they
+    don't have indexes of their own.
+
+    Requests can be slowed down by setting latency, and made to fail with
+    add_fault()."""
+
+    # How many events etcd keeps (which is fixed at 1000 in etcd itself).
+    HISTORY_SIZE = 1000
+
+    # The longest a watch waits for a change before timing out, whatever
+    # timeout the client asked for, so that UTs don't hang around. Set this
+    # to None to honour the client's timeout.
+    MAX_WATCH_TIME = 0.1
+
+    def __init__(self):
+        self._condition = Condition()
+        self.clear()
+
+    def clear(self):
+        """Deletes everything, including the history, injected latency and
+        faults."""
+        with self._condition:
+            self.index = 0
+            self.latency = 0
+            self._nodes = {}
+            self._dirs = {}
+            self._expiries = []
+            self._history = deque(maxlen=self.HISTORY_SIZE)
+            self._oldest_index = 1
+            self._faults = []
+            self.last_written_value = ""
+            self._condition.notify_all()
+
+    def add_fault(self, error, operation=None, key=None, count=None):
+        """Makes requests fail with error (an exception) instead of being
+        carried out. The fault can be limited to one operation ("read",
+        "write" or "delete"), to requests for key and the keys under it, and
+        to the next count matching requests."""
+        with self._condition:
+            self._faults.append({"error": error,
+                                 "operation": operation,
+                                 "key": _normalize(key) if key else None,
+                                 "count": count})
+
+    def request(self, operation, key):
+        """Called at the start of each request, to add any latency and fail it
+        if a fault has been injected."""
+        key = _normalize(key)
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            sleep(latency)
+
+        with self._condition:
+            for fault in self._faults:
+                if ((fault["operation"] in (None, operation)) and
+                    (fault["key"] is None or
+                     self._is_under(key, fault["key"]))):
+                    if fault["count"] is not None:
+                        fault["count"] -= 1
+                        if fault["count"] <= 0:
+                            self._faults.remove(fault)
+                    raise fault["error"]
+
+    @staticmethod
+    def _is_under(key, directory):
+        return (key == directory or
+                directory == "/" or
+                key.startswith(directory + "/"))
+
+    def _error(self, error_class, code, message, cause):
+        return error_class("{} : {}".format(message, cause),
+                           {"errorCode": code,
+                            "message": message,
+                            "cause": cause,
+                            "index": self.index})
+
+    def _node(self, key):
+        # The externally-visible form of the node for key.
+        node = dict(self._nodes[key])
+        expires_at = node.pop("expires_at")
+        if expires_at is not None:
+            node["ttl"] = int(math.ceil(max(expires_at - time(), 0)))
+            node["expiration"] = (
+                datetime.utcfromtimestamp(expires_at).isoformat() + "Z")
+        return node
+
+    def _dir_node(self, key, recursive):
+        prefix = key if key == "/" else key + "/"
+        leaves = []
+        subdirs = set()
+        for child in self._nodes:
+            if child.startswith(prefix):
+                rest = child[len(prefix):]
+                if "/" in rest:
+                    subdirs.add(prefix + rest.split("/", 1)[0])
+                else:
+                    leaves.append(child)
+
+        nodes = [self._node(child) for child in leaves]
+        for child in subdirs:
+            if recursive:
+                nodes.append(self._dir_node(child, True))
+            else:
+                nodes.append({"key": child, "dir": True})
+        nodes.sort(key=lambda node: node["key"])
+        return {"key": key, "dir": True, "nodes": nodes}
+
+    def _response(self, action, node, prev_node=None):
+        # The body of etcd's response, along with the index etcd would return
+        # in the X-Etcd-Index header.
+        response = {"action": action, "node": node, "etcd_index": self.index}
+        if prev_node is not None:
+            response["prevNode"] = prev_node
+        return response
+
+    def _record(self, action, node, prev_node):
+        # Store an event in the history and wake up any watches.
+        self._history.append({"action": action,
+                              "node": node,
+                              "prevNode": prev_node})
+        self._oldest_index = self.index - len(self._history) + 1
+        self._condition.notify_all()
+
+    def _add_leaf(self, key):
+        for directory in _ancestors(key):
+            self._dirs[directory] = self._dirs.get(directory, 0) + 1
+
+    def _remove_leaf(self, key):
+        del self._nodes[key]
+        for directory in _ancestors(key):
+            self._dirs[directory] -= 1
+            if self._dirs[directory] == 0:
+                del self._dirs[directory]
+
+    def _expire(self):
+        # Delete any keys whose TTLs have run out.
+        now = time()
+        while self._expiries and self._expiries[0][0] <= now:
+            expires_at, key, index = heapq.heappop(self._expiries)
+            node = self._nodes.get(key)
+            if node is not None and node["modifiedIndex"] == index:
+                prev_node = self._node(key)
+                self._remove_leaf(key)
+                self.index += 1
+                self._record("expire",
+                             {"key": key,
+                              "modifiedIndex": self.index,
+                              "createdIndex": prev_node["createdIndex"]},
+                             prev_node)
+
+    def get(self, key, recursive=False):
+        key = _normalize(key)
+        with self._condition:
+            self._expire()
+            if key in self._nodes:
+                return self._response("get", self._node(key))
+            if key == "/" or key in self._dirs:
+                return self._response("get", self._dir_node(key, recursive))
+            raise self._error(etcd.EtcdKeyNotFound, 100, "Key not found", key)
+
+    def set(self,
+            key,
+            value,
+            ttl=None,
+            prevValue=None,
+            prevIndex=None,
+            prevExist=None):
+        key = _normalize(key)
+        with self._condition:
+            self._expire()
+            if key == "/" or key in self._dirs:
+                raise self._error(etcd.EtcdNotFile, 102, "Not a file", key)
+            for directory in _ancestors(key):
+                if directory in self._nodes:
+                    raise self._error(etcd.EtcdNotDir,
+                                      104,
+                                      "Not a directory",
+                                      directory)
+
+            existing = self._nodes.get(key)
+            if existing is None:
+                if prevExist or prevIndex or prevValue is not None:
+                    raise self._error(etcd.EtcdKeyNotFound,
+                                      100,
+                                      "Key not found",
+                                      key)
+            else:
+                if prevExist is False:
+                    raise self._error(etcd.EtcdAlreadyExist,
+                                      105,
+                                      "Key already exists",
+                                      key)
+                if ((prevIndex and prevIndex != existing["modifiedIndex"]) or
+                    (prevValue is not None and prevValue != existing["value"])):
+                    raise self._error(etcd.EtcdCompareFailed,
+                                      101,
+                                      "Compare failed",
+                                      "[{} != {}] [{} != {}]".format(
+                                          prevValue,
+                                          existing["value"],
+                                          prevIndex,
+                                          existing["modifiedIndex"]))
+
+            if prevIndex or prevValue is not None:
+                action = "compareAndSwap"
+            elif prevExist is False:
+                action = "create"
+            elif prevExist:
+                action = "update"
+            else:
+                action = "set"
+
+            self.index += 1
+            prev_node = None
+            if existing is None:
+                created_index = self.index
+                self._add_leaf(key)
+            else:
+                created_index = existing["createdIndex"]
+                prev_node = self._node(key)
+
+            expires_at = None
+            if ttl:
+                expires_at = time() + ttl
+                heapq.heappush(self._expiries, (expires_at, key, self.index))
+
+            self._nodes[key] = {"key": key,
+                                "value": value,
+                                "modifiedIndex": self.index,
+                                "createdIndex": created_index,
+                                "expires_at": expires_at}
+            self.last_written_value = value
+            node = self._node(key)
+            self._record(action, node, prev_node)
+            return self._response(action, node, prev_node)
+
+    def delete(self, key, recursive=False, prevValue=None, prevIndex=None):
+        key = _normalize(key)
+        with self._condition:
+            self._expire()
+            if key in self._nodes:
+                existing = self._nodes[key]
+                if ((prevIndex and prevIndex != existing["modifiedIndex"]) or
+                    (prevValue is not None and prevValue != existing["value"])):
+                    raise self._error(etcd.EtcdCompareFailed,
+                                      101,
+                                      "Compare failed",
+                                      key)
+                action = ("compareAndDelete"
+                          if (prevIndex or prevValue is not None) else
+                          "delete")
+                prev_node = self._node(key)
+                self._remove_leaf(key)
+                self.index += 1
+                node = {"key": key,
+                        "modifiedIndex": self.index,
+                        "createdIndex": prev_node["createdIndex"]}
+            elif key in self._dirs:
+                if not recursive:
+                    raise self._error(etcd.EtcdNotFile, 102, "Not a file", key)
+                action = "delete"
+                prev_node = {"key": key, "dir": True}
+                for child in [k for k in self._nodes
+                              if self._is_under(k, key)]:
+                    self._remove_leaf(child)
+                self.index += 1
+                node = {"key": key, "dir": True, "modifiedIndex": self.index}
+            else:
+                raise self._error(etcd.EtcdKeyNotFound,
+                                  100,
+                                  "Key not found",
+                                  key)
+
+            self._record(action, node, prev_node)
+            return self._response(action, node, prev_node)
+
+    def _matches(self, event, key, recursive):
+        event_key = event["node"]["key"]
+        if event_key == key:
+            return True
+        if recursive and self._is_under(event_key, key):
+            return True
+        # Deleting a directory affects everything in it.
+        return (event["node"].get("dir", False) and
+                event["action"] in ("delete", "expire") and
+                self._is_under(key, event_key))
+
+    def _find_event(self, key, index, recursive):
+        # Returns the first event for key at or after index, if there's one in
+        # the history.
+        if index < self._oldest_index:
+            raise self._error(
+                etcd.EtcdEventIndexCleared,
+                401,
+                "The event in requested index is outdated and cleared",
+                "the requested history has been cleared [{}/{}]".format(
+                    self._oldest_index, index))
+
+        for position in xrange(index - self._oldest_index,
+                               len(self._history)):
+            event = self._history[position]
+            if self._matches(event, key, recursive):
+                return event
+        return None
+
+    def watch(self, key, index=None, recursive=False, timeout=None):
+        """Waits for key (or, if recursive, anything under it) to change at or
+        after index, and returns the change. With no index, waits for the
+        next change."""
+        key = _normalize(key)
+        if self.MAX_WATCH_TIME is not None:
+            timeout = min(timeout or self.MAX_WATCH_TIME, self.MAX_WATCH_TIME)
+        deadline = time() + timeout if timeout else None
+
+        with self._condition:
+            self._expire()
+            if not index:
+                index = self.index + 1
+
+            while True:
+                event = self._find_event(key, index, recursive)
+                if event is not None:
+                    return self._response(event["action"],
+                                        event["node"],
+                                        event["prevNode"])
+
+                wait = None
+                if deadline is not None:
+                    wait = deadline - time()
+                    if wait <= 0:
+                        raise etcd.EtcdWatchTimedOut(
+                            "Watch timed out: Read timed out")
+                if self._expiries:
+                    until_expiry = max(self._expiries[0][0] - time(), 0)
+                    wait = until_expiry if wait is None else min(wait,
+                                                                 until_expiry)
+                self._condition.wait(wait)
+                self._expire()
+
+
+def _result(response):
+    # Turns a response from the simulator into what python-etcd would return.
+    response = dict(response)
+    etcd_index = response.pop("etcd_index")
+    result = EtcdResult(**response)
+    result.etcd_index = etcd_index
+    return result
+
+
+# The key space used by clients that aren't given one of their own.
+default_simulator = EtcdSimulator()
+
+
 class MockEtcdClient(object):
-    def __init__(self, _host, _port):
-        pass
+    """Stands in for a python-etcd client, storing data in an EtcdSimulator
+    (by default, one shared by every client in the process)."""
+    def __init__(self, host=None, port=None, simulator=None):
+        self.host = host
+        self.port = port
+        self.simulator = simulator or default_simulator
 
     @classmethod
-    def clear(self):
-        global global_index
-        global global_data
-        global_condvar.acquire()
-        global_index = 0
-        global_data = ""
-        global_condvar.release()
+    def clear(cls):
+        default_simulator.clear()
 
     def return_global_data(self):
-        return global_data
+        """Returns the value most recently written to any key."""
+        return self.simulator.last_written_value
 
-    def fake_result(self):
-        r = EtcdResult(None, {})
-        r.value = global_data
-        r.createdIndex = 1
-        r.modifiedIndex = global_index
-        r.etcd_index = global_index
-        return r
+    def write(self,
+              key,
+              value,
+              ttl=None,
+              prevValue=None,
+              prevIndex=None,
+              prevExist=None,
+              **kwargs):
+        self.simulator.request("write", key)
+        return _result(self.simulator.set(key,
+                                  value,
+                                  ttl=ttl,
+                                  prevValue=prevValue,
+                                  prevIndex=prevIndex,
+                                  prevExist=prevExist))
 
-    def write(self, key, value, prevIndex=0, prevExist=None):
-        global global_index
-        global global_data
-        global_condvar.acquire()
-        if (((prevIndex != global_index) and (prevIndex != 0)) or
-                (prevExist and global_index != 0)):
-            global_condvar.release()
-            raise ValueError()
-        global_data = value
-        global_index += 1
-        r = self.fake_result()
-        global_condvar.notify_all()
-        global_condvar.release()
-        return r
-
-    def read(self, key, wait=False, waitIndex=None, timeout=None, recursive=None, **kwargs):
-        with global_condvar:
-            if wait:
-                if global_index == 0:
-                    raise etcd.EtcdKeyError()
-                if waitIndex > global_index:
-                    global_condvar.wait(0.1)
-                if waitIndex > global_index:
-                    raise EtcdException("Read timed out")
-            if global_data == "":
-                raise EtcdKeyError("")
-            ret = self.fake_result()
-        return ret
+    def read(self,
+             key,
+             wait=False,
+             waitIndex=None,
+             timeout=None,
+             recursive=None,
+             **kwargs):
+        self.simulator.request("read", key)
+        if wait:
+            return _result(self.simulator.watch(key,
+                                                index=waitIndex,
+                                                recursive=recursive,
+                                                timeout=timeout))
+        return _result(self.simulator.get(key, recursive=recursive))
+
+    def delete(self, key, recursive=None, prevValue=None, prevIndex=None,
+               **kwargs):
+        self.simulator.request("delete", key)
+        return _result(self.simulator.delete(key,
+                                             recursive=recursive,
+                                             prevValue=prevValue,
+                                             prevIndex=prevIndex))
+
+    def get(self, key):
+        return self.read(key)
+
+    def set(self, key, value, ttl=None):
+        return self.write(key, value, ttl=ttl)
+
+    def watch(self, key, index=None, timeout=None, recursive=None):
+        return self.read(key,
+                         wait=True,
+                         waitIndex=index,
+                         timeout=timeout,
+                         recursive=recursive)
 
     def read_noexcept(self, *args, **kwargs):
         return self.read(*args, **kwargs)
@@ -89,10 +490,10 @@ class SlowMockEtcdClient(MockEtcdClient):
     def write(self, key, value, prevIndex=0, prevExist=None):
         """Make writes take 0-200ms to discover race conditions"""
         sleep(random()/5.0)
-        super(SlowMockEtcdClient, self).write(key,
-                                              value,
-                                              prevIndex=prevIndex,
-                                              prevExist=prevExist)
+        return super(SlowMockEtcdClient, self).write(key,
+                                                     value,
+                                                     prevIndex=prevIndex,
+                                                     prevExist=prevExist)
 
 
 class ExceptionMockEtcdClient(MockEtcdClient):
@@ -0,0 +1,119 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import json
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+_log = logging.getLogger(__name__)
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError("{} is immutable - use thaw() to get a copy that can be "
+                    "changed".format(self.__class__.__name__))
+
+
+class FrozenDict(dict):
+    """A dict that can't be changed, so one parsed value can be shared by
+    every thread that reads it."""
+    __slots__ = ("_encoded",)
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+
+class FrozenList(list):
+    """A list that can't be changed. This is a list (rather than a tuple) so
+    that it compares equal to the list it was made from."""
+    __slots__ = ("_encoded",)
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _immutable
+    __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+
+
+def freeze(value):
+    """Returns an immutable copy of a parsed JSON value."""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.iteritems())
+    elif isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """Returns a mutable copy of a (possibly frozen) parsed JSON value."""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.iteritems()}
+    elif isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
+
+
+def encode(value):
+    """Serializes value as canonical JSON (with its keys sorted), so that equal
+    values always serialize the same way. The result is remembered for frozen
+    values, which can't change."""
+    if isinstance(value, (FrozenDict, FrozenList)):
+        try:
+            return value._encoded
+        except AttributeError:
+            value._encoded = json.dumps(value, sort_keys=True)
+            return value._encoded
+    return json.dumps(value, sort_keys=True)
+
+
+class ValueCache(object):
+    """Parses each revision of a JSON value in etcd once.
+
+    Parsed values are keyed by etcd key and modifiedIndex, which between them
+    identify the value uniquely, and handed out as frozen (immutable) objects
+    so they can be shared. Callers that want to change a value should thaw()
+    it first."""
+
+    # How many parsed values to keep.
+    MAX_ENTRIES = 64
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, key, index, value):
+        """Returns the parsed, frozen form of value, which is the value of key
+        at modifiedIndex index. Values without an index (e.g. defaults) are
+        parsed but not cached. Raises ValueError if value isn't valid JSON."""
+        if key is None or index is None:
+            return freeze(json.loads(value))
+
+        cache_key = (key, index)
+        with self._lock:
+            entry = self._entries.pop(cache_key, None)
+            if entry is not None and entry[0] == value:
+                self._entries[cache_key] = entry
+                self.hits += 1
+                return entry[1]
+
+        parsed = freeze(json.loads(value))
+
+        with self._lock:
+            self.misses += 1
+            self._entries[cache_key] = (value, parsed)
+            while len(self._entries) > self.MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+        return parsed
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+
+# The parsed values for this process.
+value_cache = ValueCache()
@@ -0,0 +1,61 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import base64
+import binascii
+import logging
+import zlib
+
+_log = logging.getLogger(__name__)
+
+# Compressed values are stored in etcd as this prefix followed by the base64
+# encoding of the zlib-compressed UTF-8 value. Anything without the prefix is
+# a plain value, so values written before compression was enabled (or by
+# nodes that don't compress) are still read correctly.
+MAGIC_PREFIX = "#clearwater-zlib-base64#"
+
+# Values shorter than this aren't worth compressing.
+COMPRESSION_THRESHOLD = 16384
+
+
+class ValueDecodeError(ValueError):
+    """Raised if a value has the compressed prefix but can't be
+    decompressed."""
+    pass
+
+
+def is_compressed(value):
+    return value is not None and value.startswith(MAGIC_PREFIX)
+
+
+def encode_value(value, compress=True):
+    """Returns the form of value to store in etcd. This is compressed if
+    compress is set and the value is large enough for that to be worthwhile,
+    and is otherwise just value."""
+    if not compress or value is None or len(value) < COMPRESSION_THRESHOLD:
+        return value
+
+    data = value.encode("utf-8") if isinstance(value, unicode) else value
+    encoded = MAGIC_PREFIX + base64.b64encode(zlib.compress(data))
+    if len(encoded) >= len(value):
+        return value
+
+    _log.debug("Compressed value from {} to {} bytes".format(len(value),
+                                                            len(encoded)))
+    return encoded
+
+
+def decode_value(value):
+    """Returns the original form of a value read from etcd."""
+    if not is_compressed(value):
+        return value
+
+    try:
+        data = base64.b64decode(value[len(MAGIC_PREFIX):].encode("ascii"))
+        return zlib.decompress(data).decode("utf-8")
+    except (binascii.Error, zlib.error, TypeError, UnicodeError) as e:
+        raise ValueDecodeError("Unable to decompress value: {!r}".format(e))
@@ -0,0 +1,70 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import logging
+import zlib
+from threading import Lock
+from time import time
+
+
+def _as_bytes(value):
+    return value.encode("utf-8") if isinstance(value, unicode) else value
+
+
+class ValueSummary(object):
+    """Describes a value in etcd by its key, index, size and a CRC32 digest,
+    for passing as a lazy % argument to a log call. Nothing is computed unless
+    the message is actually logged."""
+    __slots__ = ("key", "index", "value")
+
+    def __init__(self, key, index, value):
+        self.key = key
+        self.index = index
+        self.value = value
+
+    def __str__(self):
+        if self.value is None:
+            return "key={} index={} no value".format(self.key, self.index)
+        data = _as_bytes(self.value)
+        return "key={} index={} size={} crc32={:08x}".format(
+            self.key, self.index, len(data), zlib.crc32(data) & 0xffffffff)
+
+
+class FullValueLog(object):
+    """Logs the full text of values at DEBUG, but no more than once every
+    FULL_VALUE_INTERVAL seconds for each key - values can be up to a megabyte,
+    and the synchronizers see them on every wake-up. Values that aren't
+    logged are counted in the given counter."""
+
+    FULL_VALUE_INTERVAL = 30
+
+    def __init__(self, logger, suppressed_counter):
+        self._logger = logger
+        self._suppressed_counter = suppressed_counter
+        self._lock = Lock()
+        self._last_logged = {}
+        self._suppressed = {}
+
+    def log(self, key, index, value):
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+
+        now = time()
+        with self._lock:
+            last_logged = self._last_logged.get(key)
+            if (last_logged is not None and
+                now - last_logged < self.FULL_VALUE_INTERVAL):
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                self._suppressed_counter.inc()
+                return
+            self._last_logged[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+
+        self._logger.debug("Full value (%s, %d not logged since the last):\n%s",
+                           ValueSummary(key, index, value),
+                           suppressed,
+                           _as_bytes(value))
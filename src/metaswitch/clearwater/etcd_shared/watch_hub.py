@@ -0,0 +1,330 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import etcd
+import logging
+from threading import Thread, Condition, Event, Lock, current_thread
+from time import time
+from .watch_transport import transport_for_client
+from .retry_policy import RetryPolicy
+from .metrics import metrics
+
+_log = logging.getLogger(__name__)
+
+
+class WatchHub(object):
+    """Shares a single recursive etcd watch on a key prefix between all the
+    synchronizers in this process that watch keys under that prefix.
+
+    The hub's thread keeps a watch armed on the prefix and remembers the most
+    recent event seen for each key. Synchronizers call wait_for_change()
+    rather than issuing their own long-poll against etcd.
+
+    The hub has seen every event in the range [start index, next index), so it
+    can only answer waiters whose wait index lies at or after the start index.
+    For anything older, wait_for_change() returns None and the caller should
+    fall back to watching the key directly. It does the same while the hub's
+    watch is failing, so that callers see the error for themselves rather
+    than waiting out the hub's back-off."""
+
+    # How often the hub's thread stops waiting on its watch to check whether
+    # it should exit. When the keep-alive transport is in use, the watch itself
+    # stays armed on the server across these timeouts.
+    WATCH_TIMEOUT = 5
+
+    INITIAL_PAUSE_BEFORE_RETRY = 0.05
+    PAUSE_BEFORE_RETRY_ON_EXCEPTION = 30
+
+    # A zero timeout (as used in UT) would otherwise make waiters spin.
+    MINIMUM_WAIT = 0.1
+
+    # How long to wait for the hub's thread to finish once it's been told to
+    # stop. It may be part way through a watch, so won't always make it.
+    STOP_TIMEOUT = 1
+
+    def __init__(self, client, prefix):
+        self._client = client
+        self._transport = transport_for_client(client)
+        self._retry_policy = RetryPolicy(getattr(client, "base_uri", None),
+                                         self.INITIAL_PAUSE_BEFORE_RETRY,
+                                         self.PAUSE_BEFORE_RETRY_ON_EXCEPTION)
+        self._prefix = prefix
+        self._condition = Condition()
+        self._latest = {}
+        self._start_index = None
+        self._next_index = None
+        self._users = 0
+        self._running = False
+        self._healthy = False
+        self._failing = False
+        self._thread = None
+
+        # Set when the hub is stopped, to cut short any back-off.
+        self._stopped = Event()
+
+        self._metrics = metrics.labelled(watch_prefix=prefix)
+
+    def prefix(self):
+        return self._prefix
+
+    def connections_established(self):
+        """Returns the number of connections the hub has opened to etcd for
+        its watch, or None if it isn't using a keep-alive transport."""
+        if self._transport is None:
+            return None
+        return self._transport.connections_established
+
+    def acquire(self):
+        with self._condition:
+            self._users += 1
+
+    def release(self):
+        """Drops a reference to the hub. Returns True if this was the last
+        user, in which case the watch thread is told to stop - call stop() to
+        wait for it."""
+        with self._condition:
+            self._users -= 1
+            if self._users > 0:
+                return False
+
+            self._running = False
+            self._stopped.set()
+            self._condition.notify_all()
+            return True
+
+    def stop(self):
+        """Stops the watch thread, waiting up to STOP_TIMEOUT seconds for it
+        to finish."""
+        with self._condition:
+            self._running = False
+            self._stopped.set()
+            self._condition.notify_all()
+            thread = self._thread
+
+        if thread is not None and thread is not current_thread():
+            thread.join(self.STOP_TIMEOUT)
+
+    def wait_for_change(self, key, wait_index, timeout, cancelled=None):
+        """Waits for a change to key at or after wait_index.
+
+        Returns the etcd result for the change, or None if the hub can't
+        answer for this index or its watch is failing (in which case the
+        caller should watch the key itself). Raises EtcdWatchTimedOut if
+        nothing changed within timeout seconds, or if cancelled (a function)
+        returns True when the hub is woken."""
+        deadline = time() + max(timeout, self.MINIMUM_WAIT)
+
+        with self._condition:
+            if self._start_index is None:
+                # This is the first waiter - start watching from its index.
+                self._start_index = wait_index
+                self._next_index = wait_index
+                self._start_thread()
+            elif wait_index < self._start_index:
+                return None
+
+            while True:
+                # The hub may have had to skip ahead since we started waiting.
+                if wait_index < self._start_index:
+                    return None
+
+                result = self._latest.get(key)
+                if result is not None and result.modifiedIndex >= wait_index:
+                    return result
+
+                # If the hub's watch is failing, it can't tell whether anything
+                # else has changed.
+                if self._failing:
+                    return None
+
+                remaining = deadline - time()
+                if (remaining <= 0 or
+                    not self._running or
+                    (cancelled is not None and cancelled())):
+                    raise etcd.EtcdWatchTimedOut("Read timed out")
+
+                self._condition.wait(remaining)
+
+    def wake(self):
+        """Wakes everyone waiting for a change, so that they can check whether
+        they've been cancelled."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def is_current(self, key, index, as_of):
+        """Returns True if the hub's watch shows that key hasn't changed since
+        it was seen at modification index, given that it was known to be
+        current as of etcd index as_of.
+
+        This only holds if the watch has been running without errors and has
+        seen every event since as_of. It can't rule out a change that etcd
+        hasn't reported to the watch yet, so anything relying on it should
+        still use a compare-and-swap."""
+        with self._condition:
+            if (not self._running or
+                not self._healthy or
+                self._start_index is None or
+                self._start_index > as_of + 1):
+                return False
+
+            result = self._latest.get(key)
+            return result is None or result.modifiedIndex <= index
+
+    def _start_thread(self):
+        # Must be called with the condition held.
+        self._running = True
+        self._thread = Thread(target=self._watch_loop,
+                              name="WatchHub " + self._prefix)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _watch_loop(self):
+        _log.info("Started shared watch on {}".format(self._prefix))
+
+        while self._running:
+            try:
+                self._retry_policy.check()
+                if self._transport is not None:
+                    result = self._transport.watch(self._prefix,
+                                                   self._next_index,
+                                                   recursive=True,
+                                                   timeout=self.WATCH_TIMEOUT)
+                else:
+                    result = self._client.read(self._prefix,
+                                               wait=True,
+                                               waitIndex=self._next_index,
+                                               recursive=True,
+                                               timeout=self.WATCH_TIMEOUT)
+            except etcd.EtcdWatchTimedOut:
+                self._set_healthy(True)
+                continue
+            except etcd.EtcdEventIndexCleared as e:
+                self._skip_ahead(e)
+                continue
+            except Exception as e:
+                if (isinstance(e, etcd.EtcdException) and
+                    "Read timed out" in str(e)):
+                    # Timeouts are expected - just re-arm the watch.
+                    self._set_healthy(True)
+                    continue
+
+                self._set_healthy(False)
+
+                self._metrics.counter("etcd_watch_errors").inc()
+                _log.error("Shared watch on {} caught {!r} with index {}"
+                           " - pause before retry".
+                           format(self._prefix, e, self._next_index))
+                self._retry_policy.failed(e)
+                self._stopped.wait(self._retry_policy.next_delay())
+                continue
+
+            self._retry_policy.succeeded()
+            self._set_healthy(True)
+            self._deliver(result)
+
+        if self._transport is not None:
+            self._transport.close()
+            _log.info("Shared watch on {} used {} connection(s) to etcd".format(
+                self._prefix, self._transport.connections_established))
+
+        _log.info("Stopped shared watch on {}".format(self._prefix))
+
+    def _set_healthy(self, healthy):
+        with self._condition:
+            self._healthy = healthy
+            if self._failing == healthy:
+                # Tell anyone waiting that the watch has started (or stopped)
+                # failing.
+                self._failing = not healthy
+                self._condition.notify_all()
+
+    def _skip_ahead(self, error):
+        # etcd no longer has the events the hub was about to watch for, so it
+        # can't tell what's changed. Start watching again from etcd's current
+        # index - anyone waiting for something older is told to watch for
+        # themselves, and will then discover the events are gone too.
+        payload = error.payload or {}
+        if "index" in payload:
+            index = int(payload["index"])
+        else:
+            try:
+                index = self._client.read(self._prefix).etcd_index
+            except Exception as e:
+                _log.error("Shared watch on {} caught {!r} reading current "
+                           "index - pause before retry".format(self._prefix, e))
+                self._set_healthy(False)
+                self._retry_policy.failed(e)
+                self._stopped.wait(self._retry_policy.next_delay())
+                return
+
+        index_cleared = self._metrics.counter("etcd_index_cleared")
+        index_cleared.inc()
+        _log.warning("Shared watch on {} fell behind etcd's event history at "
+                     "index {} - resuming from {} (happened {} times)".format(
+                         self._prefix, self._next_index, index + 1,
+                         index_cleared.value))
+
+        with self._condition:
+            self._start_index = index + 1
+            self._next_index = index + 1
+            self._latest = {}
+            self._condition.notify_all()
+
+    def _deliver(self, result):
+        self._metrics.counter("etcd_watch_events").inc()
+        _log.debug("Shared watch on {} saw {} on {} at index {}".format(
+            self._prefix, result.action, result.key, result.modifiedIndex))
+
+        with self._condition:
+            self._latest[result.key] = result
+            self._next_index = max(self._next_index, result.modifiedIndex + 1)
+            self._condition.notify_all()
+
+
+# All the hubs in this process, keyed on the etcd server they talk to and the
+# prefix they watch.
+_hubs = {}
+_hubs_lock = Lock()
+
+
+def acquire_watch_hub(client, prefix):
+    """Returns the shared hub watching prefix on the etcd server that client
+    talks to, creating it if necessary. The hub uses the client of whoever
+    first acquired it. Every call must be balanced by release_watch_hub()."""
+    hub_key = (getattr(client, "base_uri", None), prefix)
+
+    with _hubs_lock:
+        hub = _hubs.get(hub_key)
+        if hub is None:
+            hub = WatchHub(client, prefix)
+            _hubs[hub_key] = hub
+        hub.acquire()
+        return hub
+
+
+def release_watch_hub(hub):
+    with _hubs_lock:
+        if not hub.release():
+            return
+        for hub_key, value in _hubs.items():
+            if value is hub:
+                del _hubs[hub_key]
+
+    # That was the last user, so wait for the hub's thread to finish (outside
+    # the lock, so as not to hold up anyone acquiring another hub).
+    hub.stop()
+
+
+def stop_watch_hubs():
+    """Stops every hub in this process, whether or not it's still in use (e.g.
+    at the end of a test)."""
+    with _hubs_lock:
+        hubs = _hubs.values()
+        _hubs.clear()
+
+    for hub in hubs:
+        hub.stop()
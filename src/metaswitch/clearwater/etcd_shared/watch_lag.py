@@ -0,0 +1,145 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import logging
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+from .event_loop import get_event_loop
+
+_log = logging.getLogger(__name__)
+
+
+class LatestIndex(object):
+    """The highest etcd index that any synchronizer in this process has seen
+    in a response - as near as we can tell, where the cluster has got to."""
+    def __init__(self):
+        self._lock = Lock()
+        self.value = None
+
+    def update(self, index):
+        with self._lock:
+            if (isinstance(index, (int, long)) and
+                    (self.value is None or index > self.value)):
+                self.value = index
+
+
+# The latest index for this process.
+latest_index = LatestIndex()
+
+
+class WatchLagMonitor(object):
+    """Tracks how far behind etcd a synchronizer has fallen.
+
+    While a synchronizer is watching its key, it's up to date - any change
+    will wake it. Otherwise (while it's handling a value, or backing off
+    after an error) it may be missing changes. This measures how long it's
+    been since it was last watching, and how far the cluster's index has
+    moved on from the index it had caught up to.
+
+    These are checked every CHECK_INTERVAL seconds on the shared event loop,
+    and published as the watch_staleness_seconds and watch_lag_indexes
+    gauges. If either passes its threshold, the synchronizer is logged as
+    lagging, counted in watch_lag_events, and watch_lagging is set to 1 until
+    it catches up."""
+
+    CHECK_INTERVAL = 10
+
+    # How long a synchronizer can go without watching its key before it's
+    # lagging.
+    STALENESS_THRESHOLD = 120
+
+    # How many indexes the cluster can move on from where a synchronizer got
+    # to before it's lagging.
+    INDEX_THRESHOLD = 1000
+
+    def __init__(self, name, metrics, latest=latest_index):
+        self._name = name
+        self._latest = latest
+        self._lock = Lock()
+        self._watching = False
+        self._last_watched = time()
+        self._caught_up_to = None
+        self._lagging = False
+        self._timer = None
+        self._running = False
+
+        self._staleness_gauge = metrics.gauge("watch_staleness_seconds")
+        self._index_lag_gauge = metrics.gauge("watch_lag_indexes")
+        self._lagging_gauge = metrics.gauge("watch_lagging")
+        self._lag_events = metrics.counter("watch_lag_events")
+
+    def start(self):
+        with self._lock:
+            self._running = True
+            self._schedule()
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def saw_index(self, etcd_index):
+        self._latest.update(etcd_index)
+
+    @contextmanager
+    def watching(self, wait_index):
+        """Marks the synchronizer as watching for changes from wait_index (so
+        it has caught up to the index before)."""
+        with self._lock:
+            self._watching = True
+            self._caught_up_to = wait_index - 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._watching = False
+                self._last_watched = time()
+
+    def lag(self, now=None):
+        """Returns how long it's been since the synchronizer was last
+        watching, and how many indexes behind it is."""
+        now = now or time()
+        latest = self._latest.value
+        with self._lock:
+            if self._watching:
+                return 0, 0
+            staleness = max(0, now - self._last_watched)
+            if latest is None or self._caught_up_to is None:
+                return staleness, 0
+            return staleness, max(0, latest - self._caught_up_to)
+
+    def check(self, now=None):
+        staleness, index_lag = self.lag(now)
+        self._staleness_gauge.set(staleness)
+        self._index_lag_gauge.set(index_lag)
+
+        lagging = (staleness > self.STALENESS_THRESHOLD or
+                   index_lag > self.INDEX_THRESHOLD)
+        if lagging and not self._lagging:
+            self._lag_events.inc()
+            _log.warning("{} has fallen behind etcd - it last watched for "
+                         "changes {:.0f}s ago, and is {} indexes "
+                         "behind".format(self._name, staleness, index_lag))
+        elif self._lagging and not lagging:
+            _log.info("{} has caught up with etcd".format(self._name))
+        self._lagging = lagging
+        self._lagging_gauge.set(1 if lagging else 0)
+        return lagging
+
+    def _schedule(self):
+        # Must be called with the lock held.
+        self._timer = get_event_loop().call_later(self.CHECK_INTERVAL,
+                                                  self._periodic_check)
+
+    def _periodic_check(self):
+        self.check()
+        with self._lock:
+            if self._running:
+                self._schedule()
@@ -0,0 +1,182 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import etcd
+import httplib
+import logging
+import select
+import socket
+import urllib
+from .etcd_v2_client import EtcdV2Client, result_from_response
+from .etcd_v3_client import EtcdV3Client
+
+_log = logging.getLogger(__name__)
+
+
+class KeepAliveWatchTransport(object):
+    """Issues etcd v2 watches over a single persistent HTTP connection.
+
+    python-etcd gives up on a watch when its read times out, which means
+    closing the socket (as the request is still outstanding on it) and
+    reconnecting for the next watch. Instead, this transport leaves the watch
+    request outstanding when the caller's timeout passes, and carries on
+    waiting for the response to that same request on the next call. The
+    connection is only re-established if it actually fails, so an idle watcher
+    holds one connection open rather than churning through a new one every
+    few seconds."""
+
+    # How long to allow for reading the headers or the body of a response once
+    # etcd has started sending it.
+    READ_TIMEOUT = 10
+
+    def __init__(self, host, port):
+        self._host = host
+        self._port = port
+        self._connection = None
+        self._pending = None
+
+        # The response to the pending watch, once its headers have arrived.
+        self._response = None
+
+        # The number of TCP connections this transport has opened.
+        self.connections_established = 0
+
+    def watch(self, key, wait_index, recursive=False, timeout=None):
+        """Waits for a change to key at or after wait_index, returning a
+        V2Result. Raises EtcdWatchTimedOut if nothing has changed after
+        timeout seconds - the watch stays armed on the server, and is picked
+        up again by the next call with the same arguments."""
+        request = (key, wait_index, recursive)
+
+        if self._pending != request:
+            if self._pending is not None:
+                # The caller has moved on from the outstanding watch. There's
+                # no way to cancel it, so drop the connection it's on.
+                self.close()
+            self._send(key, wait_index, recursive)
+            self._pending = request
+
+        # etcd sends a watch's headers straight away, and its body when
+        # something changes - unless the change has already happened, or the
+        # watch fails, in which case it all comes at once. Either way, wait
+        # for the headers first, and then for the body.
+        if self._response is None:
+            self._wait_for_data(key, timeout)
+            self._response = self._read_headers(key)
+
+        if self._response.chunked:
+            self._wait_for_data(key, timeout)
+
+        response, self._response = self._response, None
+        self._pending = None
+
+        try:
+            data = response.read()
+        except httplib.IncompleteRead as e:
+            self.close()
+            if not e.partial:
+                # etcd has closed the connection before anything changed.
+                # That's not an error - re-arm the watch next time round.
+                raise etcd.EtcdWatchTimedOut("Read timed out")
+            raise etcd.EtcdConnectionFailed(
+                "Watch on {} failed: {!r}".format(key, e), cause=e)
+        except (httplib.HTTPException, socket.error) as e:
+            self.close()
+            raise etcd.EtcdConnectionFailed(
+                "Watch on {} failed: {!r}".format(key, e), cause=e)
+
+        if response.will_close:
+            self.close()
+
+        return result_from_response(response, data)
+
+    def _wait_for_data(self, key, timeout):
+        # Waits for something to read on the connection, raising
+        # EtcdWatchTimedOut if nothing arrives within timeout seconds.
+        try:
+            readable, _, _ = select.select([self._connection.sock], [], [],
+                                           timeout)
+        except (select.error, socket.error) as e:
+            self.close()
+            raise etcd.EtcdConnectionFailed(
+                "Watch on {} failed: {!r}".format(key, e), cause=e)
+
+        if not readable:
+            raise etcd.EtcdWatchTimedOut("Read timed out")
+
+    def _read_headers(self, key):
+        # Reads the status line and headers of the watch's response. These
+        # are read without buffering, so that anything of the body that's
+        # already arrived stays on the socket for select() to see.
+        try:
+            return self._connection.getresponse(buffering=False)
+        except httplib.BadStatusLine:
+            # etcd has closed the connection while it was idle. That's not an
+            # error - re-arm the watch on a new connection next time round.
+            _log.debug("etcd closed idle watch connection to {}:{}".format(
+                self._host, self._port))
+            self.close()
+            raise etcd.EtcdWatchTimedOut("Read timed out")
+        except (httplib.HTTPException, socket.error) as e:
+            self.close()
+            raise etcd.EtcdConnectionFailed(
+                "Watch on {} failed: {!r}".format(key, e), cause=e)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self._pending = None
+        self._response = None
+
+    def _send(self, key, wait_index, recursive):
+        params = {"wait": "true", "waitIndex": wait_index}
+        if recursive:
+            params["recursive"] = "true"
+        path = "/v2/keys{}?{}".format(urllib.quote(key),
+                                      urllib.urlencode(params))
+
+        for attempt in range(2):
+            if self._connection is None:
+                self._connect()
+
+            try:
+                self._connection.request("GET", path)
+                return
+            except (httplib.HTTPException, socket.error) as e:
+                # If this was an existing connection, etcd may have closed it
+                # - try again on a fresh one.
+                self.close()
+                if attempt > 0:
+                    raise etcd.EtcdConnectionFailed(
+                        "Watch on {} failed: {!r}".format(key, e), cause=e)
+
+    def _connect(self):
+        _log.debug("Opening watch connection to {}:{}".format(self._host,
+                                                              self._port))
+        self._connection = httplib.HTTPConnection(self._host,
+                                                  self._port,
+                                                  timeout=self.READ_TIMEOUT)
+        try:
+            self._connection.connect()
+        except socket.error as e:
+            self._connection = None
+            raise etcd.EtcdConnectionFailed(
+                "Unable to connect to etcd at {}:{}: {!r}".format(
+                    self._host, self._port, e), cause=e)
+
+        self.connections_established += 1
+
+
+def transport_for_client(client):
+    """Returns a long-lived watch transport talking to the same etcd server as
+    client, or None if client doesn't support one (e.g. in UT)."""
+    if isinstance(client, (EtcdV2Client, etcd.client.Client)):
+        return KeepAliveWatchTransport(client.host, client.port)
+    elif isinstance(client, EtcdV3Client):
+        return client.watch_transport()
+    return None
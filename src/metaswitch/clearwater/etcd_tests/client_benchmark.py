@@ -0,0 +1,88 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+"""Compares the CPU time that python-etcd's Client and EtcdV2Client spend on
+each request, against a stand-in etcd server running in a child process (so
+that only the client's CPU time is counted).
+
+Usage: python -m metaswitch.clearwater.etcd_tests.client_benchmark [requests]
+"""
+
+import etcd
+import os
+import sys
+from multiprocessing import Event, Process
+from time import sleep
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
+from .etcdstandin import EtcdStandInServer
+
+SERVER_IP = "127.0.0.250"
+
+# A value the size of a typical cluster view.
+VALUE = "{" + ", ".join('"10.0.{}.{}": "normal"'.format(i / 256, i % 256)
+                        for i in range(50)) + "}"
+
+
+def _serve(ready, stop):
+    server = EtcdStandInServer(SERVER_IP)
+    ready.set()
+    stop.wait()
+    server.exit()
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _run(client, requests):
+    # Returns the CPU time per read and per CAS write, in microseconds.
+    index = client.write("/benchmark", VALUE).modifiedIndex
+
+    start = _cpu_time()
+    for _ in range(requests):
+        client.read("/benchmark", quorum=True)
+    read_time = _cpu_time() - start
+
+    start = _cpu_time()
+    for _ in range(requests):
+        index = client.write("/benchmark",
+                             VALUE,
+                             prevIndex=index).modifiedIndex
+    write_time = _cpu_time() - start
+
+    return (read_time * 1e6 / requests, write_time * 1e6 / requests)
+
+
+def main(requests):
+    ready = Event()
+    stop = Event()
+    server = Process(target=_serve, args=(ready, stop))
+    server.daemon = True
+    server.start()
+    ready.wait()
+
+    # Give the server a moment to start listening.
+    sleep(0.1)
+
+    try:
+        results = [("python-etcd", _run(etcd.Client(SERVER_IP, 4000),
+                                        requests)),
+                   ("EtcdV2Client", _run(EtcdV2Client(SERVER_IP, 4000),
+                                         requests))]
+    finally:
+        stop.set()
+        server.join()
+
+    print "CPU time per request over {} requests (us):".format(requests)
+    print "{:<15}{:>10}{:>10}".format("", "read", "CAS write")
+    for name, (read_time, write_time) in results:
+        print "{:<15}{:>10.0f}{:>10.0f}".format(name, read_time, write_time)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,118 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+"""Compares the time taken to work out the cluster state after a node
+changes state, by recalculating it from the whole view (as ClusterInfo does)
+and by keeping count of the nodes in each state and applying each change to
+the counts.
+
+Usage: python -m metaswitch.clearwater.etcd_tests.cluster_state_benchmark
+           [changes]
+"""
+
+import sys
+from collections import defaultdict
+from timeit import default_timer
+from metaswitch.clearwater.cluster_manager import constants
+from metaswitch.clearwater.cluster_manager.cluster_state import \
+    ClusterInfo, _STATE_BITS, _OTHER_BIT, _lookup_cluster_state
+
+CLUSTER_SIZES = [10, 100, 1000]
+
+# The states each node goes through as it joins the cluster.
+JOINING_STATES = [constants.JOINING,
+                  constants.JOINING_ACKNOWLEDGED_CHANGE,
+                  constants.JOINING_CONFIG_CHANGED,
+                  constants.NORMAL]
+
+
+class IncrementalClusterState(object):
+    """Counts how many nodes are in each state, so that a node changing state
+    is O(1), and the cluster state can then be looked up rather than
+    recalculated from every node."""
+
+    def __init__(self, view):
+        self._view = dict(view)
+        self._counts = defaultdict(int)
+        for state in self._view.itervalues():
+            self._counts[state] += 1
+
+    def set_node_state(self, ip, state):
+        old_state = self._view.get(ip)
+        if old_state is not None:
+            self._counts[old_state] -= 1
+            if self._counts[old_state] == 0:
+                del self._counts[old_state]
+        self._counts[state] += 1
+        self._view[ip] = state
+
+    @property
+    def cluster_state(self):
+        # There are only ever a handful of distinct states, however many
+        # nodes there are.
+        present = 0
+        for state in self._counts:
+            if state != constants.ERROR:
+                present |= _STATE_BITS.get(state, _OTHER_BIT)
+        return _lookup_cluster_state(present, constants.ERROR in self._counts)
+
+
+def _initial_view(nodes):
+    return {"10.0.{}.{}".format(i / 256, i % 256): constants.NORMAL
+            for i in range(nodes)}
+
+
+def _changes(nodes, changes):
+    # A stream of (ip, new state) changes, as each node in turn joins.
+    ips = ["10.0.{}.{}".format(i / 256, i % 256) for i in range(nodes)]
+    for i in range(changes):
+        yield (ips[(i / len(JOINING_STATES)) % nodes],
+               JOINING_STATES[i % len(JOINING_STATES)])
+
+
+def _recalculate(nodes, changes):
+    info = ClusterInfo("{}")
+    view = _initial_view(nodes)
+    stream = list(_changes(nodes, changes))
+
+    start = default_timer()
+    for ip, state in stream:
+        view[ip] = state
+        cluster_state = info.calculate_cluster_state(view)
+    return default_timer() - start, cluster_state
+
+
+def _incremental(nodes, changes):
+    info = IncrementalClusterState(_initial_view(nodes))
+    stream = list(_changes(nodes, changes))
+
+    start = default_timer()
+    for ip, state in stream:
+        info.set_node_state(ip, state)
+        cluster_state = info.cluster_state
+    return default_timer() - start, cluster_state
+
+
+def main(changes):
+    print "Time per node state change over {} changes (us):".format(changes)
+    print "{:<8}{:>14}{:>14}{:>10}".format("nodes",
+                                           "recalculate",
+                                           "incremental",
+                                           "speed-up")
+    for nodes in CLUSTER_SIZES:
+        recalculate, expected = _recalculate(nodes, changes)
+        incremental, cluster_state = _incremental(nodes, changes)
+        assert cluster_state == expected, (cluster_state, expected)
+
+        recalculate *= 1e6 / changes
+        incremental *= 1e6 / changes
+        print "{:<8}{:>14.1f}{:>14.1f}{:>9.0f}x".format(
+            nodes, recalculate, incremental, recalculate / incremental)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
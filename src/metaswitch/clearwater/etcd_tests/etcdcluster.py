@@ -5,14 +5,24 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
+import os
 from shutil import rmtree
 from .etcdserver import EtcdServer
+from .etcdstandin import EtcdStandInServer
 from metaswitch.common.logging_config import configure_test_logging
 configure_test_logging()
 
 
 class EtcdCluster(object):
-    def __init__(self, n=1):
+    def __init__(self, n=1, server_class=None):
+        # Run pure-Python stand-ins for etcd (rather than the etcd binary) if
+        # ETCD_STAND_IN is set.
+        if server_class is None:
+            if os.environ.get('ETCD_STAND_IN'):
+                server_class = EtcdStandInServer
+            else:
+                server_class = EtcdServer
+        self.server_class = server_class
         self.datadir = "./etcd_test_data"
         self.servers = {}
         self.pool = ["127.0.0.{}".format(last_byte) for last_byte in range(100, 150)]
@@ -29,7 +39,10 @@ class EtcdCluster(object):
         live_server = self.get_live_server()
         if live_server is not None:
             existing_ip = live_server._ip
-        server = EtcdServer(ip, datadir=self.datadir, existing=existing_ip, **kwargs)
+        server = self.server_class(ip,
+                                   datadir=self.datadir,
+                                   existing=existing_ip,
+                                   **kwargs)
         self.servers[ip] = server
         return server
 
@@ -11,9 +11,9 @@ import json
 from time import sleep
 from signal import SIGTERM, SIGABRT
 import shlex
-import etcd
 from shutil import rmtree
 import uuid
+from metaswitch.clearwater.etcd_shared.etcd_v2_client import EtcdV2Client
 
 base_cmd =              """clearwater-etcd/usr/share/clearwater/clearwater-etcd/3.1.7/etcd --debug --listen-client-urls http://{0}:4000 --advertise-client-urls http://{0}:4000 --listen-peer-urls http://{0}:2380 --initial-advertise-peer-urls http://{0}:2380 --data-dir {2} --name {1}"""
 
@@ -158,7 +158,7 @@ class EtcdServer(object):
         cxn.getresponse().read()
 
     def client(self):
-        return etcd.Client(self._ip, port=4000)
+        return EtcdV2Client(self._ip, port=4000)
 
     def __repr__(self):
         return ("Name/IP - {}/{}\n"
@@ -0,0 +1,388 @@
+# Copyright (C) Metaswitch Networks 2017
+# If license terms are provided to you in a COPYING file in the root directory
+# of the source code repository by which you are accessing this code, then
+# the license outlined in that COPYING file applies to your use.
+# Otherwise no rights are granted except for those provided to you by
+# Metaswitch Networks in a separate written agreement.
+
+import BaseHTTPServer
+import SocketServer
+import json
+import logging
+import random
+import select
+import socket
+import urllib
+import urlparse
+from collections import OrderedDict
+from threading import Lock, Thread
+from time import time
+import etcd
+from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import \
+    EtcdSimulator
+from .etcdserver import EtcdServer
+
+_log = logging.getLogger(__name__)
+
+# The HTTP status etcd returns with each error code.
+ERROR_STATUSES = {100: 404,
+                  101: 412,
+                  102: 403,
+                  104: 403,
+                  105: 412,
+                  401: 400}
+
+
+def _as_bool(value):
+    return value is not None and value.lower() == "true"
+
+
+def _as_int(value):
+    return int(value) if value else None
+
+
+class StandInCluster(object):
+    """The state shared by the members of a stand-in etcd cluster - the key
+    space and the member list."""
+    def __init__(self):
+        self.simulator = EtcdSimulator()
+        self.id = "{:016x}".format(random.getrandbits(64))
+        self.start_time = time()
+        self._members = OrderedDict()
+        self._lock = Lock()
+
+    def add_member(self, name, peer_urls, client_urls):
+        member = {"id": "{:016x}".format(random.getrandbits(64)),
+                  "name": name,
+                  "peerURLs": peer_urls,
+                  "clientURLs": client_urls}
+        with self._lock:
+            self._members[member["id"]] = member
+        return member
+
+    def remove_member(self, member_id):
+        with self._lock:
+            return self._members.pop(member_id, None) is not None
+
+    def members(self):
+        with self._lock:
+            return self._members.values()
+
+    def leader(self):
+        # The longest-standing member is the leader.
+        members = self.members()
+        return members[0] if members else None
+
+
+class StandInHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A threaded HTTP server that answers the subset of etcd's v2 API that
+    clearwater-etcd uses (/v2/keys, /v2/members, /v2/machines and
+    /v2/stats/self), from a StandInCluster."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # There may be thousands of clients connecting at once.
+    request_queue_size = 1024
+
+    def __init__(self, address, cluster, name):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandInRequestHandler)
+        self.cluster = cluster
+        self.running = True
+        self.member = cluster.add_member(
+            name,
+            ["http://{}:2380".format(address[0])],
+            ["http://{}:{}".format(address[0], self.server_address[1])])
+
+    def handle_error(self, request, client_address):
+        # Clients close connections whenever their watches time out, so
+        # don't report that.
+        _log.debug("Error handling request from {}".format(client_address),
+                   exc_info=True)
+
+    def stop(self):
+        self.running = False
+        self.shutdown()
+        self.server_close()
+
+
+class StandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Responses are written a header at a time, so without this each one
+    # waits for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    # How often a watch checks whether its client has gone away, or the
+    # server is stopping.
+    WATCH_POLL_INTERVAL = 1
+
+    # How long a watch looks for a change that's already happened before it
+    # starts streaming its response.
+    IMMEDIATE_WATCH_TIME = 0.001
+
+    def log_message(self, format, *args):
+        _log.debug("%s - %s", self.client_address[0], format % args)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        url = urlparse.urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in
+                      urlparse.parse_qs(url.query).iteritems())
+        body = self._read_body()
+        path = urllib.unquote(url.path)
+
+        if path.startswith("/v2/keys"):
+            if isinstance(body, dict):
+                params.update(body)
+            self._keys(method, path[len("/v2/keys"):] or "/", params)
+        elif path == "/v2/members" and method == "GET":
+            self._send(200, {"members": self.server.cluster.members()})
+        elif path == "/v2/members" and method == "POST":
+            member = self.server.cluster.add_member("",
+                                                    body.get("peerURLs", []),
+                                                    [])
+            self._send(201, member)
+        elif path.startswith("/v2/members/") and method == "DELETE":
+            if self.server.cluster.remove_member(path[len("/v2/members/"):]):
+                self._send(204, None)
+            else:
+                self._send(404, {"message": "Member not found"})
+        elif path == "/v2/machines" and method == "GET":
+            urls = [client_url for member in self.server.cluster.members()
+                    for client_url in member["clientURLs"]]
+            self._send(200, ", ".join(urls), content_type="text/plain")
+        elif path == "/v2/stats/self" and method == "GET":
+            self._send(200, self._stats())
+        else:
+            self._send(404, {"message": "Not found"})
+
+    def _read_body(self):
+        length = int(self.headers.getheader("Content-Length") or 0)
+        if not length:
+            return {}
+        data = self.rfile.read(length)
+        if "json" in (self.headers.getheader("Content-Type") or ""):
+            return json.loads(data)
+        return dict((k, v[-1]) for k, v in urlparse.parse_qs(data).iteritems())
+
+    def _stats(self):
+        me = self.server.member
+        leader = self.server.cluster.leader() or me
+        is_leader = leader["id"] == me["id"]
+        return {"name": me["name"],
+                "id": me["id"],
+                "state": "StateLeader" if is_leader else "StateFollower",
+                "startTime": self.server.cluster.start_time,
+                "leaderInfo": {"leader": leader["id"],
+                               "startTime": self.server.cluster.start_time}}
+
+    def _keys(self, method, key, params):
+        simulator = self.server.cluster.simulator
+        operation = {"GET": "read", "PUT": "write", "DELETE": "delete"}.get(
+            method)
+        if operation is None:
+            self._send(405, {"message": "Method not supported"})
+            return
+
+        try:
+            simulator.request(operation, key)
+            if method == "PUT":
+                response = simulator.set(
+                    key,
+                    params.get("value"),
+                    ttl=_as_int(params.get("ttl")),
+                    prevValue=params.get("prevValue"),
+                    prevIndex=_as_int(params.get("prevIndex")),
+                    prevExist=(_as_bool(params["prevExist"])
+                               if "prevExist" in params else None))
+            elif method == "DELETE":
+                response = simulator.delete(
+                    key,
+                    recursive=_as_bool(params.get("recursive")),
+                    prevValue=params.get("prevValue"),
+                    prevIndex=_as_int(params.get("prevIndex")))
+            elif _as_bool(params.get("wait")):
+                response = self._watch(simulator,
+                                       key,
+                                       _as_int(params.get("waitIndex")),
+                                       _as_bool(params.get("recursive")))
+                if response is None:
+                    return
+            else:
+                response = simulator.get(
+                    key, recursive=_as_bool(params.get("recursive")))
+        except etcd.EtcdException as e:
+            payload = e.payload if isinstance(e.payload, dict) else {}
+            if "errorCode" not in payload:
+                # Not an error etcd would return, so treat it as a network
+                # failure.
+                _log.debug("Dropping request for {}: {!r}".format(key, e))
+                self.close_connection = 1
+                return
+            self._send(ERROR_STATUSES.get(payload["errorCode"], 400),
+                       payload,
+                       index=payload.get("index"))
+            return
+
+        response = dict(response)
+        index = response.pop("etcd_index")
+        created = response["action"] == "create" or (
+            response["action"] == "set" and "prevNode" not in response)
+        self._send(201 if created else 200, response, index=index)
+
+    def _watch(self, simulator, key, index, recursive):
+        # Like etcd, this answers straight away if the change has already
+        # happened (or the history it needs has been cleared). Otherwise it
+        # sends the response headers at once, and the change as the (chunked)
+        # body when it happens - returning None, as the response has been
+        # sent. While waiting, it checks regularly whether the client has gone
+        # away or the server is stopping, and if so drops the connection.
+        if not index:
+            index = simulator.index + 1
+
+        try:
+            return simulator.watch(key,
+                                   index=index,
+                                   recursive=recursive,
+                                   timeout=self.IMMEDIATE_WATCH_TIME)
+        except etcd.EtcdWatchTimedOut:
+            pass
+
+        self._send_headers(200,
+                           "application/json",
+                           index=simulator.index,
+                           chunked=True)
+
+        while self.server.running:
+            try:
+                response = simulator.watch(key,
+                                           index=index,
+                                           recursive=recursive,
+                                           timeout=self.WATCH_POLL_INTERVAL)
+            except etcd.EtcdWatchTimedOut:
+                if self._client_gone():
+                    break
+                continue
+            except etcd.EtcdException as e:
+                # It's too late to send an error response.
+                _log.debug("Dropping watch on {}: {!r}".format(key, e))
+                break
+
+            response = dict(response)
+            del response["etcd_index"]
+            self._write_chunk(json.dumps(response, separators=(",", ":")))
+            self._write_chunk("")
+            return None
+
+        self.close_connection = 1
+        return None
+
+    def _client_gone(self):
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return (readable and
+                    self.connection.recv(1, socket.MSG_PEEK) == "")
+        except (select.error, socket.error):
+            return True
+
+    def _send(self, status, body, index=None, content_type="application/json"):
+        if body is None:
+            data = ""
+        elif content_type == "application/json":
+            data = json.dumps(body, separators=(",", ":"))
+        else:
+            data = body
+
+        self._send_headers(status, content_type, index=index, length=len(data))
+        self.wfile.write(data)
+
+    def _send_headers(self, status, content_type, index=None, length=None,
+                      chunked=False):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(length))
+        self.send_header("X-Etcd-Cluster-Id", self.server.cluster.id)
+        if index is not None:
+            self.send_header("X-Etcd-Index", str(index))
+            self.send_header("X-Raft-Index", str(index))
+            self.send_header("X-Raft-Term", "2")
+        self.end_headers()
+        self.wfile.flush()
+
+    def _write_chunk(self, data):
+        # An empty chunk ends the response.
+        self.wfile.write("{:x}\r\n{}\r\n".format(len(data), data))
+
+
+class EtcdStandInServer(EtcdServer):
+    """A drop-in replacement for EtcdServer that serves etcd's v2 API from
+    this process rather than running the etcd binary. Servers created with
+    an existing server's IP join its cluster, sharing its key space.
+
+    The server listens on port 4000 like etcd, so each one needs its own
+    IP - any of 127.0.0.0/8 works on Linux without configuring aliases."""
+
+    # The stand-in servers running in this process, by IP.
+    servers = {}
+
+    def __init__(self, ip, datadir=None, existing=None, actually_start=True):
+        self._ip = ip
+        self._existing = existing
+        self._name = ip.replace(".", "-")
+        self._datadir = None
+        self._id = None
+        self._http_server = None
+        if existing is not None:
+            self._cluster = EtcdStandInServer.servers[existing]._cluster
+        else:
+            self._cluster = StandInCluster()
+        self.start_process(actually_start)
+
+    @property
+    def simulator(self):
+        return self._cluster.simulator
+
+    def start_process(self, actually_start=True):
+        # There's no process and no data directory - just start serving.
+        self._cmd = None
+        self._subprocess = None
+        if not actually_start:
+            return
+
+        self._http_server = StandInHTTPServer((self._ip, 4000),
+                                              self._cluster,
+                                              self._name)
+        self._id = self._http_server.member["id"]
+        self._thread = Thread(target=self._http_server.serve_forever,
+                              name="etcd-stand-in-{}".format(self._ip))
+        self._thread.daemon = True
+        self._thread.start()
+        EtcdStandInServer.servers[self._ip] = self
+
+    def recover(self):
+        if self._http_server is None:
+            self.start_process()
+
+    def exit(self):
+        if getattr(self, "_http_server", None) is not None:
+            self._cluster.remove_member(self._id)
+            self._http_server.stop()
+            self._http_server = None
+            EtcdStandInServer.servers.pop(self._ip, None)
+
+    # A stand-in server has nothing to lose by crashing.
+    crash = exit
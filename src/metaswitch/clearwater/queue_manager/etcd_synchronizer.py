@@ -7,14 +7,16 @@
 # Otherwise no rights are granted except for those provided to you by
 # Metaswitch Networks in a separate written agreement.
 
-import json
-from time import sleep
-from concurrent import futures
-from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import CommonEtcdSynchronizer
+from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import \
+    CommonEtcdSynchronizer, ReadConsistency
 from queue_fsm import QueueFSM
 import logging
+from threading import Event
 from etcd import EtcdAlreadyExist
 from queue_config import QueueConfig
+from metaswitch.clearwater.etcd_shared.value_cache import \
+    value_cache, thaw, encode
+from metaswitch.clearwater.etcd_shared.value_log import ValueSummary
 
 _log = logging.getLogger(__name__)
 
@@ -26,9 +28,8 @@ class WriteToEtcdStatus:
 class EtcdSynchronizer(CommonEtcdSynchronizer):
     def __init__(self, plugin, ip, site, key, node_type, etcd_ip=None):
         super(EtcdSynchronizer, self).__init__(plugin, ip, etcd_ip)
-        self.WAIT_FOR_TIMER_POP = 1
         self._id = ip + "-" + node_type
-        self._stop_timer_thread = False
+        self._timer_popped = Event()
         self._fsm = QueueFSM(self._plugin, self._id, self.fsm_timer_expired)
         self._site = site
         self._key = key
@@ -50,93 +51,110 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
             etcd_result = None
             self._abort_read = False
 
-            executor = self.ThreadPoolExecutorWithExceptionHandler(2)
-            fsm_timer_future = executor.submit(self.wait_for_fsm)
-            etcd_future = executor.submit(self.update_from_etcd)
-            futures.wait([etcd_future, fsm_timer_future], return_when=futures.FIRST_COMPLETED)
-
-            # At this point, the executor has returned. This is either
-            # because the timer has popped, or etcd has detected a
-            # change to the underlying key. We firstly check whether the
-            # terminate flag has been set, and then check which future is
-            # marked as done (making sure that the other thread terminates by
-            # setting the appropriate flags for each future)
+            # Wait for etcd on this thread. If the FSM's timer pops (on the
+            # shared event loop) it aborts the read, so we don't need a
+            # thread of our own waiting for it.
+            if not self._timer_popped.is_set():
+                etcd_result = self.update_from_etcd()
+
+            # At this point, either the timer has popped, or etcd has
+            # detected a change to the underlying key. We firstly check
+            # whether the terminate flag has been set.
             if self._terminate_flag:
-                executor.shutdown(wait=False)
                 break
 
-            if fsm_timer_future.done():
-                self._abort_read = True
-                self._stop_timer_thread = False
+            if self._timer_popped.is_set():
+                self._timer_popped.clear()
                 self.fsm_loop()
-            elif etcd_future.done():
-                self._stop_timer_thread = True
-                etcd_result = etcd_future.result()
-
-                if etcd_result is not None:
-                    _log.info("Got new queue config %s from etcd" % etcd_result)
-                    self.fsm_loop(etcd_result)
-                else: #pragma: no cover
-                    _log.warning("read_from_etcd returned None, " +
-                                 "indicating a failure to get data from etcd")
-
-            executor.shutdown()
+            elif etcd_result is not None:
+                _log.info("Got new queue config (%s) from etcd",
+                          ValueSummary(self.key(), self._index, etcd_result))
+                self._full_value_log.log(self.key(), self._index, etcd_result)
+                self.fsm_loop(etcd_result)
+            else: #pragma: no cover
+                _log.warning("read_from_etcd returned None, " +
+                             "indicating a failure to get data from etcd")
 
         _log.info("Quitting FSM")
         self._fsm.quit()
 
     def fsm_timer_expired(self):
-        self._stop_timer_thread = True;
-
-    def wait_for_fsm(self):
-        while not self._stop_timer_thread and not self._terminate_flag:
-            sleep(self.WAIT_FOR_TIMER_POP)
+        self._timer_popped.set()
+        self._abort_read = True
+        self.wake_watch()
 
     def fsm_loop(self, etcd_value=None): # Change to add helper message
-        queue_config = {}
+        # The parsed value we started from, if it's the one in etcd. Each
+        # revision of the value is only parsed once, however many times we
+        # go round this loop with it.
+        current_config = None
 
         try:
             if etcd_value is None:
                 if self._last_value is None: # pragma: no cover
-                    queue_config = json.loads(self.default_value())
+                    queue_config = value_cache.decode(None,
+                                                      None,
+                                                      self.default_value())
                 else:
-                    queue_config = json.loads(self._last_value)
+                    queue_config = value_cache.decode(self.key(),
+                                                      self._index,
+                                                      self._last_value)
+                    current_config = queue_config
             else:
-                queue_config = json.loads(etcd_value)
+                queue_config = value_cache.decode(self.key(),
+                                                  self._index,
+                                                  etcd_value)
+                if etcd_value == self._last_value:
+                    current_config = queue_config
         except Exception: # pragma: no cover
-            queue_config = json.loads(self.default_value())
+            queue_config = value_cache.decode(None, None, self.default_value())
 
+        queue_config = thaw(queue_config)
         self._fsm.fsm_update(queue_config)
-        etcd_updated_value = json.dumps(queue_config)
 
         # If we have a new state, try and write it to etcd.
-        if etcd_updated_value != self._last_value:
+        if queue_config != current_config:
             _log.debug("Writing updated queue config to etcd")
-            self.write_to_etcd(etcd_updated_value)
+            self.write_to_etcd(encode(queue_config))
 
     # Write the new cluster view to etcd. We may be expecting to create the key
-    # for the first time.
-    def write_to_etcd(self, queue_config, with_index=None):
+    # for the first time. If the write fails, the FSM's state is reset so that
+    # it's re-run from the next value we read - but only if restart_fsm is set
+    # (i.e. we're on the main loop's thread, which owns that state).
+    def write_to_etcd(self, queue_config, with_index=None, restart_fsm=True):
         index = with_index or self._index
-        _log.info("Writing state {} into etcd with index {}"
-                   .format(queue_config, self._index))
+        _log.info("Writing state (%s) into etcd with index %s",
+                  ValueSummary(self.key(), None, queue_config), index)
+        self._full_value_log.log(self.key(), index, queue_config)
         rc = WriteToEtcdStatus.SUCCESS
 
         try:
-            if index:
-                self._client.write(self.key(), queue_config, prevIndex=index)
-            else: # pragma: no cover
-                self._client.write(self.key(), queue_config, prevExist=False)
+            self._retry_policy.check()
+            with self._metrics.histogram("etcd_write_seconds").time():
+                if index:
+                    result = self._client.write(self.key(),
+                                                queue_config,
+                                                prevIndex=index)
+                else: # pragma: no cover
+                    result = self._client.write(self.key(),
+                                                queue_config,
+                                                prevExist=False)
+            self._retry_policy.succeeded()
+            self.record_write(queue_config, result)
         except (EtcdAlreadyExist, ValueError): # pragma: no cover
+            self._metrics.counter("etcd_write_contention").inc()
             _log.debug("Contention on etcd write")
+            self._retry_policy.succeeded()
             # Our etcd write failed because someone got there before us. We
             # don't need to retry in this case as we'll just pick up the
             # changes in the next etcd read
-            self._last_value, self._last_index, self._fsm._last_local_state = None, None, None
+            if restart_fsm:
+                self._last_value, self._last_index, self._fsm._last_local_state = None, None, None
             rc = WriteToEtcdStatus.CONTENTION
         except Exception as e: #pragma: no cover
             # Catch-all error handler (for invalid requests, timeouts, etc) -
             # unset our state and start over.
+            self._metrics.counter("etcd_write_errors").inc()
             _log.error("{} caught {!r} when trying to write {} with index {}"
                        " - pause before retrying"
                        .format(self._ip, e, queue_config, self._index))
@@ -145,25 +163,48 @@ class EtcdSynchronizer(CommonEtcdSynchronizer):
             # read from etcd will trigger the state machine, which will mean
             # that any necessary work/state changes get retried.
             # Sleep briefly to avoid hammering a failed server
-            self._last_value, self._last_index, self._fsm._last_local_state = None, None, None
-            self.pause()
+            if restart_fsm:
+                self._last_value, self._last_index, self._fsm._last_local_state = None, None, None
+            self.pause(e)
             rc = WriteToEtcdStatus.ERROR
 
         return rc
 
     def edit_queue_config(self, function, *args, **kwargs):
+        # Start from our cached copy of the queue if the watch shows it's still
+        # current. If it turns out to be stale the write fails, so try again
+        # with a quorum read.
+        #
+        # This runs on the caller's thread, so leaves the main loop's state
+        # alone if a write fails - if someone else has changed the queue, the
+        # main loop will see that change anyway.
+        rc = self._edit_queue_config(ReadConsistency.CACHED,
+                                     function,
+                                     *args,
+                                     **kwargs)
+        if rc == WriteToEtcdStatus.CONTENTION:
+            rc = self._edit_queue_config(ReadConsistency.QUORUM,
+                                         function,
+                                         *args,
+                                         **kwargs)
+        return rc
+
+    def _edit_queue_config(self, consistency, function, *args, **kwargs):
         # Get and parse the current value
-        etcd_result, idx = self.read_from_etcd(wait=False)
+        etcd_result, idx = self.read_from_etcd(wait=False,
+                                               consistency=consistency)
         if etcd_result is None: #pragma: no cover
             return WriteToEtcdStatus.ERROR
 
-        queue_config = QueueConfig(self._id, json.loads(etcd_result))
+        current_config = value_cache.decode(self.key(), idx, etcd_result)
+        queue_config = QueueConfig(self._id, thaw(current_config))
         function(queue_config, *args, **kwargs)
-        # If the JSON changed, write it back to etcd
-        updated_etcd_result = json.dumps(queue_config.get_value())
 
-        if updated_etcd_result != etcd_result:
-            return self.write_to_etcd(updated_etcd_result, idx)
+        # If the value changed, write it back to etcd
+        if queue_config.get_value() != current_config:
+            return self.write_to_etcd(encode(queue_config.get_value()),
+                                      idx,
+                                      restart_fsm=False)
         else: #pragma: no cover
             return WriteToEtcdStatus.SUCCESS
 
@@ -12,7 +12,7 @@
 Usage:
   main.py --local-ip=IP --local-site=SITE --etcd-key=KEY --node-type=TYPE
           [--foreground] [--log-level=LVL] [--log-directory=DIR] [--pidfile=FILE]
-          [--wait-plugin-complete=RESP]
+          [--wait-plugin-complete=RESP] [--etcd-api=VERSION] [--etcd-endpoints=MODE]
 
 Options:
   -h --help                      Show this screen.
@@ -25,6 +25,8 @@ Options:
   --log-directory=DIR            Directory to log to [default: ./]
   --pidfile=FILE                 Pidfile to write [default: ./config-manager.pid]
   --wait-plugin-complete=RESP    Whether to wait for plugin responses
+  --etcd-api=VERSION             Etcd API to use, v2 or v3 [default: v2]
+  --etcd-endpoints=MODE          Etcd members to use: local, cluster, hedged or leader [default: local]
 
 """
 
@@ -32,6 +34,9 @@ from docopt import docopt, DocoptExit
 
 from metaswitch.common import logging_config, utils
 from metaswitch.clearwater.etcd_shared.plugin_loader import load_plugins_in_dir
+from metaswitch.clearwater.etcd_shared.metrics import export_stats_file
+from metaswitch.clearwater.etcd_shared.common_etcd_synchronizer import \
+    shutdown_time
 from metaswitch.clearwater.queue_manager.plugin_base import PluginParams
 from metaswitch.clearwater.queue_manager.etcd_synchronizer \
     import EtcdSynchronizer
@@ -68,6 +73,8 @@ def main(args):
     log_dir = arguments['--log-directory']
     log_level = LOG_LEVELS.get(arguments['--log-level'], logging.DEBUG)
     wait_plugin_complete = arguments['--wait-plugin-complete']
+    EtcdSynchronizer.ETCD_API = arguments['--etcd-api']
+    EtcdSynchronizer.ETCD_ENDPOINTS = arguments['--etcd-endpoints']
 
     stdout_err_log = os.path.join(log_dir, "queue-manager.output.log")
 
@@ -97,6 +104,9 @@ def main(args):
         # We failed to take the lock - another process is already running
         exit(1)
 
+    # Periodically write out performance metrics alongside the pidfile.
+    export_stats_file(arguments['--pidfile'])
+
     plugins_dir = "/usr/share/clearwater/clearwater-queue-manager/plugins/"
     plugins = load_plugins_in_dir(plugins_dir,
                                   PluginParams(wait_plugin_complete=wait_plugin_complete))
@@ -126,8 +136,9 @@ def main(args):
                 thr.join(1)
 
     while not utils.should_quit:
-        sleep(1)
+        sleep(0.1)
 
     _log.info("Clearwater Queue Manager shutting down")
-    pdlogs.EXITING.log()
+    pdlogs.EXITING.log(
+        shutdown_time="{:.3f}".format(shutdown_time(synchronizers)))
     syslog.closelog()
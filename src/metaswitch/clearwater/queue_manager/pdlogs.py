@@ -17,7 +17,7 @@ STARTUP = PDLog(
 EXITING = PDLog(
     number=PDLog.CL_QUEUE_MGR_ID+2,
     desc="clearwater-queue-manager is exiting.",
-    cause="The application is exiting.",
+    cause="The application is exiting. Stopping it took {shutdown_time} seconds.",
     effect="Configuration synchronization services are no longer available.",
     action="This occurs normally when the application is stopped. Wait for monit "+\
       "to restart the application.",
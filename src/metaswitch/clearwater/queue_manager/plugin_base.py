@@ -39,3 +39,9 @@ class QueuePluginBase(object): # pragma : no cover
         """This hook is called when the node is at the front of the
         queue."""
         pass
+
+    def coalescing_window(self):
+        """How long (in seconds) to wait for further changes to the queue
+        before acting on a change, or None to use the queue manager's
+        default."""
+        return None
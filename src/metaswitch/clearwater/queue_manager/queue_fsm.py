@@ -9,6 +9,8 @@ import constants
 from queue_config import QueueConfig
 from alarms import QueueAlarm
 from timers import QueueTimer
+from time import time
+from metaswitch.clearwater.etcd_shared.metrics import metrics
 import logging
 
 _log = logging.getLogger("queue_manager.queue_fsm")
@@ -29,6 +31,11 @@ class QueueFSM(object):
 
         self._last_local_state = None
 
+        # The local state we're timing, and when we entered it. This is kept
+        # separately from _last_local_state, which is reset on etcd errors.
+        self._timed_local_state = None
+        self._timed_local_state_entered = None
+
         # List of functions when in each local state. All the functions get
         # called, even if they change the local state
         self._local_fsm = {constants.LS_NO_QUEUE: [self._local_alarm.clear],
@@ -37,7 +44,7 @@ class QueueFSM(object):
                                                          self.move_to_processing],
                            constants.LS_PROCESSING: [self._local_alarm.minor,
                                                      self._set_timer_with_id,
-                                                     self._plugin.at_front_of_queue],
+                                                     self._at_front_of_queue],
                            constants.LS_WAITING_ON_OTHER_NODE: [self._local_alarm.clear,
                                                                 self._set_timer_with_current_node_id],
                            constants.LS_WAITING_ON_OTHER_NODE_ERROR: [self._local_alarm.critical,
@@ -58,6 +65,26 @@ class QueueFSM(object):
     def is_running(self):
         return self._running
 
+    def _at_front_of_queue(self):
+        with metrics.histogram("plugin_hook_seconds",
+                               plugin=self._plugin.__class__.__name__,
+                               hook="at_front_of_queue").time():
+            self._plugin.at_front_of_queue()
+
+    def _track_local_state(self, local_state):
+        # Record how long this node spent in its previous local state
+        if local_state == self._timed_local_state:
+            return
+
+        now = time()
+        if self._timed_local_state is not None:
+            metrics.histogram("fsm_state_seconds",
+                              plugin=self._plugin.__class__.__name__,
+                              state=self._timed_local_state).observe(
+                                  now - self._timed_local_state_entered)
+        self._timed_local_state = local_state
+        self._timed_local_state_entered = now
+
     def move_to_processing(self):
         self._queue_config.move_to_processing()
 
@@ -95,6 +122,7 @@ class QueueFSM(object):
         # Now, check the local state and perform any appropriate actions
         local_queue_state = self._queue_config.calculate_local_state()
         _log.debug("Local state is {}".format(local_queue_state))
+        self._track_local_state(local_queue_state)
 
         if (local_queue_state != constants.LS_PROCESSING) or (local_queue_state != self._last_local_state):
             for local_state_action in self._local_fsm[local_queue_state]:
@@ -18,7 +18,8 @@ import json
 alarms_patch = patch("metaswitch.clearwater.queue_manager.alarms.alarm_manager")
 
 class AddToQueueTest(BaseQueueTest):
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def setUp(self):
         alarms_patch.start()
         self._p = TestPlugin()
@@ -38,7 +39,8 @@ class AddToQueueTest(BaseQueueTest):
             print "Failed to successfully add the node to the queue"
 
     # Test that adding to an empty queue simply adds the new node to the QUEUED array
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_add_to_empty_queue(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": []}")
         self.add_to_queue()
@@ -50,7 +52,8 @@ class AddToQueueTest(BaseQueueTest):
         self.assertEqual("10.0.0.1-node", val.get("QUEUED")[0]["ID"])
 
     # Test that adding a node when its already in the queue in the processing state adds the new node to the QUEUED array
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_add_to_queue_already_processing(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"PROCESSING\"}]}")
         self.add_to_queue()
@@ -64,7 +67,8 @@ class AddToQueueTest(BaseQueueTest):
         self.assertEqual("QUEUED", val.get("QUEUED")[1]["STATUS"])
 
     # Test that adding a node when its already in the queue in the queued state doesn't add the new node to the QUEUED array
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_add_to_queue_already_queued(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"PROCESSING\"}, {\"ID\":\"10.0.0.1-node\",\"STATUS\":\"QUEUED\"}]}")
         self.add_to_queue()
@@ -78,7 +82,8 @@ class AddToQueueTest(BaseQueueTest):
         self.assertEqual("QUEUED", val.get("QUEUED")[1]["STATUS"])
 
     # Test that adding a node when its not already in the queue in the queued state adds the node (with more nodes in the queue already)
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_add_to_queue_with_other_nodes_and_already_queued(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"PROCESSING\"}, {\"ID\":\"10.0.0.2-node\",\"STATUS\":\"QUEUED\"}]}")
         self.add_to_queue()
@@ -94,7 +99,8 @@ class AddToQueueTest(BaseQueueTest):
         self.assertEqual("QUEUED", val.get("QUEUED")[2]["STATUS"])
 
     # Test that adding the node succeeds for a non-empty queue that its not already in
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_add_to_queue_with_other_nodes(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.2-node\",\"STATUS\":\"PROCESSING\"}]}")
         self.add_to_queue()
@@ -108,7 +114,8 @@ class AddToQueueTest(BaseQueueTest):
         self.assertEqual("QUEUED", val.get("QUEUED")[1]["STATUS"])
 
     # Test that adding a node to an empty queue with an unresponsive node doesn't add the unresponsive node to the queue
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_add_to_empty_queue_and_other_node_unresponsive(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [{\"ID\":\"10.0.0.2-node\",\"STATUS\":\"UNRESPONSIVE\"}], \"COMPLETED\": [], \"QUEUED\": []}")
         self.add_to_queue()
@@ -120,7 +127,8 @@ class AddToQueueTest(BaseQueueTest):
         self.assertEqual("10.0.0.1-node", val.get("QUEUED")[0]["ID"])
 
     # Test that adding a node to an empty queue with an failed node adds the failed node to the front of the queue
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_add_to_empty_queue_and_other_node_failed(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [{\"ID\":\"10.0.0.2-node\",\"STATUS\":\"FAILURE\"}], \"COMPLETED\": [], \"QUEUED\": []}")
         self.add_to_queue()
@@ -135,7 +143,8 @@ class AddToQueueTest(BaseQueueTest):
         self.assertEqual("QUEUED", val.get("QUEUED")[1]["STATUS"])
 
     # Test that adding a node to an empty queue with this node marked as failed node only adds the node to the queue once
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_add_to_empty_queue_and_this_node_failed(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"FAILURE\"}], \"COMPLETED\": [], \"QUEUED\": []}")
         self.add_to_queue()
@@ -147,7 +156,8 @@ class AddToQueueTest(BaseQueueTest):
         self.assertEqual("10.0.0.1-node", val.get("QUEUED")[0]["ID"])
 
     # Test that adding a node when it's marked as completed removes the node from the completed list
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_add_to_queue_while_completed(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"DONE\"}], \"QUEUED\": [{\"ID\":\"10.0.0.2-node\",\"STATUS\":\"PROCESSING\"}]}")
         self.add_to_queue()
@@ -161,7 +171,8 @@ class AddToQueueTest(BaseQueueTest):
         self.assertEqual("QUEUED", val.get("QUEUED")[1]["STATUS"])
 
     # Test that adding a node that's marked as errored when it's not at the front of the queue doesn't change the errored state
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_add_to_queue_while_errored(self):
         self.set_initial_val("{\"FORCE\": true, \"ERRORED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"FAILURE\"}], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.2-node\",\"STATUS\":\"PROCESSING\"}]}")
         self.add_to_queue()
@@ -173,3 +184,28 @@ class AddToQueueTest(BaseQueueTest):
         self.assertEqual("10.0.0.2-node", val.get("QUEUED")[0]["ID"])
         self.assertEqual("10.0.0.1-node", val.get("QUEUED")[1]["ID"])
         self.assertEqual("QUEUED", val.get("QUEUED")[1]["STATUS"])
+
+    # Test that a contended edit from another thread is retried with a quorum
+    # read, without resetting the main loop's state
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
+    def test_add_to_queue_with_stale_cache(self):
+        empty_queue = "{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": []}"
+        key = "/clearwater/local/configuration/queue_test"
+        stale = self._e._client.write(key, empty_queue)
+        self._e._client.write(key, empty_queue)
+        self._e._last_value = empty_queue
+        self._e._fsm._last_local_state = "main loop state"
+        contention = self._e._metrics.counter("etcd_write_contention")
+        contended_writes = contention.value
+
+        with patch.object(self._e,
+                          "cached_read",
+                          return_value=(empty_queue, stale.modifiedIndex)):
+            self.assertEqual(WriteToEtcdStatus.SUCCESS, self._e.add_to_queue())
+
+        val = json.loads(self._e._client.read(key).value)
+        self.assertEqual("10.0.0.1-node", val.get("QUEUED")[0]["ID"])
+        self.assertEqual(contended_writes + 1, contention.value)
+        self.assertEqual(empty_queue, self._e._last_value)
+        self.assertEqual("main loop state", self._e._fsm._last_local_state)
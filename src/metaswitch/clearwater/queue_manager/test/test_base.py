@@ -9,13 +9,16 @@
 
 import unittest
 from metaswitch.clearwater.etcd_shared.test.mock_python_etcd import EtcdFactory
+from metaswitch.clearwater.etcd_shared.event_loop import stop_event_loop
+from metaswitch.clearwater.etcd_shared.watch_hub import stop_watch_hubs
 from time import sleep
 from threading import Thread
 from mock import patch
 import json
 
 class BaseQueueTest(unittest.TestCase):
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def set_initial_val(self, queue_config):
         # Write some initial data into the key and start the synchronizer
         self._e._client.write("/clearwater/local/configuration/queue_test", queue_config)
@@ -23,12 +26,17 @@ class BaseQueueTest(unittest.TestCase):
         thread.daemon=True
         thread.start()
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def tearDown(self):
         # Allow the EtcdSynchronizer to exit
         self._e._terminate_flag = True
         sleep(1)
 
+        # Stop the threads the synchronizer shares with others
+        stop_watch_hubs()
+        stop_event_loop()
+
     def wait_for_success_or_fail(self, pass_criteria):
         for x in range(10):
             val = json.loads(self._e._client.return_global_data())
@@ -18,7 +18,8 @@ import json
 alarms_patch = patch("metaswitch.clearwater.queue_manager.alarms.alarm_manager")
 
 class RemoveFromQueueFailureTest(BaseQueueTest):
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def setUp(self):
         alarms_patch.start()
         self._p = TestPlugin()
@@ -38,7 +39,8 @@ class RemoveFromQueueFailureTest(BaseQueueTest):
             print "Failed to successfully remove the node from the queue"
 
     # Tests that marking a node as failed moves it to the ERRORED list
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_remove_from_queue_after_failure(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"PROCESSING\"}]}")
         self.remove_from_queue_helper()
@@ -51,7 +53,8 @@ class RemoveFromQueueFailureTest(BaseQueueTest):
         self.assertEqual("FAILURE", val.get("ERRORED")[0]["STATUS"])
 
     # Tests that marking a node as failed but when it is also the next node in the queue doesn't set it as errored
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_remove_from_queue_after_failure_no_force(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [{\"ID\":\"10.0.0.3-node\",\"STATUS\":\"DONE\"}, {\"ID\":\"10.0.0.2-node\",\"STATUS\":\"DONE\"}], \"QUEUED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"PROCESSING\"}, {\"ID\":\"10.0.0.1-node\",\"STATUS\":\"QUEUED\"}]}")
         self.remove_from_queue_helper()
@@ -62,7 +65,8 @@ class RemoveFromQueueFailureTest(BaseQueueTest):
         self.assertEqual(0, len(val.get("QUEUED")))
 
     # Tests that marking a node as failed but when it is also the next node in the queue doesn't set it as errored
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_remove_from_queue_after_failure_force(self):
         self.set_initial_val("{\"FORCE\": true, \"ERRORED\": [{\"ID\":\"10.0.0.4-node\",\"STATUS\":\"UNRESPONSIVE\"}, {\"ID\":\"10.0.0.5-node\",\"STATUS\":\"FAILURE\"}], \"COMPLETED\": [{\"ID\":\"10.0.0.3-node\",\"STATUS\":\"DONE\"}, {\"ID\":\"10.0.0.2-node\",\"STATUS\":\"DONE\"}], \"QUEUED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"PROCESSING\"}, {\"ID\":\"10.0.0.1-node\",\"STATUS\":\"QUEUED\"}]}")
         self.remove_from_queue_helper()
@@ -72,7 +76,8 @@ class RemoveFromQueueFailureTest(BaseQueueTest):
         self.assertEqual(2, len(val.get("COMPLETED")))
         self.assertEqual(1, len(val.get("QUEUED")))
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     # Tests that marking a node as failed when it is in the queued list but not the next node does move it to the ERRORED list
     def test_remove_from_queue_after_failure_not_next_in_queue_force(self):
         self.set_initial_val("{\"FORCE\": true, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"PROCESSING\"}, {\"ID\":\"10.0.0.2-node\",\"STATUS\":\"QUEUED\"}, {\"ID\":\"10.0.0.1-node\",\"STATUS\":\"QUEUED\"}]}")
@@ -86,7 +91,8 @@ class RemoveFromQueueFailureTest(BaseQueueTest):
         self.assertEqual("FAILURE", val.get("ERRORED")[0]["STATUS"])
 
     # Tests that marking a node as failed when it isn't the front of the queue doesn't change the JSON
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_remove_from_queue_after_failure_not_front_of_queue_force(self):
         self.set_initial_val("{\"FORCE\": true, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.2-node\",\"STATUS\":\"PROCESSING\"},{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"QUEUED\"}]}")
         self.remove_from_queue_helper()
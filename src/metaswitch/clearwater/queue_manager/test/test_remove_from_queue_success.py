@@ -18,7 +18,8 @@ import json
 alarms_patch = patch("metaswitch.clearwater.queue_manager.alarms.alarm_manager")
 
 class RemoveFromQueueSuccessTest(BaseQueueTest):
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def setUp(self):
         alarms_patch.start()
         self._p = TestPlugin()
@@ -38,7 +39,8 @@ class RemoveFromQueueSuccessTest(BaseQueueTest):
             print "Failed to successfully remove the node from the queue"
 
     # Test that marking a node as successful moves it to the COMPLETED list
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_remove_from_queue_success(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"PROCESSING\"}, {\"ID\":\"10.0.0.2-node\",\"STATUS\":\"QUEUED\"}]}")
         self.remove_from_queue_helper()
@@ -51,7 +53,8 @@ class RemoveFromQueueSuccessTest(BaseQueueTest):
         self.assertEqual("DONE", val.get("COMPLETED")[0]["STATUS"])
 
     # Test that marking a node as successful when it is still in the queue doesn't move it to the COMPLETED list (but does take out the first entry)
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_remove_from_queue_success_still_in_queue(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"PROCESSING\"},{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"QUEUED\"}]}")
         self.remove_from_queue_helper()
@@ -64,7 +67,8 @@ class RemoveFromQueueSuccessTest(BaseQueueTest):
 
     # Test that calling this method when the node isn't at the front of the
     # doesn't change the queue
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def test_remove_from_queue_success_not_front_of_queue(self):
         self.set_initial_val("{\"FORCE\": false, \"ERRORED\": [{\"ID\":\"10.0.0.1-node\",\"STATUS\":\"UNRESPONSIVE\"}], \"COMPLETED\": [], \"QUEUED\": [{\"ID\":\"10.0.0.2-node\",\"STATUS\":\"PROCESSING\"}]}")
         self.remove_from_queue_helper()
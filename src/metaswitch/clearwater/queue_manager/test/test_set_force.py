@@ -18,7 +18,8 @@ import json
 alarms_patch = patch("metaswitch.clearwater.queue_manager.alarms.alarm_manager")
 
 class SetForceQueueTest(BaseQueueTest):
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def setUp(self):
         alarms_patch.start()
         self._p = TestPlugin()
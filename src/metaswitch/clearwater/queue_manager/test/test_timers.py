@@ -16,7 +16,8 @@ from .test_base import BaseQueueTest
 alarms_patch = patch("metaswitch.clearwater.queue_manager.alarms.alarm_manager")
 
 class TimersTest(BaseQueueTest):
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     def setUp(self):
         alarms_patch.start()
         self._p = TestNoTimerDelayPlugin()
@@ -36,7 +37,8 @@ class TimersTest(BaseQueueTest):
 
         self.assertTrue(self.wait_for_success_or_fail(pass_criteria))
 
-    @patch("etcd.Client", new=EtcdFactory)
+    @patch("metaswitch.clearwater.etcd_shared.common_etcd_synchronizer."
+           "EtcdV2Client", new=EtcdFactory)
     # Test that when a timer pops for another node it marks the other node as failed
     def test_other_node_timer_pop(self):
         # Write some initial data into the key
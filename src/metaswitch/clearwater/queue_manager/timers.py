@@ -8,45 +8,46 @@
 # Metaswitch Networks in a separate written agreement.
 
 import logging
-from threading import Thread, Condition
+from threading import Lock
+from metaswitch.clearwater.etcd_shared.event_loop import get_event_loop
 
 _log = logging.getLogger("queue_manager.timers")
 
 class QueueTimer(object):
+    # The timer is scheduled on the process's shared event loop rather than
+    # having a thread of its own.
     def __init__(self, f):
-        self._condition = Condition()
-        self._timer_thread = None
+        self._lock = Lock()
+        self._handle = None
         self.timer_popped = False
         self._timer_running = False
         self._delay = 1
         self.timer_id = "NO_ID"
         self._function_call = f
 
-    def set_timer(self):
-        with self._condition:
-            self._condition.wait(self._delay)
-
+    def timer_pop(self):
+        with self._lock:
             if self._timer_running:
                 # Trigger FSM
                 self.timer_popped = True
                 self._timer_running = False
+                self._handle = None
                 if self._function_call:
                     self._function_call()
 
     def set(self, tid, delay):
         self.clear()
-        self.timer_id = tid
-        self.timer_popped = False
-        self._timer_running = True
-        self._delay = delay
-        self._timer_thread = Thread(target=self.set_timer, name="Timer thread " + self.timer_id)
-        self._timer_thread.start()
+        with self._lock:
+            self.timer_id = tid
+            self.timer_popped = False
+            self._timer_running = True
+            self._delay = delay
+            self._handle = get_event_loop().call_later(delay, self.timer_pop)
 
     def clear(self):
-        if self._timer_thread is not None:
+        with self._lock:
             self._timer_running = False
-            with self._condition:
-                self._condition.notify()
-            self._timer_thread.join()
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = None
             self.timer_id = "NO_ID"
-            self._timer_thread = None